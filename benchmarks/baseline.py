@@ -0,0 +1,52 @@
+import json
+import os
+
+# Results of the benchmarks are flat JSON objects of a name and a value, where
+# a lower value is better. A result regresses, if it exceeds the baseline by
+# more than its relative tolerance and, for noisy values, by more than an
+# absolute amount.
+
+def load(path: str) -> dict[str, float] | None:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save(path: str, results: dict[str, float]) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def compare(results: dict[str, float], baseline: dict[str, float], tolerances: dict[str, float],
+            absolute: dict[str, float] | None = None) -> list[str]:
+    """Returns the results which regressed. Results without baseline are
+    skipped."""
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        tolerance = tolerances.get(name, tolerances.get('*', 0.0))
+        if value > baseline[name] * (1 + tolerance) and value - baseline[name] > (absolute or {}).get(name, 0.0):
+            regressions.append("%s %.4g exceeds baseline %.4g by more than %.0f%%" % (name, value, baseline[name], tolerance * 100))
+    return regressions
+
+def check(path: str, results: dict[str, float], update: bool, tolerances: dict[str, float],
+          absolute: dict[str, float] | None = None) -> int:
+    """Stores the results as baseline or compares them with it and returns
+    the exit code of the benchmark."""
+    if update:
+        save(path, results)
+        print("Baseline written to %s" % path)
+        return 0
+    baseline = load(path)
+    if baseline is None:
+        print("No baseline at %s, store one with --update" % path)
+        return 0
+
+    regressions = compare(results, baseline, tolerances, absolute)
+    for regression in regressions:
+        print("[FAIL] %s" % regression)
+    if len(regressions) > 0:
+        return 1
+    print("[OK] No regression against %s" % path)
+    return 0
@@ -0,0 +1,325 @@
+import os
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from typing import NamedTuple
+import configparser
+import subprocess
+import argparse
+import platform
+import tempfile
+import socket
+import signal
+import struct
+import time
+import json
+import math
+
+from pythonosc.osc_bundle_builder import OscBundleBuilder
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.udp_client import SimpleUDPClient
+
+from lib.recorder import Record, RecordKind, read_records
+from lib.stage.commands import Command
+
+# Starts rsc in the testing mode and sends OSC commands to its first stage at
+# fixed rates, like a show control does. Every command sets a remote
+# frequency, which is unique within a run, so the write of the converter it
+# caused is found in the flight recorder. The latency is the time from sending
+# the datagram until the call of the converter, which wrote the frequency,
+# returned.
+#
+# Commands are coalesced, if a newer command overtook them on the way to the
+# converter: inputs drain bursts of datagrams and the converter gets a new
+# frequency at most every 100 ms. Commands which did not reach the converter
+# and were not overtaken are dropped. The CPU usage of the main process and
+# of the runtimes is measured while the commands are sent.
+#
+# With --scheduled it also checks that a cue sent as bundle for later is
+# neither cancelled nor changed by single messages before and after its time,
+# like a fader of a show control.
+def args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='command_latency')
+    parser.add_argument('-c', '--config', default='default.conf')
+    parser.add_argument('--rates', default='5,20,100', help="Comma separated rates in Hz of the commands")
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds commands are sent at every rate")
+    parser.add_argument('--settle', type=float, default=1.0, help="Seconds to wait for the writes after the last command of a rate")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Seconds to wait for rsc to start")
+    parser.add_argument('--output', help="JSON file to write the results to")
+    parser.add_argument('--scheduled', action='store_true', help="Checks that single messages don't cancel a scheduled cue")
+    return parser.parse_args()
+
+# Remote frequencies are a fraction of the maximal frequency, which OSC sends
+# as 32 bit float
+FRACTIONS = 2000
+MATCH_TOLERANCE = 0.001
+
+def fraction(index: int) -> float:
+    return struct.unpack('f', struct.pack('f', 0.25 + (index % FRACTIONS) * 0.5 / FRACTIONS))[0]
+
+class Sent(NamedTuple):
+    time: float
+    fraction: float
+
+def free_port(kind: int) -> int:
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def write_config(config: configparser.ConfigParser, directory: str) -> tuple[str, int]:
+    """Writes the config of rsc for the harness and returns its path and the
+    OSC port. The harness runs a single stage on free ports without the
+    servers it does not need."""
+    port = free_port(socket.SOCK_DGRAM)
+    config['DEFAULT']['stages'] = '1'
+    overrides = {
+        'input': {'ip': '127.0.0.1', 'port': str(port)},
+        'websocket': {'ip': '127.0.0.1', 'port': str(free_port(socket.SOCK_STREAM))},
+        'api': {'ip': '127.0.0.1', 'port': str(free_port(socket.SOCK_STREAM))},
+        'metrics': {'port': '0'},
+        'feedback': {'destinations': ''},
+        'control': {'frequency_map': os.path.join(directory, 'frequency_map.{stage}.json')},
+        'recorder': {'path': os.path.join(directory, 'flight.rec'), 'capacity': '262144'}
+    }
+    for section, options in overrides.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for option, value in options.items():
+            config[section][option] = value
+    path = os.path.join(directory, 'rsc.conf')
+    with open(path, 'w') as f:
+        config.write(f)
+    return path, port
+
+def records(path: str, since: int) -> list[Record]:
+    # The file is created by the control runtime
+    try:
+        return list(read_records(path, since))
+    except (OSError, ValueError, struct.error):
+        return []
+
+def descendants(pid: int) -> list[int]:
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    result = []
+    pending = list(children.get(pid, []))
+    while len(pending) > 0:
+        child = pending.pop()
+        result.append(child)
+        pending += children.get(child, [])
+    return result
+
+def cpu_time(pid: int) -> float:
+    """Returns the user and system time of a process in seconds or NaN, if
+    the process is gone."""
+    try:
+        with open('/proc/%i/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return math.nan
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def cpu_times(pid: int) -> dict[int, float]:
+    return {p: cpu_time(p) for p in [pid] + descendants(pid)}
+
+def percentile(values: list[float], q: float) -> float:
+    if len(values) == 0:
+        return math.nan
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+class Harness:
+    def __init__(self, config: configparser.ConfigParser, directory: str) -> None:
+        self.max_frequency = config.getfloat('motor', 'max_frequency', fallback=40.0)
+        path, port = write_config(config, directory)
+        self.recording = config['recorder']['path']
+        self.log = open(os.path.join(directory, 'rsc.log'), 'w+')
+        self.process = subprocess.Popen([sys.executable, 'rsc.py', '--testing', '-c', path],
+            cwd=ROOT, stdout=self.log, stderr=subprocess.STDOUT)
+        self.client = SimpleUDPClient('127.0.0.1', port)
+        self.sequence = 0
+        self.index = 0
+
+    def send(self, fraction: float) -> float:
+        sent = time.time()
+        self.client.send_message('/remote', [1, fraction])
+        return sent
+
+    def written(self, since: int) -> list[Record]:
+        return [r for r in records(self.recording, since) if r.kind == RecordKind.WRITE and r.stage == 0]
+
+    def wait_ready(self, timeout: float) -> None:
+        """Sends commands until one of them reaches the converter."""
+        started = time.time()
+        while time.time() - started < timeout:
+            if self.process.poll() is not None:
+                break
+            expected = fraction(self.index) * self.max_frequency
+            self.send(fraction(self.index))
+            time.sleep(0.5)
+            if any(abs(r.values[0] - expected) < MATCH_TOLERANCE for r in self.written(0)):
+                self.index += 1
+                self.sequence = max(r.sequence for r in records(self.recording, 0)) + 1
+                return
+        self.log.seek(0)
+        raise RuntimeError("rsc did not start within %.0f s:\n%s" % (timeout, self.log.read()))
+
+    def run(self, rate: float, duration: float, settle: float) -> dict:
+        sent: list[Sent] = []
+        count = int(rate * duration)
+        cpu_before = cpu_times(self.process.pid)
+        started = time.time()
+        for i in range(count):
+            delay = started + i / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            f = fraction(self.index)
+            sent.append(Sent(self.send(f), f))
+            self.index += 1
+        elapsed = time.time() - started
+        cpu_after = cpu_times(self.process.pid)
+        time.sleep(settle)
+
+        recorded = records(self.recording, self.sequence)
+        if len(recorded) > 0:
+            self.sequence = recorded[-1].sequence + 1
+        return self.analyze(sent, recorded) | {
+            "rate": rate,
+            "cpu": self.cpu(cpu_before, cpu_after, elapsed)
+        }
+
+    def analyze(self, sent: list[Sent], recorded: list[Record]) -> dict:
+        writes = [r for r in recorded if r.kind == RecordKind.WRITE and r.stage == 0]
+        arrived = [r.values[4] for r in recorded if r.kind == RecordKind.COMMAND and r.stage == 0 and
+            r.values[0] == Command.Action.REMOTE.value]
+        latencies: list[float] = []
+        written = [False] * len(sent)
+        for i, command in enumerate(sent):
+            expected = command.fraction * self.max_frequency
+            for write in writes:
+                # The time after the converter call is the fourth value
+                if write.values[3] >= command.time and abs(write.values[0] - expected) < MATCH_TOLERANCE:
+                    latencies.append(write.values[3] - command.time)
+                    written[i] = True
+                    break
+
+        # Commands behind the last written one were overtaken by nothing
+        last = max((i for i, w in enumerate(written) if w), default=-1)
+        return {
+            "sent": len(sent),
+            "written": sum(written),
+            "coalesced": sum(1 for i, w in enumerate(written) if not w and i < last),
+            "dropped": sum(1 for i, w in enumerate(written) if not w and i > last),
+            "at_control": sum(1 for command in sent if any(abs(f - command.fraction) < 1e-6 for f in arrived)),
+            "latency": {
+                "p50": percentile(latencies, 50),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies, default=math.nan)
+            }
+        }
+
+    def check_scheduled(self, delay: float) -> bool:
+        """Schedules a move to an angle with a bundle and changes the speed
+        with single messages before and after the move is due. Returns if the
+        move was the only command applied since and if it was applied at its
+        time."""
+        self.client.send_message('/stop', [])
+        time.sleep(0.5)
+        recorded = records(self.recording, self.sequence)
+        if len(recorded) > 0:
+            self.sequence = recorded[-1].sequence + 1
+
+        at = time.time() + delay
+        bundle = OscBundleBuilder(at)
+        for address, value in (('/direction', 'clockwise'), ('/speed', 0.5), ('/angle', 90.0), ('/run/to_angle', None)):
+            message = OscMessageBuilder(address)
+            if value is not None:
+                message.add_arg(value)
+            bundle.add_content(message.build())
+        self.client.send(bundle.build())
+        time.sleep(delay / 2)
+        self.client.send_message('/speed', 0.3)
+        time.sleep(delay / 2 + 0.5)
+        self.client.send_message('/speed', 0.2)
+        time.sleep(0.5)
+
+        recorded = records(self.recording, self.sequence)
+        if len(recorded) > 0:
+            self.sequence = recorded[-1].sequence + 1
+        commands = [r for r in recorded if r.kind == RecordKind.COMMAND and r.stage == 0]
+        for command in commands:
+            print("  %+.3f s %s speed %.2f angle %.1f" % (command.time - at, Command.Action(int(command.values[0])).name,
+                command.values[2], command.values[3]))
+        self.client.send_message('/stop', [])
+        return len(commands) == 1 and commands[0].values[0] == Command.Action.RUN_TO_ANGLE.value and \
+            commands[0].values[2] == 0.5 and commands[0].time >= at
+
+    def cpu(self, before: dict[int, float], after: dict[int, float], elapsed: float) -> dict:
+        """CPU usage in percent of one CPU of the main process and its
+        children, which lived through the whole run."""
+        usage = {pid: (after[pid] - before[pid]) / elapsed * 100 for pid in after
+                 if pid in before and not math.isnan(after[pid] - before[pid])}
+        children = {pid: value for pid, value in usage.items() if pid != self.process.pid}
+        return {
+            "supervisor": usage.get(self.process.pid, math.nan),
+            "children": sum(children.values()),
+            "processes": children
+        }
+
+    def stop(self) -> None:
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+def print_result(result: dict) -> None:
+    latency = result["latency"]
+    cpu = result["cpu"]
+    print("Commands at %g Hz" % result["rate"])
+    print("  Sent %i, written %i, coalesced %i, dropped %i, at control %i" % (
+        result["sent"], result["written"], result["coalesced"], result["dropped"], result["at_control"]))
+    print("  Latency p50/p99/max       %6.1f/%6.1f/%6.1f ms" % (latency["p50"] * 1000, latency["p99"] * 1000, latency["max"] * 1000))
+    print("  CPU supervisor            %6.1f %%" % cpu["supervisor"])
+    print("  CPU children              %6.1f %% (%s)" % (cpu["children"],
+        ", ".join("%i %.1f %%" % (pid, value) for pid, value in sorted(cpu["processes"].items()))))
+
+if __name__ == "__main__":
+    args = args()
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    results = []
+    scheduled = True
+    with tempfile.TemporaryDirectory() as directory:
+        harness = Harness(config, directory)
+        try:
+            harness.wait_ready(args.timeout)
+            for rate in [float(r) for r in args.rates.split(',')]:
+                result = harness.run(rate, args.duration, args.settle)
+                print_result(result)
+                results.append(result)
+            if args.scheduled:
+                print("Scheduled cue with single messages before and after it")
+                scheduled = harness.check_scheduled(2.0)
+                print("  %s" % ("Applied at its time" if scheduled else "FAILED: the cue was cancelled or changed"))
+        finally:
+            harness.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=2)
+    if not scheduled:
+        sys.exit(1)
@@ -0,0 +1,197 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multiprocessing import Pipe
+from typing import Any, Type
+import configparser
+import argparse
+import tempfile
+import tracemalloc
+import time
+import gc
+
+from lib import wire
+from lib.runtime import App
+from lib.control import ControlRuntime
+from lib.telemetry import Telemetry
+from lib.tracing import TracedReadings
+from lib.sensor import Sensor
+from lib.sensor.rotation import SimulatedRotationSensor
+from lib.sensor.speed import AngularSpeedSensor
+from lib.stage.commands import Command
+from lib.stage.emergency import EmergencyStop
+from lib.stage.plant import StagePlant
+from lib.utility.clock import VirtualClock
+import baseline
+
+# Runs the loop of the control runtime of a single simulated stage in this
+# process on a virtual clock. The readings of the simulated camera are send
+# through a pipe like the sensor runtime does, but outside of the measured
+# cycle. The stage runs to a new angle every few seconds.
+#
+# Every cycle is measured twice: once for the time and once under tracemalloc
+# for the memory. The memory of a cycle is the peak of the traced memory above
+# the memory before the cycle, the retained memory is what is left after all
+# cycles. The results are compared with the baseline and the benchmark fails
+# if a value regressed by more than the tolerance.
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'control_cycle.json')
+
+def args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='control_cycle')
+    parser.add_argument('-c', '--config', default='default.conf')
+    parser.add_argument('--cycles', type=int, default=5000, help="Results are only comparable with the same number of cycles")
+    parser.add_argument('--step', type=float, default=5.0, help="Loop duration in ms")
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update', action='store_true', help="Store the results as new baseline")
+    parser.add_argument('--memory-tolerance', type=float, default=0.1, help="Allowed relative regression of the memory")
+    parser.add_argument('--time-tolerance', type=float, default=0.5, help="Allowed relative regression of the time")
+    return parser.parse_args()
+
+class BenchmarkApp(App):
+    def __init__(self, config: configparser.ConfigParser) -> None:
+        self.config = config
+        self.messages: list[Any] = []
+
+    def send(self, data: Any) -> None:
+        self.messages.append(data)
+
+    def get_config(self, section: str, option: str, t: Type = str, default: Any = None, timeout: float = 2.0) -> Any:
+        if not self.config.has_option(section, option):
+            return default
+        if t == int:
+            return self.config.getint(section, option)
+        elif t == bool:
+            return self.config.getboolean(section, option)
+        elif t == float:
+            return self.config.getfloat(section, option)
+        return self.config.get(section, option)
+
+    @property
+    def is_testing_enabled(self) -> bool:
+        return True
+
+    @property
+    def is_debug_enabled(self) -> bool:
+        return False
+
+class Bench:
+    def __init__(self, config: configparser.ConfigParser, step: float, directory: str) -> None:
+        config['control']['frequency_map'] = os.path.join(directory, 'frequency_map.{stage}.json')
+        config['recorder']['path'] = os.path.join(directory, 'flight.rec')
+        app = BenchmarkApp(config)
+        self.step = step
+        self.clock = VirtualClock(0.0)
+        self.plant = StagePlant(clock=self.clock)
+
+        commands, self.commands = Pipe()
+        values, self.values = Pipe()
+        self.runtime = ControlRuntime([commands], [values], EmergencyStop(1), Telemetry(1), app, [self.plant])
+        self.runtime.clock = self.clock
+        self.runtime.last_latency_report = self.clock.time()
+        self.runtime.setup()
+
+        self.angle_sensor = SimulatedRotationSensor(self.plant,
+            app.get_config('simulation', 'frame_rate', float, 30.0),
+            app.get_config('simulation', 'latency', int, 50) / 1000,
+            app.get_config('simulation', 'noise', float, 0.05),
+            seed=0, clock=self.clock)
+        self.speed_sensor = AngularSpeedSensor(self.angle_sensor, app.get_config('DEFAULT', 'stage_diameter', float, 4.5))
+        self.cycle = 0
+
+    def prepare(self) -> None:
+        """Everything outside of the control cycle: the time goes on, the
+        camera delivers frames and every 10 s a new angle is commanded."""
+        self.clock.advance(self.step)
+        readings: list[tuple[Sensor, float]] = []
+        angle = self.angle_sensor.measure_angle()
+        detection = self.clock.time()
+        if angle is not None:
+            readings.append((Sensor.STAGE_ABSOLUTE_ANGLE, float(angle)))
+        speed = self.speed_sensor.measure_speed()
+        if speed is not None:
+            readings.append((Sensor.STAGE_SPEED, speed))
+        if angle is not None and self.angle_sensor.last_angle_recording is not None:
+            wire.send(self.values, TracedReadings(readings, self.angle_sensor.last_angle_recording, detection, detection))
+        elif len(readings) > 0:
+            wire.send(self.values, readings)
+
+        if self.cycle % int(10 / self.step) == int(1 / self.step):
+            angle = (self.cycle * 7 // int(10 / self.step) * 97) % 360
+            wire.send(self.commands, Command(Command.Action.RUN_TO_ANGLE, Command.Direction.AUTO, 0.5, float(angle)))
+        while self.commands.poll():
+            self.commands.recv_bytes()
+        self.runtime.app.messages.clear()
+        self.cycle += 1
+
+    def stop(self) -> None:
+        self.runtime.stop()
+
+def measure_time(config: configparser.ConfigParser, cycles: int, step: float) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        bench = Bench(config, step, directory)
+        total = 0.0
+        for _ in range(cycles):
+            bench.prepare()
+            started = time.perf_counter()
+            bench.runtime.loop()
+            total += time.perf_counter() - started
+        bench.stop()
+    return total / cycles
+
+def measure_memory(config: configparser.ConfigParser, cycles: int, step: float) -> tuple[float, int, int]:
+    with tempfile.TemporaryDirectory() as directory:
+        bench = Bench(config, step, directory)
+
+        # The first cycles warm up caches and lazily created objects
+        for _ in range(cycles // 10):
+            bench.prepare()
+            bench.runtime.loop()
+
+        gc.collect()
+        tracemalloc.start()
+        total = 0
+        maximum = 0
+        retained = 0
+        for _ in range(cycles):
+            bench.prepare()
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            bench.runtime.loop()
+            after, peak = tracemalloc.get_traced_memory()
+            total += peak - before
+            maximum = max(maximum, peak - before)
+            retained += after - before
+        tracemalloc.stop()
+        bench.stop()
+    return total / cycles, maximum, retained
+
+if __name__ == "__main__":
+    args = args()
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    step = args.step / 1000
+
+    memory, memory_max, retained = measure_memory(config, args.cycles, step)
+    duration = measure_time(config, args.cycles, step)
+    results = {
+        "time_per_cycle": duration,
+        "bytes_per_cycle": memory,
+        "max_bytes_per_cycle": memory_max,
+        "retained_bytes_per_cycle": retained / args.cycles
+    }
+    print("Control cycle over %i cycles" % args.cycles)
+    print("  Time per cycle            %8.1f us" % (duration * 1e6))
+    print("  Allocated per cycle       %8.1f B (max %i B)" % (memory, memory_max))
+    print("  Retained per cycle        %8.1f B" % (retained / args.cycles))
+
+    # Small absolute changes of the memory are noise of the allocator
+    sys.exit(baseline.check(args.baseline, results, args.update, {
+        "time_per_cycle": args.time_tolerance,
+        "*": args.memory_tolerance
+    }, {
+        "bytes_per_cycle": 64,
+        "max_bytes_per_cycle": 256,
+        "retained_bytes_per_cycle": 16
+    }))
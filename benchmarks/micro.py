@@ -0,0 +1,180 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multiprocessing import Pipe
+from threading import Thread
+from types import SimpleNamespace
+from typing import Callable
+import configparser
+import argparse
+import platform
+import timeit
+import json
+import fnmatch
+
+from lib.app import App
+from lib.process import AppProxy, Message, Signals
+from lib.sensor import Sensor
+from lib.sensor.rotation import SimulatedRotationSensor
+from lib.sensor.speed import AngularSpeedSensor
+from lib.stage.commands import Command
+from lib.stage.control import StageControl
+from lib.stage.controller import StageAngleController, StageSpeedController
+from lib.stage.motor import TestConverter
+from lib.stage.plant import StagePlant
+from lib.utility.angle import Angle, angle_avg
+from lib.utility.clock import VirtualClock
+import baseline
+
+# Micro benchmarks of the building blocks of the runtimes. Every benchmark
+# creates its state once and returns a function, which is timed. The time of a
+# call is the best of many repeats, so the result is as little affected by
+# other load on the machine as possible. Functions which need time to pass
+# advance a virtual clock.
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'micro.json')
+
+def args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='micro')
+    parser.add_argument('-c', '--config', default='default.conf')
+    parser.add_argument('-k', '--filter', default='*', help="Runs only the benchmarks matching the pattern")
+    parser.add_argument('--repeat', type=int, default=25)
+    parser.add_argument('--output', help="JSON file to write the results to")
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update', action='store_true', help="Store the results as new baseline")
+    parser.add_argument('--tolerance', type=float, default=1.0, help="Allowed relative regression of the time, single calls are noisy")
+    return parser.parse_args()
+
+def angle_arithmetic(config: configparser.ConfigParser) -> Callable[[], object]:
+    a, b = Angle(350.0), Angle(20.0)
+    def run() -> object:
+        return (a + b, a - b, a.delta(b), a < b, a == b)
+    return run
+
+def angle_average(config: configparser.ConfigParser) -> Callable[[], object]:
+    angles = [Angle(355.0 + i) for i in range(11)]
+    return lambda: angle_avg(angles)
+
+def measure_speed(config: configparser.ConfigParser) -> Callable[[], object]:
+    clock = VirtualClock(0.0)
+    plant = StagePlant(clock=clock)
+    plant.configure(1 / 60, 0.8, 0.01, 10.0, 40.0, 4.5)
+    plant.command(target_frequency=20.0, running=True, forward=True)
+    angle_sensor = SimulatedRotationSensor(plant, seed=0, clock=clock)
+    speed_sensor = AngularSpeedSensor(angle_sensor, 4.5)
+    def run() -> object:
+        clock.advance(0.005)
+        angle_sensor.measure_angle()
+        return speed_sensor.measure_speed()
+    return run
+
+def angle_controller(config: configparser.ConfigParser) -> Callable[[], object]:
+    clock = VirtualClock(0.0)
+    controller = StageAngleController(
+        config.getfloat('control', 'angle_pid_kp', fallback=0.6),
+        config.getfloat('control', 'angle_pid_ki', fallback=0),
+        config.getfloat('control', 'angle_pid_kd', fallback=0),
+        clock=clock)
+    # The move is long enough to stay in the middle of the profile
+    controller(0.0)
+    controller.set_setpoint(Angle(180.0), 0.5, Command.Direction.CLOCKWISE, turns=1000)
+    state = SimpleNamespace(angle=0.0)
+    def run() -> object:
+        clock.advance(0.005)
+        state.angle = (state.angle + 0.1) % 360
+        return controller(state.angle)
+    return run
+
+def stage_control(config: configparser.ConfigParser) -> Callable[[], object]:
+    clock = VirtualClock(0.0)
+    max_frequency = config.getfloat('motor', 'max_frequency', fallback=40.0)
+    control = StageControl(TestConverter(),
+        StageAngleController(
+            config.getfloat('control', 'angle_pid_kp', fallback=0.6),
+            config.getfloat('control', 'angle_pid_ki', fallback=0),
+            config.getfloat('control', 'angle_pid_kd', fallback=0),
+            clock=clock),
+        StageSpeedController(
+            max_frequency,
+            config.getfloat('control', 'speed_pid_kp', fallback=20),
+            config.getfloat('control', 'speed_pid_ki', fallback=0.5),
+            config.getfloat('control', 'speed_pid_kd', fallback=0),
+            clock=clock),
+        max_frequency, clock)
+    control([(Sensor.STAGE_ABSOLUTE_ANGLE, 0.0), (Sensor.STAGE_SPEED, 0.0)])
+    control.set_activity(Command(Command.Action.RUN_CONTINUOUS, Command.Direction.CLOCKWISE, 0.5))
+    readings = [(Sensor.STAGE_ABSOLUTE_ANGLE, 10.0), (Sensor.STAGE_SPEED, 0.3)]
+    def run() -> object:
+        clock.advance(0.005)
+        return control(readings)
+    return run
+
+def command_equality(config: configparser.ConfigParser) -> Callable[[], object]:
+    a = Command(Command.Action.RUN_TO_ANGLE, Command.Direction.CLOCKWISE, 0.5, 90.0, turns=1)
+    b = Command(Command.Action.RUN_TO_ANGLE, Command.Direction.CLOCKWISE, 0.5, 90.0, turns=1)
+    c = Command(Command.Action.RUN_CONTINUOUS, Command.Direction.AUTO, 0.5)
+    return lambda: (a == b, a != c, c == c)
+
+def message_pipe(config: configparser.ConfigParser) -> Callable[[], object]:
+    a, b = Pipe()
+    message = Message.data_signal(('latency', 0, 1.0, 0.001, 0.002, 0.003))
+    def run() -> object:
+        message.send_on(a)
+        return Message.recv_from(b)
+    return run
+
+def get_config(config: configparser.ConfigParser) -> Callable[[], object]:
+    # The main process answers the requests of the proxy in a thread
+    app = App(False, True)
+    app._config = config
+    a, b = Pipe()
+    def answer() -> None:
+        process = SimpleNamespace(signal=a)
+        while True:
+            try:
+                msg = Message.recv_from(a)
+            except EOFError:
+                return
+            if msg.signal == Signals.CONFIG:
+                app.send_config_to(process, msg)
+    Thread(target=answer, daemon=True).start()
+    proxy = AppProxy(b)
+    return lambda: proxy.get_config('control', 'angle_pid_kp', float, 0.6)
+
+BENCHMARKS: dict[str, Callable[[configparser.ConfigParser], Callable[[], object]]] = {
+    "angle_arithmetic": angle_arithmetic,
+    "angle_avg": angle_average,
+    "measure_speed": measure_speed,
+    "angle_controller": angle_controller,
+    "stage_control": stage_control,
+    "command_equality": command_equality,
+    "message_pipe": message_pipe,
+    "get_config": get_config,
+}
+
+def measure(function: Callable[[], object], repeat: int) -> float:
+    """Returns the best time of a call in seconds. Many short repeats are
+    more likely to contain one which was not disturbed than a few long
+    ones."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    number = max(number // 10, 1)
+    return min(timer.repeat(repeat, number)) / number
+
+if __name__ == "__main__":
+    args = args()
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    results: dict[str, float] = {}
+    for name, benchmark in BENCHMARKS.items():
+        if not fnmatch.fnmatch(name, args.filter):
+            continue
+        results[name] = measure(benchmark(config), args.repeat)
+        print("%-20s %10.3f us" % (name, results[name] * 1e6))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=2)
+    sys.exit(baseline.check(args.baseline, results, args.update, {"*": args.tolerance}))
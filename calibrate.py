@@ -0,0 +1,54 @@
+from lib.stage.motor import JSLSM100Converter
+from lib.sensor.rotation import OpticalRotationSensor
+from lib.sensor.speed import AngularSpeedSensor
+from lib.stage.controller.feedforward import calibrate
+import configparser
+import argparse
+
+# Creates the frequency map of a stage, which the speed controller uses as
+# feed-forward. The converter is swept through the frequencies while the stage
+# speed is measured by the camera. Must not run alongside rsc.py.
+def args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='calibrate')
+    parser.add_argument('-c', '--config', default='default.conf')
+    parser.add_argument('-s', '--stage', type=int, default=0)
+    parser.add_argument('--min', type=float, default=2.0, help="Lowest frequency in Hz")
+    parser.add_argument('--max', type=float, help="Highest frequency in Hz, max_frequency by default")
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--settle', type=float, default=5.0, help="Seconds to wait per step")
+    parser.add_argument('--duration', type=float, default=3.0, help="Seconds to measure per step")
+    parser.add_argument('-o', '--output')
+    return parser.parse_args()
+
+def stage_config(config: configparser.ConfigParser, stage: int, section: str, option: str) -> str:
+    if stage > 0 and config.has_option("%s.%i" % (section, stage), option):
+        return config.get("%s.%i" % (section, stage), option)
+    return config.get(section, option)
+
+if __name__ == "__main__":
+    args = args()
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    max_frequency = args.max if args.max is not None else float(stage_config(config, args.stage, 'motor', 'max_frequency'))
+    frequencies = [args.min + (max_frequency - args.min) * i / max(args.steps - 1, 1) for i in range(args.steps)]
+    output = args.output or stage_config(config, args.stage, 'control', 'frequency_map').format(stage=args.stage)
+
+    motor = JSLSM100Converter(int(stage_config(config, args.stage, 'motor', 'address')),
+                              stage_config(config, args.stage, 'motor', 'port'))
+    angle_sensor = OpticalRotationSensor(int(stage_config(config, args.stage, 'sensors', 'camera_index')))
+    speed_sensor = AngularSpeedSensor(angle_sensor, config.getfloat('DEFAULT', 'stage_diameter'))
+    angle_sensor.init()
+    speed_sensor.init()
+
+    def measure_speed() -> float | None:
+        angle_sensor.measure_angle()
+        return speed_sensor.measure_speed()
+
+    try:
+        frequency_map = calibrate(motor, measure_speed, frequencies, args.settle, args.duration)
+        frequency_map.save(output)
+        print("Saved frequency map with %i points to %s" % (len(frequency_map), output))
+    finally:
+        angle_sensor.release()
@@ -0,0 +1,206 @@
+from lib.recorder import Record, RecordKind, read_records, runs
+from lib.stage.motor import FrequencyConverter
+from lib.stage.control import StageControl
+from lib.stage.controller import StageAngleController, StageSpeedController, FrequencyMap
+from lib.stage.commands import Command
+from lib.sensor import Sensor
+from lib.utility.clock import VirtualClock
+import numpy as np
+import configparser
+import argparse
+import math
+import csv
+
+# Tool for the files of the flight recorder.
+#   runs    lists the runs of the control process in the file
+#   export  writes the records of a time window to CSV or NumPy (.npy)
+#   replay  feeds the recorded readings and commands of a stage into a new
+#           StageControl on a virtual clock and compares its converter writes
+#           with the recorded ones
+# The ring holds the last runs, the window is taken from one of them, the
+# latest by default. Times of the window are seconds since its start. A
+# replay is deterministic, so the writes of two replays with different
+# controller code or config can be compared for regressions. It matches the
+# recording only roughly: the controllers start without state, so a replay
+# should start before the first command, and the PIDs skip updates within their
+# sample time, which depends on the exact time of every call.
+def args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='flight')
+    parser.add_argument('file', help="Flight recorder file")
+    parser.add_argument('--run', type=int, default=-1, help="Index of the run, negative counts from the latest one")
+    parser.add_argument('--stage', type=int, help="Only records of this stage")
+    parser.add_argument('--start', type=float, default=0.0, help="Start of the window in seconds")
+    parser.add_argument('--end', type=float, default=math.inf, help="End of the window in seconds")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('runs')
+    export = commands.add_parser('export')
+    export.add_argument('output', help="CSV or .npy file")
+    replay = commands.add_parser('replay')
+    replay.add_argument('-c', '--config', default='default.conf')
+    replay.add_argument('--step', type=float, default=5.0, help="Loop duration in ms between the recorded cycles")
+    replay.add_argument('--frequency-map', help="Frequency map of the replay instead of the configured one, '' for none")
+    replay.add_argument('--output', help="CSV file to write the replayed converter writes to")
+    return parser.parse_args()
+
+DTYPE = np.dtype([('sequence', '<u8'), ('time', '<f8'), ('kind', 'u1'), ('stage', 'u1'), ('extra', '<u2'),
+                  ('a', '<f8'), ('b', '<f8'), ('c', '<f8'), ('d', '<f8'), ('e', '<f8')])
+
+def window(recorded: list[list[Record]], run: int, stage: int | None, start: float, end: float) -> list[Record]:
+    if len(recorded) == 0:
+        return []
+    if not -len(recorded) <= run < len(recorded):
+        raise ValueError("Run %i is not in the file, it holds %i runs" % (run, len(recorded)))
+    records = recorded[run]
+    first = records[0].time
+    return [r for r in records if (stage is None or r.stage == stage) and start <= r.time - first <= end]
+
+def print_runs(recorded: list[list[Record]]) -> None:
+    print("Run  Records  Duration")
+    for i, records in enumerate(recorded):
+        print("%3i %8i %8.1f s" % (i, len(records), records[-1].time - records[0].time))
+
+def export(records: list[Record], output: str) -> None:
+    if output.endswith('.npy'):
+        np.save(output, np.array([(r.sequence, r.time, r.kind, r.stage, r.extra) + r.values for r in records], dtype=DTYPE))
+        return
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sequence', 'time', 'kind', 'stage', 'extra', 'a', 'b', 'c', 'd', 'e'])
+        for r in records:
+            writer.writerow([r.sequence, "%.6f" % r.time, r.kind.name.lower(), r.stage, r.extra] + ["%.6g" % v for v in r.values])
+
+class ReplayConverter(FrequencyConverter):
+    """Converter without hardware for a replay."""
+    def __init__(self) -> None:
+        super().__init__()
+        self.frequency = 0.0
+        self.running = False
+        self.emergency = False
+
+    def set_target_frequency(self, frequency: float) -> None:
+        self.frequency = frequency
+
+    def get_target_frequency(self) -> float:
+        return self.frequency
+
+    def get_current_frequency(self) -> float:
+        return self.frequency
+
+    def run(self, forward: bool) -> None:
+        self.running, self.emergency = True, False
+
+    def stop(self) -> None:
+        self.running = False
+
+    def emergency_stop(self) -> None:
+        self.running, self.frequency, self.emergency = False, 0.0, True
+
+    def is_emergency_stop_active(self) -> bool:
+        return self.emergency
+
+def command(record: Record) -> Command:
+    a, b, speed, angle, frequency = record.values
+    return Command(Command.Action(int(a)), Command.Direction(int(b)), speed,
+        None if math.isnan(angle) else angle, None if math.isnan(frequency) else frequency,
+        turns=record.extra)
+
+def replay(records: list[Record], config: configparser.ConfigParser, stage: int, step: float,
+           frequency_map: FrequencyMap) -> list[tuple[float, float, bool, bool]]:
+    """Replays the records of a stage and returns the converter writes as
+    (time, target frequency, running, forward) like they are recorded."""
+    def stage_config(section: str, option: str, fallback: float) -> float:
+        override = '%s.%i' % (section, stage)
+        if stage > 0 and config.has_option(override, option):
+            return config.getfloat(override, option)
+        return config.getfloat(section, option, fallback=fallback)
+
+    records = [r for r in records if r.stage == stage]
+    clock = VirtualClock(records[0].time if len(records) > 0 else 0.0)
+    stage_diameter = config.getfloat('DEFAULT', 'stage_diameter', fallback=4.5)
+    max_frequency = stage_config('motor', 'max_frequency', 40.0)
+    max_speed = config.getfloat('DEFAULT', 'max_speed', fallback=1.0)
+    writes: list[tuple[float, float, bool, bool]] = []
+    control = StageControl(ReplayConverter(),
+        StageAngleController(
+            stage_config('control', 'angle_pid_kp', 0.6),
+            stage_config('control', 'angle_pid_ki', 0),
+            stage_config('control', 'angle_pid_kd', 0),
+            stage_diameter,
+            stage_config('control', 'max_acceleration', 0.25),
+            stage_config('control', 'max_jerk', 0.5),
+            stage_config('motor', 'ramp', 10.0) * stage_config('motor', 'speed_per_hertz', 1 / 60),
+            stage_config('control', 'response_time', 2000) / 1000,
+            clock=clock),
+        StageSpeedController(
+            max_frequency,
+            stage_config('control', 'speed_pid_kp', 20),
+            stage_config('control', 'speed_pid_ki', 0.5),
+            stage_config('control', 'speed_pid_kd', 0),
+            frequency_map,
+            clock=clock),
+        max_frequency, clock)
+
+    def cycle(readings: list[tuple[Sensor, float]] | None) -> None:
+        if control(readings):
+            writes.append((clock.time(), control.target_frequency, control.motor_running, control.motor_running_forward))
+
+    # Readings of a cycle share their time. Between the cycles the loop runs
+    # without readings like the control process does.
+    i = 0
+    while i < len(records):
+        r = records[i]
+        while clock.time() + step < r.time:
+            clock.advance(step)
+            cycle(None)
+        clock.advance(r.time - clock.time())
+        if r.kind == RecordKind.COMMAND:
+            cmd = command(r)
+            cmd.speed = min(cmd.speed, max_speed)
+            control.set_activity(cmd)
+            i += 1
+        elif r.kind in (RecordKind.ANGLE, RecordKind.SPEED):
+            readings: list[tuple[Sensor, float]] = []
+            while i < len(records) and records[i].time == r.time and records[i].kind in (RecordKind.ANGLE, RecordKind.SPEED):
+                sensor = Sensor.STAGE_ABSOLUTE_ANGLE if records[i].kind == RecordKind.ANGLE else Sensor.STAGE_SPEED
+                readings.append((sensor, records[i].values[0]))
+                i += 1
+            cycle(readings)
+        else:
+            i += 1
+    return writes
+
+if __name__ == "__main__":
+    args = args()
+    recorded = runs(read_records(args.file))
+    records = window(recorded, args.run, args.stage, args.start, args.end) if args.command != 'runs' else []
+    if args.command == 'runs':
+        print_runs(recorded)
+    elif args.command == 'export':
+        export(records, args.output)
+        print("Exported %i records to %s" % (len(records), args.output))
+    else:
+        config = configparser.ConfigParser()
+        config.read(args.config)
+        stage = args.stage if args.stage is not None else 0
+        if args.frequency_map is None:
+            frequency_map = FrequencyMap.load(config.get('control', 'frequency_map', fallback='frequency_map.{stage}.json').format(stage=stage))
+        else:
+            frequency_map = FrequencyMap.load(args.frequency_map) if args.frequency_map != '' else FrequencyMap()
+        writes = replay(records, config, stage, args.step / 1000, frequency_map)
+
+        # The writes of the recording are compared in order with the replay
+        recorded = [r for r in records if r.stage == stage and r.kind == RecordKind.WRITE]
+        differences = [(abs(w[0] - r.time), abs(w[1] - r.values[0])) for w, r in zip(writes, recorded)]
+        print("Replayed %i records of stage %i" % (len(records), stage))
+        print("Converter writes: %i recorded, %i replayed" % (len(recorded), len(writes)))
+        if len(differences) > 0:
+            print("Of %i writes in order %i differ in frequency (max %.2f Hz), max time difference %.1f ms" % (
+                len(differences), sum(1 for _, df in differences if df > 0.01),
+                max(df for _, df in differences), max(dt for dt, _ in differences) * 1000))
+        if args.output is not None:
+            with open(args.output, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['time', 'frequency', 'running', 'forward'])
+                for time, frequency, running, forward in writes:
+                    writer.writerow(["%.6f" % time, "%.2f" % frequency, int(running), int(forward)])
@@ -21,7 +21,19 @@ class App:
     @property
     def is_testing_enabled(self) -> bool:
         return self._config.getboolean('DEFAULT', 'testing', fallback=False)
-    
+
+    @property
+    def stages(self) -> int:
+        return self._config.getint('DEFAULT', 'stages', fallback=1)
+
+    @property
+    def metrics_ip(self) -> str:
+        return self._config.get('metrics', 'ip', fallback='127.0.0.1')
+
+    @property
+    def metrics_port(self) -> int:
+        return self._config.getint('metrics', 'port', fallback=0)
+
     def exit(self) -> None:
         self._shutdown = True
 
@@ -1,121 +1,331 @@
 from multiprocessing.connection import Connection
 from multiprocessing import Pipe
-from typing import Tuple, cast
-from time import time
+from typing import Tuple
+import math
 
 from .process import RuntimeEnvironment, GenericProcess
+from . import wire
 from .runtime import Runtime, App
 from .sensors import Sensor, AbsoluteSensor
+from .telemetry import Telemetry
+from .tracing import LatencyTrace
+from .recorder import FlightRecorder, RecordKind
 from .view import View
+from .utility.log import log, Level
 from .stage.commands import Command
-from .stage.motor import JSLSM100Converter, TestConverter
-from .utility.angle import Angle
+from .stage.bus import ConverterBus
+from .stage.emergency import EmergencyStop, EmergencyStopWatchdog
+from .stage.plant import StagePlant
 from .stage.control import StageControl
-from .stage.controller import StageAngleController, StageSpeedController 
+from .stage.controller import StageAngleController, StageSpeedController, FrequencyMap
+
+# State of a single stage inside the control process. Every stage has its own
+# converter on the shared bus, its own sensor values and its own commands. The
+# connections are read with frame readers, so a cycle allocates (nearly)
+# nothing.
+class ControlledStage:
+    def __init__(self, index: int, control: StageControl, commands: Connection, sensor_values: Connection) -> None:
+        self.index = index
+        self.control = control
+
+        # Connections
+        self.commands = commands
+        self.sensor_values = sensor_values
+        self.command_frames = wire.FrameReader(commands)
+        self.sensor_frames = wire.FrameReader(sensor_values)
+
+        # State
+        self.last_measurement: float = control.clock.time()
+        self.last_send_command: Command | None = None
+        self.scheduled: list[Command] = []
+        self.emergency_stop_active: bool | None = None
+        self.last_converter_status: float = 0.0
+        self.latency = LatencyTrace()
+
+        # Stamps of the latest traced readings
+        self.traced: bool = False
+        self.capture: float = 0.0
+        self.detection: float = 0.0
+        self.send: float = 0.0
+        self.received: float = 0.0
 
 # The control process collects any data getting to the system. It contains
-# sensor readings and input commands.
+# sensor readings and input commands of all stages.
 class ControlRuntime(Runtime):
-    def __init__(self, cmds: Connection, asv: Connection, app: App) -> None:
+    def __init__(self, cmds: list[Connection], asv: list[Connection], emergency_stop: EmergencyStop, telemetry: Telemetry, app: App,
+                 plants: list[StagePlant] | None = None) -> None:
         super().__init__()
         self.app = app
+        self.emergency_stop = emergency_stop
+        self.telemetry = telemetry
+        self.plants = plants
 
         # Connections
         self.commands = cmds
         self.sensor_values = asv
 
         # Function classes
-        self.control: StageControl = None
+        self.bus: ConverterBus = None
+        self.stages: list[ControlledStage] = []
+        self.watchdog: EmergencyStopWatchdog = None
+        self.recorder: FlightRecorder | None = None
+        self.frequency_maps: list[str] = []
 
         # State
-        self.last_debug: float = time()
-        self.last_measurement: float = time()
-        self.last_send_command: Command | None = None
+        self.last_latency_report: float = self.clock.time()
 
     def setup(self):
-        converter = JSLSM100Converter(
-                self.app.get_config('motor', 'address', int, 1),
-                self.app.get_config('motor', 'port', str, '/dev/serial0')) \
-            if not self.app.is_testing_enabled else TestConverter()
-        
-        max_frequency = self.app.get_config('motor', 'max_frequency', float, 40.0)
-        
+        assert len(self.commands) == len(self.sensor_values), "Expect commands and sensor values for every stage"
+        self.bus = ConverterBus(
+            self.app.get_config('motor', 'port', str, '/dev/serial0'),
+            self.app.is_testing_enabled)
+        for index, (commands, sensor_values) in enumerate(zip(self.commands, self.sensor_values)):
+            self.stages.append(ControlledStage(index, self.setup_control(index), commands, sensor_values))
+
+        # Config
+        self.max_measurement_duration = self.app.get_config('control', 'max_measurement_duration', int, 100) / 1000
+        self.max_speed = self.app.get_config('DEFAULT', 'max_speed', float, 1.0)
+        self.emergency_stop_budget = self.app.get_config('control', 'emergency_stop_budget', int, 100) / 1000
+        self.converter_status_interval = self.app.get_config('control', 'converter_status_interval', int, 1000) / 1000
+        self.latency_report_interval = self.app.get_config('control', 'latency_report_interval', int, 10000) / 1000
+
+        # Everything the controllers get and do is recorded for the analysis of
+        # faults
+        recorder_path = self.app.get_config('recorder', 'path', str, '')
+        if recorder_path != '':
+            self.recorder = FlightRecorder(recorder_path, self.app.get_config('recorder', 'capacity', int, 262144))
+            self.recorder.record(RecordKind.START, 0, self.clock.time())
+
+        # Emergency stops are executed by the watchdog as soon as they are
+        # requested, even if this loop is busy.
+        self.watchdog = EmergencyStopWatchdog(self.emergency_stop, lambda stage: self.stages[stage].control.motor.emergency_stop())
+        self.watchdog.start()
+
+    def setup_control(self, stage: int) -> StageControl:
+        plant = self.setup_plant(stage) if self.plants is not None else None
+        converter = self.bus.converter(self.app.get_stage_config(stage, 'motor', 'address', int, 1), plant)
+        max_frequency = self.app.get_stage_config(stage, 'motor', 'max_frequency', float, 40.0)
+        frequency_map = self.app.get_stage_config(stage, 'control', 'frequency_map', str, 'frequency_map.{stage}.json').format(stage=stage)
+        self.frequency_maps.append(frequency_map)
+
         # Controller
         angle_controller = StageAngleController(
-            self.app.get_config('control', 'angle_pid_kp', float, 2),
-            self.app.get_config('control', 'angle_pid_ki', float, 0),
-            self.app.get_config('control', 'angle_pid_kd', float, 0))
+            self.app.get_stage_config(stage, 'control', 'angle_pid_kp', float, 0.6),
+            self.app.get_stage_config(stage, 'control', 'angle_pid_ki', float, 0),
+            self.app.get_stage_config(stage, 'control', 'angle_pid_kd', float, 0),
+            self.app.get_stage_config(stage, 'DEFAULT', 'stage_diameter', float, 4.5),
+            self.app.get_stage_config(stage, 'control', 'max_acceleration', float, 0.25),
+            self.app.get_stage_config(stage, 'control', 'max_jerk', float, 0.5),
+            self.app.get_stage_config(stage, 'motor', 'ramp', float, 10.0) *
+                self.app.get_stage_config(stage, 'motor', 'speed_per_hertz', float, 1 / 60),
+            self.app.get_stage_config(stage, 'control', 'response_time', int, 2000) / 1000,
+            clock=self.clock)
         speed_controller = StageSpeedController(
             max_frequency,
-            self.app.get_config('control', 'speed_pid_kp', float, 10),
-            self.app.get_config('control', 'speed_pid_ki', float, 10),
-            self.app.get_config('control', 'speed_pid_kd', float, 0))
-        self.control = StageControl(converter, angle_controller, speed_controller, max_frequency)
+            self.app.get_stage_config(stage, 'control', 'speed_pid_kp', float, 20),
+            self.app.get_stage_config(stage, 'control', 'speed_pid_ki', float, 0.5),
+            self.app.get_stage_config(stage, 'control', 'speed_pid_kd', float, 0),
+            FrequencyMap.load(frequency_map),
+            clock=self.clock)
+        return StageControl(converter, angle_controller, speed_controller, max_frequency, self.clock)
 
-        # Config
-        self.max_measurement_duration = self.app.get_config('control', 'max_measurement_duration', int, 100) / 1000
-        self.max_speed = self.app.get_config('DEFAULT', 'max_speed', float, 1.0)
+    def setup_plant(self, stage: int) -> StagePlant:
+        plant = self.plants[stage]
+        plant.configure(
+            self.app.get_stage_config(stage, 'simulation', 'speed_per_hertz', float, 1 / 60),
+            self.app.get_stage_config(stage, 'simulation', 'time_constant', float, 0.8),
+            self.app.get_stage_config(stage, 'simulation', 'friction', float, 0.01),
+            self.app.get_stage_config(stage, 'simulation', 'ramp', float, 10.0),
+            self.app.get_stage_config(stage, 'simulation', 'emergency_ramp', float, 40.0),
+            self.app.get_stage_config(stage, 'DEFAULT', 'stage_diameter', float, 4.5))
+        return plant
 
     def loop(self):
-        # Update sensor values
-        sensor_values: list[tuple[Sensor, float]] | None = None
-        if self.sensor_values.poll():
-            sensor_values = cast(list[tuple[Sensor, float]], self.sensor_values.recv())
-            self.last_measurement = time()
+        # Align the stage state with emergency stops done by the watchdog
+        while len(self.watchdog.handled) > 0:
+            index, latency = self.watchdog.handled.popleft()
+            self.stages[index].scheduled.clear()
+            self.set_activity(self.stages[index], Command(Command.Action.EMERGENCY_STOP))
+            if latency is not None:
+                if latency > self.emergency_stop_budget:
+                    log.warn("Control", "Emergency stop exceeded its budget", stage=index, latency_ms=latency * 1000, budget_ms=self.emergency_stop_budget * 1000)
+                self.app.send(('emergency_stop', index, latency))
+
+        # All stages share the converter bus. The stage which is served first
+        # changes every loop, so a stage is never starved by the others.
+        for stage in self.bus.schedule(self.stages):
+            self.loop_stage(stage)
+
+        # Report the latencies and the bus transactions of the last interval to
+        # the main process
+        if self.latency_report_interval > 0 and self.clock.time() - self.last_latency_report > self.latency_report_interval:
+            for stage in self.stages:
+                self.app.send(('latency', stage.index) + stage.latency.summary())
+                stage.latency.reset()
+            transactions, errors = self.bus.lock.take_statistics()
+            self.app.send(('modbus', transactions.sum, errors) + tuple(transactions.counts))
+            self.last_latency_report = self.clock.time()
+
+    def loop_stage(self, stage: ControlledStage):
+        control = stage.control
+
+        # Update sensor values. All pending values are consumed, otherwise a
+        # stage would fall behind its sensor as soon as more stages are added.
+        cycle = self.clock.time()
+        measured = self.receive_readings(stage, cycle)
 
         # Check angle update duration. If this class is missing angle updates
         # the stage rotation should be stopped immediately.
-        if time() - self.last_measurement > self.max_measurement_duration:
-            sensor_values = []
-            self.control.set_activity(Command(Command.Action.EMERGENCY_STOP))
+        if self.clock.time() - stage.last_measurement > self.max_measurement_duration:
+            stage.scheduled.clear()
+            self.set_activity(stage, Command(Command.Action.EMERGENCY_STOP))
 
-        # Update controller and send control values if testing is enabled. 
-        if self.control(sensor_values) and self.app.is_testing_enabled:
-            self.sensor_values.send(('debug', self.control.motor_running_forward, self.control.motor.get_target_frequency()))
+        # Update controller. The latest traced reading is followed until the
+        # converter write it caused.
+        written = control()
+        controlled = self.clock.time()
+        if self.recorder is not None:
+            self.record_cycle(stage, cycle, measured, written, controlled)
+        if stage.traced and control.last_output is not None and control.last_output >= stage.received:
+            stage.latency.record(stage.capture, stage.detection, stage.send, stage.received,
+                control.last_output, controlled if written else None)
+            stage.traced = False
 
-        # Update commands
-        if self.commands.poll():
-            command = self.commands.recv()
+        # Update commands. Scheduled commands are kept until their time has
+        # come. Immediate commands cancel all scheduled commands, so an older
+        # cue can't override them later.
+        frames = stage.command_frames
+        while frames.poll():
+            start, end = frames.recv()
+            command = wire.decode(frames.buffer, start, end)
             assert isinstance(command, Command), "Received non command type from the command connection"
-            if command.speed > self.max_speed:
-                command.speed = self.max_speed
-            if not self.control.set_activity(command):
-                print("[WARN] Failed to set activity")
+            if command.at is not None and command.at > self.clock.time():
+                stage.scheduled.append(command)
+                stage.scheduled.sort(key=lambda c: c.at)
             else:
-                self.last_send_command = command
+                stage.scheduled.clear()
+                self.apply_command(stage, command)
+
+        while len(stage.scheduled) > 0 and stage.scheduled[0].at <= self.clock.time():
+            self.apply_command(stage, stage.scheduled.pop(0))
 
         # Check if send command and active command are the same. Otherwise
         # notify view process.
-        if self.last_send_command != self.control.activity and self.last_send_command is not None:
-            self.commands.send(self.control.activity)
+        if stage.last_send_command != control.activity and stage.last_send_command is not None:
+            wire.send(stage.commands, control.activity)
+
+        # Converter status is read rarely, it costs bus time of all stages
+        if self.clock.time() - stage.last_converter_status > self.converter_status_interval:
+            stage.emergency_stop_active = control.motor.is_emergency_stop_active()
+            stage.last_converter_status = self.clock.time()
+
+        # Publish the latest state for readers in other processes
+        self.telemetry.write(stage.index, self.clock.time(),
+            control.angle_controller._actual_angle,
+            control.speed_controller.actual_speed,
+            control.target_frequency,
+            control.motor_running_forward,
+            control.activity,
+            stage.last_measurement,
+            stage.emergency_stop_active)
+
+    def apply_command(self, stage: ControlledStage, command: Command):
+        if command.speed > self.max_speed:
+            command.speed = self.max_speed
+        if not self.set_activity(stage, command):
+            log.every(1.0, Level.WARN, "Control", "Failed to set activity", stage=stage.index, action=command.action.name)
+        else:
+            stage.last_send_command = command
 
-        # Update debug
-        if self.app.is_debug_enabled and time() - self.last_debug > 0.2:
-            if self.control.angle_controller._actual_angle is not None and \
-                self.control.speed_controller.frequency is not None:
-                self.app.send((self.control.angle_controller._actual_angle, self.control.speed_controller.frequency))
-                self.last_debug = time()
+    def set_activity(self, stage: ControlledStage, command: Command) -> bool:
+        if self.recorder is not None:
+            self.recorder.record(RecordKind.COMMAND, stage.index, self.clock.time(),
+                command.action.value, command.direction.value, command.speed,
+                command.angle if command.angle is not None else math.nan,
+                command.frequency if command.frequency is not None else math.nan,
+                command.turns)
+        return stage.control.set_activity(command)
+
+    def receive_readings(self, stage: ControlledStage, cycle: float) -> bool:
+        """Passes all pending readings to the controllers and returns if there
+        were any. The readings are read from the buffer of the frame reader
+        without decoding them into lists."""
+        frames = stage.sensor_frames
+        buffer = frames.buffer
+        measured = False
+        while frames.poll():
+            start, end = frames.recv()
+            stage.last_measurement = self.clock.time()
+            count, offset = wire.readings(buffer, start)
+            while count > 0:
+                sensor, value = wire.READING.unpack_from(buffer, offset)
+                sensor = wire.sensor(sensor)
+                stage.control.measure(sensor, value)
+                if self.recorder is not None:
+                    # Everything is recorded with the time the cycle started
+                    self.recorder.record(RecordKind.ANGLE if sensor == Sensor.STAGE_ABSOLUTE_ANGLE else RecordKind.SPEED,
+                        stage.index, cycle, value)
+                offset += wire.READING.size
+                count -= 1
+                measured = True
+            if wire.kind(buffer, start) == wire.Kinds.TRACED:
+                stage.capture, stage.detection, stage.send = wire.STAMPS.unpack_from(buffer, offset)
+                stage.received = stage.last_measurement
+                stage.traced = True
+        return measured
+
+    def record_cycle(self, stage: ControlledStage, now: float, measured: bool, written: bool, controlled: float):
+        # Everything is recorded with the time the cycle started. Writes also
+        # keep the time the converter call returned.
+        control = stage.control
+        if measured:
+            self.recorder.record(RecordKind.OUTPUT, stage.index, now,
+                control.angle_controller.speed if control.angle_controller.speed is not None else math.nan,
+                control.speed_controller.frequency if control.speed_controller.frequency is not None else math.nan,
+                control.speed_controller.actual_speed if control.speed_controller.actual_speed is not None else math.nan)
+        if written:
+            self.recorder.record(RecordKind.WRITE, stage.index, now,
+                control.target_frequency, float(control.motor_running), float(control.motor_running_forward), controlled)
 
     def stop(self) -> int | None:
-        try:
-            self.control.motor.set_target_frequency(0)
-            self.control.motor.stop()
-        except:
-            return 1
+        self.watchdog.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        returncode = None
+        for stage in self.stages:
+            try:
+                stage.control.motor.set_target_frequency(0)
+                stage.control.motor.stop()
+            except:
+                returncode = 1
+
+            # Keep what was learned about the stage for the next run
+            try:
+                stage.control.speed_controller.frequency_map.save(self.frequency_maps[stage.index])
+            except OSError as e:
+                log.warn("Control", "Failed to save frequency map", stage=stage.index, error=e)
+        return returncode
 
 class Control(GenericProcess):
-    def __init__(self, view: View, absolute_sensor: AbsoluteSensor) -> None:
+    def __init__(self, views: list[View], absolute_sensors: list[AbsoluteSensor], emergency_stop: EmergencyStop, telemetry: Telemetry,
+                 plants: list[StagePlant] | None = None) -> None:
         super().__init__()
-        self.view = view
-        self.absolute_sensor = absolute_sensor
-        self.depends(view)
-        self.depends(absolute_sensor)
+        self.emergency_stop = emergency_stop
+        self.telemetry = telemetry
+        self.plants = plants
+        self.views = views
+        self.absolute_sensors = absolute_sensors
+        [self.depends(view) for view in views]
+        [self.depends(absolute_sensor) for absolute_sensor in absolute_sensors]
 
     def init(self) -> Tuple[RuntimeEnvironment, Connection]:
         signal, runtime_signal = Pipe()
         kwargs = {
-            "asv": self.absolute_sensor.values,
-            "cmds": self.view.commands
+            "asv": [absolute_sensor.values for absolute_sensor in self.absolute_sensors],
+            "cmds": [view.commands for view in self.views],
+            "emergency_stop": self.emergency_stop,
+            "telemetry": self.telemetry,
+            "plants": self.plants
         }
         return RuntimeEnvironment(ControlRuntime, runtime_signal, kwargs=kwargs), signal
 
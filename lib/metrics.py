@@ -0,0 +1,172 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from typing import Any
+import math
+
+Labels = tuple[tuple[str, str], ...]
+
+def labels(**kwargs: Any) -> Labels:
+    """Returns the labels of a sample. Labels which are None are left out."""
+    return tuple((name, str(value)) for name, value in kwargs.items() if value is not None)
+
+def _format_labels(l: Labels) -> str:
+    if len(l) == 0:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"')) for name, value in l)
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    elif math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+# Metrics of all runtimes, aggregated by the main process from the reports of
+# the child processes. Counters and histograms are cumulative, the reports
+# contain the values of their window only. The exposition in the Prometheus
+# text format is rendered by the main loop, whenever it is due, into a
+# snapshot. Scrapes are answered with the snapshot only.
+class Metrics:
+    def __init__(self) -> None:
+        self._families: dict[str, tuple[str, str]] = {}
+        self._samples: dict[str, dict[Labels, Any]] = {}
+        self.snapshot: bytes = b''
+        self.changed = False
+
+    def declare(self, name: str, kind: str, help: str) -> None:
+        """Declares a metric family of the kind counter, gauge or histogram."""
+        self._families[name] = (kind, help)
+        self._samples[name] = {}
+
+    def set(self, name: str, l: Labels, value: float) -> None:
+        self._samples[name][l] = value
+        self.changed = True
+
+    def inc(self, name: str, l: Labels, value: float = 1.0) -> None:
+        samples = self._samples[name]
+        samples[l] = samples.get(l, 0.0) + value
+        self.changed = True
+
+    def observe(self, name: str, l: Labels, bounds: list[float], counts: list[int], total: float) -> None:
+        """Adds the bucket counts of a fixed-bucket histogram. The last count
+        is the overflow bucket."""
+        samples = self._samples[name]
+        if l not in samples:
+            samples[l] = (list(bounds), [0] * len(counts), 0.0)
+        known_bounds, known_counts, known_total = samples[l]
+        assert known_bounds == list(bounds), "Buckets of %s changed" % name
+        for i, count in enumerate(counts):
+            known_counts[i] += count
+        samples[l] = (known_bounds, known_counts, known_total + total)
+        self.changed = True
+
+    def render(self) -> bytes:
+        lines: list[str] = []
+        for name, (kind, help) in self._families.items():
+            samples = self._samples[name]
+            if len(samples) == 0:
+                continue
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for l, value in samples.items():
+                if kind == "histogram":
+                    bounds, counts, total = value
+                    cumulative = 0
+                    for bound, count in zip(bounds + [math.inf], counts):
+                        cumulative += count
+                        lines.append("%s_bucket%s %i" % (name, _format_labels(l + (("le", _format_value(bound)),)), cumulative))
+                    lines.append("%s_sum%s %s" % (name, _format_labels(l), _format_value(total)))
+                    lines.append("%s_count%s %i" % (name, _format_labels(l), cumulative))
+                else:
+                    lines.append("%s%s %s" % (name, _format_labels(l), _format_value(value)))
+        self.snapshot = ("\n".join(lines) + "\n").encode()
+        self.changed = False
+        return self.snapshot
+
+class MetricsServer:
+    """Local HTTP endpoint, which answers GET /metrics with the latest
+    snapshot of the metrics."""
+    def __init__(self, metrics: Metrics, ip: str = "127.0.0.1", port: int = 9464) -> None:
+        self.metrics = metrics
+        self.http = ThreadingHTTPServer((ip, port), MetricsRequestHandler)
+        self.http.daemon_threads = True
+        setattr(self.http, 'metrics', metrics)
+        self._thread: Thread | None = None
+
+    def start(self) -> None:
+        self._thread = Thread(target=self.http.serve_forever, name="MetricsServer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self.http.shutdown()
+            self._thread.join(1.0)
+        self.http.server_close()
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = getattr(self.server, 'metrics').snapshot
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+# Metrics of rsc. Every runtime is labeled with its process and the stage it
+# belongs to, if it belongs to a single stage.
+class StageMetrics(Metrics):
+    def __init__(self) -> None:
+        super().__init__()
+        self.declare("rsc_runtime_iterations_total", "counter", "Iterations of the runtime loop")
+        self.declare("rsc_runtime_loop_rate", "gauge", "Iterations per second of the runtime loop in the last report")
+        self.declare("rsc_runtime_sleep_ratio", "gauge", "Share of the time the runtime loop slept in the last report")
+        self.declare("rsc_runtime_loop_duration_seconds", "histogram", "Duration of the runtime loop")
+        self.declare("rsc_runtime_cycle_lateness_seconds", "histogram", "Time a cycle of the runtime loop took longer than its minimum duration")
+        self.declare("rsc_runtime_gc_pause_seconds", "histogram", "Pauses of the garbage collector in the runtime")
+        self.declare("rsc_runtime_exceptions_total", "counter", "Exceptions the runtime loop survived")
+        self.declare("rsc_runtime_errors_total", "counter", "Errors which caused a restart of the runtime")
+        self.declare("rsc_sensor_fps", "gauge", "Angles measured per second in the last report")
+        self.declare("rsc_latency_seconds", "gauge", "Latency from the camera frame to the converter write in the last report")
+        self.declare("rsc_latency_samples_total", "counter", "Traced readings per segment of the latency")
+        self.declare("rsc_modbus_transaction_seconds", "histogram", "Duration of the transactions on the converter bus")
+        self.declare("rsc_modbus_errors_total", "counter", "Failed transactions on the converter bus")
+        self.declare("rsc_emergency_stops_total", "counter", "Emergency stops done by the converter")
+
+    def runtime_stats(self, runtime: str, stage: int | None, stats: dict[str, Any]) -> None:
+        l = labels(runtime=runtime, stage=stage)
+        loop = stats["loop"]
+        self.inc("rsc_runtime_iterations_total", l, stats["iterations"])
+        self.set("rsc_runtime_loop_rate", l, stats["rate"])
+        self.set("rsc_runtime_sleep_ratio", l, stats["sleep_ratio"])
+        self.observe("rsc_runtime_loop_duration_seconds", l, loop["bounds"], loop["counts"], loop["sum"])
+        for name, values in (("rsc_runtime_cycle_lateness_seconds", stats["jitter"]), ("rsc_runtime_gc_pause_seconds", stats["gc"])):
+            self.observe(name, l, values["bounds"], values["counts"], values["sum"])
+        for exception, count in stats["exceptions"].items():
+            self.inc("rsc_runtime_exceptions_total", labels(runtime=runtime, stage=stage, exception=exception), count)
+
+    def runtime_error(self, runtime: str, stage: int | None) -> None:
+        self.inc("rsc_runtime_errors_total", labels(runtime=runtime, stage=stage))
+
+    def sensor(self, stage: int, fps: float) -> None:
+        self.set("rsc_sensor_fps", labels(stage=stage), fps)
+
+    def latency(self, stage: int, segments: tuple[str, ...], summary: tuple[float, ...]) -> None:
+        for i, segment in enumerate(segments):
+            count, p50, p99, maximum = summary[4 * i:4 * i + 4]
+            self.inc("rsc_latency_samples_total", labels(stage=stage, segment=segment), count)
+            if count > 0:
+                for quantile, value in (("0.5", p50), ("0.99", p99), ("1", maximum)):
+                    self.set("rsc_latency_seconds", labels(stage=stage, segment=segment, quantile=quantile), value)
+
+    def modbus(self, bounds: list[float], counts: list[int], total: float, errors: int) -> None:
+        self.observe("rsc_modbus_transaction_seconds", (), bounds, counts, total)
+        self.inc("rsc_modbus_errors_total", (), errors)
+
+    def emergency_stop(self, stage: int) -> None:
+        self.inc("rsc_emergency_stops_total", labels(stage=stage))
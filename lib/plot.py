@@ -0,0 +1,107 @@
+from multiprocessing.connection import Connection
+from multiprocessing import Pipe
+from typing import Tuple
+import numpy as np
+import math
+
+from .runtime import Runtime, App
+from .process import GenericProcess, RuntimeEnvironment
+from .telemetry import Telemetry
+from .stage.commands import Command
+from .utility.plot import LivePlot
+
+# History of the telemetry of a stage, decimated to one sample per sample
+# interval and kept in preallocated ring arrays.
+class PlotHistory:
+    FIELDS = ('time', 'angle', 'speed', 'command_speed', 'frequency', 'error')
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.data = np.full((len(self.FIELDS), size), math.nan)
+        self.index = 0
+        self.count = 0
+
+    def append(self, *values: float) -> None:
+        self.data[:, self.index] = values
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def ordered(self) -> np.ndarray:
+        """Returns the samples from the oldest to the latest one."""
+        if self.count < self.size:
+            return self.data[:, :self.count]
+        return np.concatenate((self.data[:, self.index:], self.data[:, :self.index]), axis=1)
+
+# The plot process reads the telemetry of all stages from shared memory, so it
+# costs the other processes nothing. It samples the telemetry with a fixed
+# interval and renders at most with the frame rate.
+class PlotRuntime(Runtime):
+    def __init__(self, telemetry: Telemetry, app: App) -> None:
+        super().__init__()
+        self.app = app
+        self.telemetry = telemetry
+
+        # Function classes
+        self.plot: LivePlot = None
+        self.histories: list[PlotHistory] = []
+
+        # State
+        self.sequences: list[int] = []
+        self.last_sample: float = 0.0
+        self.last_frame: float = 0.0
+
+    def setup(self) -> None:
+        self.frame_interval = 1 / self.app.get_config('plot', 'fps', float, 10.0)
+        self.sample_interval = self.app.get_config('plot', 'sample_interval', int, 50) / 1000
+        self.history = self.app.get_config('plot', 'history', float, 30.0)
+        self.trail = self.app.get_config('plot', 'trail', int, 20)
+        self.histories = [PlotHistory(int(self.history / self.sample_interval) + 1) for _ in range(self.telemetry.stages)]
+        self.sequences = [0] * self.telemetry.stages
+        self.plot = LivePlot(self.telemetry.stages, self.history,
+            self.app.get_config('DEFAULT', 'max_speed', float, 1.0),
+            self.app.get_config('motor', 'max_frequency', float, 40.0),
+            self.app.get_config('plot', 'error_range', float, 20.0))
+
+    def loop(self) -> None:
+        now = self.clock.time()
+        if now - self.last_sample >= self.sample_interval:
+            self.last_sample = now
+            for stage, history in enumerate(self.histories):
+                self.sample(stage, history)
+
+        if now - self.last_frame >= self.frame_interval:
+            self.last_frame = now
+            for stage, history in enumerate(self.histories):
+                t, angle, speed, command_speed, frequency, error = history.ordered()
+                self.plot.update(stage, t - now, angle, speed, command_speed, frequency, error, self.trail)
+            self.plot.draw()
+
+    def sample(self, stage: int, history: PlotHistory) -> None:
+        sequence = self.telemetry.sequence(stage)
+        if sequence == self.sequences[stage]:
+            return
+        state = self.telemetry.read(stage)
+        if state is None:
+            return
+        self.sequences[stage] = sequence
+
+        action = state.command_action
+        command_speed = state.command_speed if action in (Command.Action.RUN_TO_ANGLE, Command.Action.RUN_CONTINUOUS) else math.nan
+        error = (state.command_angle - state.angle + 180) % 360 - 180 if action == Command.Action.RUN_TO_ANGLE else math.nan
+        history.append(state.time, state.angle, abs(state.speed), command_speed, state.frequency, error)
+
+    def stop(self) -> int | None:
+        if self.plot is not None:
+            self.plot.close()
+
+class Plot(GenericProcess):
+    def __init__(self, telemetry: Telemetry) -> None:
+        super().__init__()
+        self.telemetry = telemetry
+
+    def init(self) -> Tuple[RuntimeEnvironment, Connection]:
+        signal, runtime_signal = Pipe()
+        kwargs = {
+            "telemetry": self.telemetry
+        }
+        return RuntimeEnvironment(PlotRuntime, runtime_signal, kwargs=kwargs), signal
@@ -4,10 +4,15 @@ from typing import Type, cast, Dict, Any, List, Tuple, Callable
 from abc import ABC, abstractmethod
 from enum import Enum
 import traceback
+import threading
 import inspect
 import time
 
 from .runtime import Runtime, ExitCodes, App
+from .profiling import LoopStats, SamplingProfiler
+from .realtime import GarbageCollector, parse_cpus, set_affinity, set_priority, lock_memory
+from .utility.log import log, Level
+from . import wire
 
 class Signals(Enum):
     """Signal send to and from a process to communicate its state or call for
@@ -17,10 +22,15 @@ class Signals(Enum):
     ERROR = 2
     CONFIG = 3
     DATA = 4
+    STATS = 5
+    PROFILE = 6
 
 class Message:
     """Message between processes. Mainly focused on the communication between
-    the main and child processes."""
+    the main and child processes. Messages are send in the binary wire
+    format."""
+    __slots__ = ('frame',)
+
     def __init__(self, frame: tuple[Signals, Any]) -> None:
         self.frame = frame
 
@@ -33,14 +43,12 @@ class Message:
         return self.frame[1]
     
     def send_on(self, c: Connection) -> None:
-        c.send(self.frame)
+        c.send_bytes(wire.encode_message(self.frame[0].value, self.frame[1]))
 
     @staticmethod
     def recv_from(c: Connection) -> 'Message':
-        frame = c.recv()
-        assert isinstance(frame, tuple), "Message expected a tuple, but got %s" % type(frame)
-        assert len(frame) == 2, "Expected a tuple with 2 elements, actual length is %i" % len(frame)
-        return Message(frame)
+        signal, data = wire.decode_message(c.recv_bytes())
+        return Message((Signals(signal), data))
 
     @staticmethod
     def initialized_signal() -> 'Message':
@@ -65,6 +73,14 @@ class Message:
     @staticmethod
     def data_signal(d: Any) -> 'Message':
         return Message((Signals.DATA, d))
+
+    @staticmethod
+    def stats_signal(stats: dict[str, Any]) -> 'Message':
+        return Message((Signals.STATS, stats))
+
+    @staticmethod
+    def profile_signal() -> 'Message':
+        return Message((Signals.PROFILE, None))
     
 class AppProxy(App):
     def __init__(self, signal: Connection) -> None:
@@ -116,6 +132,8 @@ class RuntimeEnvironment(Process):
             2. Call setup method of runtime
             3. Call loop method until STOP signal is received
             4. Call stop method of runtime
+        Statistics of the loop are send to the main process every stats
+        interval. On a PROFILE signal the loop is profiled for a while.
         """
         signal  = cast(Connection, self._kwargs["signal"])
         app_proxy = AppProxy(signal)
@@ -128,62 +146,111 @@ class RuntimeEnvironment(Process):
             self._kwargs["kwargs"]['app'] = app_proxy
 
         runtime = cast(Type[Runtime], self._kwargs["runtime_cls"])(*self._args, **self._kwargs["kwargs"])
+        name = runtime.__class__.__name__
         min_duration_loop = self.min_loop_duration / 1000
-        last_loop = time.time()
+        clock = runtime.clock
+        last_loop = clock.time()
 
-        # Runtime startup
+        # Runtime startup. Affinity and priority are set before the setup, so
+        # the threads started by the runtime inherit them.
         try:
             app_proxy.setup()
+            log.level = Level.DEBUG if app_proxy.is_debug_enabled else Level.INFO
+            collector = GarbageCollector(app_proxy.get_runtime_config(name, 'gc', str, 'auto'))
+            cpus = parse_cpus(app_proxy.get_runtime_config(name, 'cpus', str, ''))
+            priority = app_proxy.get_runtime_config(name, 'priority', int, 0)
+            if len(cpus) > 0:
+                set_affinity(name, cpus)
+            if priority > 0:
+                set_priority(name, priority)
             runtime.setup()
+            if app_proxy.get_runtime_config(name, 'lock_memory', bool, False):
+                lock_memory(name)
+            collector.freeze()
         except Exception as e:
-            print("[%s] %s%s" % (runtime.__class__.__name__, e.__class__.__name__, ": %s" % e if str(e) != "" else ""))
-            print("[%s] %s" % (runtime.__class__.__name__, traceback.format_exc()))
+            self._fault(runtime, e)
             Message.error_signal(e).send_on(signal)
             exit(ExitCodes.INIT_ERROR.value)
         
         Message.initialized_signal().send_on(signal)
+
+        # Profiling
+        stats = LoopStats()
+        stats_interval = app_proxy.get_config('runtime', 'stats_interval', int, 10000) / 1000
+        profile_duration = app_proxy.get_config('runtime', 'profile_duration', int, 10000) / 1000
+        profile_interval = app_proxy.get_config('runtime', 'profile_interval', int, 5) / 1000
+        profiler: SamplingProfiler | None = None
+        last_started: float | None = None
         
         # Runtime loop
         exitcode = ExitCodes.SUCCESS
         while True:
-            if signal.poll() and Message.recv_from(signal).signal == Signals.STOP:
-                break
+            if signal.poll():
+                msg = Message.recv_from(signal)
+                if msg.signal == Signals.STOP:
+                    break
+                elif msg.signal == Signals.PROFILE and (profiler is None or not profiler.is_alive()):
+                    profiler = SamplingProfiler(threading.get_ident(), "profile.%s.%i.txt" % (name, self.pid),
+                        profile_duration, profile_interval)
+                    profiler.start()
             
+            loop_started = time.perf_counter()
+            if last_started is not None:
+                stats.cycle(loop_started - last_started, min_duration_loop)
+            last_started = loop_started
             try:
                 runtime.loop()
-            except EOFError:
+            except EOFError as e:
                 # EOFError is usually triggered if another process fails and
                 # closes its connections. The current process should try to live
                 # with this situation and is probably be shutdown or restarted
                 # by the main process. 
-                time.sleep(0.5)
+                stats.exception(e)
+                clock.sleep(0.5)
             except Exception as e:
-                print("[%s] %s%s" % (runtime.__class__.__name__, e.__class__.__name__, ": %s" % e if str(e) != "" else ""))
-                print("[%s] %s" % (runtime.__class__.__name__, traceback.format_exc()))
+                self._fault(runtime, e)
                 Message.error_signal(e).send_on(signal)
                 exitcode = ExitCodes.RUNTIME_ERROR
                 break
+            stats.loop(time.perf_counter() - loop_started)
 
             # The CPU of the PI is blocked by all the loop. Further the loop is
-            # stopped if it does nothing and is to fast.
-            loop_duration = time.time() - last_loop
+            # stopped if it does nothing and is to fast. The garbage is
+            # collected in the time the loop would sleep anyway.
+            loop_duration = clock.time() - last_loop
+            collector.collect(loop_duration < min_duration_loop)
+            loop_duration = clock.time() - last_loop
             if loop_duration < min_duration_loop:
-                time.sleep(min_duration_loop - loop_duration)
-            last_loop = time.time()
+                sleep_started = time.perf_counter()
+                clock.sleep(min_duration_loop - loop_duration)
+                stats.sleep(time.perf_counter() - sleep_started)
+            last_loop = clock.time()
+
+            if stats_interval > 0 and stats.window > stats_interval:
+                Message.stats_signal(stats.report(name)).send_on(signal)
+                stats.reset()
 
         # Runtime shutdown
         try:
             stop_returncode = runtime.stop()
         except Exception as e:
-            print("[%s] %s%s" % (runtime.__class__.__name__, e.__class__.__name__, ": %s" % e if str(e) != "" else ""))
-            print("[%s] %s" % (runtime.__class__.__name__, traceback.format_exc()))
+            self._fault(runtime, e)
             exit(ExitCodes.SHUTDOWN_ERROR)
         
+        log.flush()
         if stop_returncode is not None:
             exit(stop_returncode + list(ExitCodes.__members__.values())[-1].value)
         else:
             exit(exitcode.value)
 
+    @staticmethod
+    def _fault(runtime: Runtime, e: Exception) -> None:
+        """Logs an exception and dumps the latest log records of the process,
+        which show what lead to the fault."""
+        log.error(runtime.__class__.__name__, "%s%s" % (e.__class__.__name__, ": %s" % e if str(e) != "" else ""))
+        log.error(runtime.__class__.__name__, traceback.format_exc())
+        log.dump()
+
 class GenericProcess(ABC):
     """A wrapper for RuntimeEnvironment with process control functions"""
     def __init__(self) -> None:
@@ -191,6 +258,7 @@ class GenericProcess(ABC):
         self._process: RuntimeEnvironment | None = None
         self._signal: Connection | None = None
         self._subscriber = set[GenericProcess]()
+        self.stats: dict[str, Any] | None = None
 
     @property
     def process(self) -> RuntimeEnvironment:
@@ -264,9 +332,18 @@ class GenericProcess(ABC):
         self.start(config_callback)
         [p.start(config_callback) for p in self._subscriber]
     
+    def profile(self) -> None:
+        """Requests a sampling profile of the runtime loop"""
+        if self._process is not None:
+            Message.profile_signal().send_on(self.signal)
+
     def recv(self) -> Message | None:
-        """Return app signal if a new signal is available"""
+        """Return app signal if a new signal is available. The latest loop
+        statistics of the runtime are kept in stats."""
         if self.signal.poll():
-            return Message.recv_from(self.signal)
+            msg = Message.recv_from(self.signal)
+            if msg.signal == Signals.STATS:
+                self.stats = msg.data
+            return msg
         else:
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,126 @@
+from threading import Thread
+from typing import Any
+import math
+import sys
+import gc
+import time
+import os
+
+from .utility.histogram import Histogram
+from .utility.log import log
+
+# Statistics of the loop of a runtime over a reporting window. The durations
+# are measured with the performance counter, independent of the clock which
+# paces the runtime. The jitter is the time a cycle took longer than the
+# minimum loop duration, the pauses of the garbage collector are measured
+# with a callback.
+class LoopStats:
+    def __init__(self) -> None:
+        self.durations = Histogram()
+        self.lateness = Histogram()
+        self.gc_pauses = Histogram()
+        self.exceptions: dict[str, int] = {}
+        self._gc_started = 0.0
+        gc.callbacks.append(self._on_gc)
+        self.reset()
+
+    def _on_gc(self, phase: str, info: dict[str, int]) -> None:
+        if phase == "start":
+            self._gc_started = time.perf_counter()
+        else:
+            self.gc_pauses.record(time.perf_counter() - self._gc_started)
+
+    def loop(self, duration: float) -> None:
+        self.durations.record(duration)
+        self.busy += duration
+
+    def sleep(self, duration: float) -> None:
+        self.sleeping += duration
+
+    def cycle(self, period: float, target: float) -> None:
+        self.lateness.record(max(period - target, 0.0))
+        self.cycles += 1
+        self.period_sum += period
+        self.period_squares += period * period
+
+    def exception(self, e: BaseException) -> None:
+        name = e.__class__.__name__
+        self.exceptions[name] = self.exceptions.get(name, 0) + 1
+
+    @property
+    def window(self) -> float:
+        return time.perf_counter() - self.started
+
+    def report(self, runtime: str) -> dict[str, Any]:
+        """Returns the statistics of the window with plain values, so they can
+        be send to the main process."""
+        window = self.window
+        d = self.durations
+        l = self.lateness
+        g = self.gc_pauses
+        n = self.cycles
+        mean = self.period_sum / n if n > 0 else 0.0
+        return {
+            "runtime": runtime,
+            "pid": os.getpid(),
+            "window": window,
+            "iterations": d.count,
+            "rate": d.count / window if window > 0 else 0.0,
+            "busy": self.busy,
+            "sleep_ratio": self.sleeping / window if window > 0 else 0.0,
+            "loop": {"p50": d.percentile(50), "p99": d.percentile(99), "max": d.max, "mean": d.mean,
+                     "sum": d.sum, "bounds": list(d.bounds), "counts": list(d.counts)},
+            "jitter": {"period": mean, "std": math.sqrt(max(self.period_squares / n - mean * mean, 0.0)) if n > 0 else 0.0,
+                       "p99": l.percentile(99), "max": l.max,
+                       "sum": l.sum, "bounds": list(l.bounds), "counts": list(l.counts)},
+            "gc": {"collections": g.count, "p99": g.percentile(99), "max": g.max,
+                   "sum": g.sum, "bounds": list(g.bounds), "counts": list(g.counts)},
+            "exceptions": dict(self.exceptions)
+        }
+
+    def reset(self) -> None:
+        self.durations.reset()
+        self.lateness.reset()
+        self.gc_pauses.reset()
+        self.exceptions.clear()
+        self.cycles = 0
+        self.period_sum = 0.0
+        self.period_squares = 0.0
+        self.busy = 0.0
+        self.sleeping = 0.0
+        self.started = time.perf_counter()
+
+class SamplingProfiler(Thread):
+    """Samples the stack of a thread in a fixed interval for a duration and
+    writes the collapsed stacks with their number of samples to a file. Each
+    line is 'outer;...;inner count', which can be rendered as flame graph."""
+    def __init__(self, thread_id: int, path: str, duration: float = 10.0, interval: float = 0.005) -> None:
+        super().__init__(name="SamplingProfiler", daemon=True)
+        self.thread_id = thread_id
+        self.path = path
+        self.duration = duration
+        self.interval = interval
+        self.samples: dict[str, int] = {}
+
+    def run(self) -> None:
+        end = time.perf_counter() + self.duration
+        while time.perf_counter() < end:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack: list[str] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s:%s:%i" % (os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+            time.sleep(self.interval)
+
+        try:
+            with open(self.path, "w") as f:
+                for stack, count in sorted(self.samples.items(), key=lambda s: -s[1]):
+                    f.write("%s %i\n" % (stack, count))
+            log.info("SamplingProfiler", "Profile written", samples=sum(self.samples.values()), path=self.path)
+        except OSError as e:
+            log.warn("SamplingProfiler", "Failed to write profile", path=self.path, error=e)
@@ -0,0 +1,98 @@
+import ctypes
+import ctypes.util
+import gc
+import os
+
+from .utility.log import log
+
+# Flags of mlockall, see mman.h
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+def parse_cpus(cpus: str) -> set[int]:
+    """Parses a list of CPUs like '2,3' or '1-3'."""
+    result: set[int] = set()
+    for part in cpus.split(','):
+        part = part.strip()
+        if part == "":
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            result.update(range(int(first), int(last) + 1))
+        else:
+            result.add(int(part))
+    return result
+
+def set_affinity(name: str, cpus: set[int]) -> bool:
+    """Pins the process to the CPUs. Threads started later inherit it."""
+    try:
+        os.sched_setaffinity(0, cpus)
+        return True
+    except (OSError, AttributeError) as e:
+        log.warn(name, "Failed to set CPU affinity", cpus=",".join(map(str, sorted(cpus))), error=e)
+        return False
+
+def set_priority(name: str, priority: int) -> bool:
+    """Schedules the calling thread and the threads it starts later with the
+    real-time policy SCHED_FIFO. This usually requires root or CAP_SYS_NICE."""
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        return True
+    except (OSError, AttributeError) as e:
+        log.warn(name, "Failed to set real-time priority", priority=priority, error=e)
+        return False
+
+def lock_memory(name: str) -> bool:
+    """Locks all current and future pages of the process into memory, so the
+    loop never waits for a page to be swapped in."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        return True
+    except (OSError, AttributeError) as e:
+        log.warn(name, "Failed to lock memory", error=e)
+        return False
+
+# Controls when the garbage collector of a runtime runs. After the setup the
+# objects which live as long as the runtime are frozen, so later collections
+# do not traverse them. The modes are:
+#   auto      Python collects whenever its thresholds are reached
+#   freeze    Freeze after setup, otherwise like auto
+#   slack     Freeze after setup and collect only in the slack time of the
+#             loop, i.e. while the loop would sleep anyway. If the loop has no
+#             slack for long, the collection is done regardless.
+#   disabled  Freeze after setup and never collect. Reference cycles created
+#             by the loop are never freed.
+class GarbageCollector:
+    MODES = ('auto', 'freeze', 'slack', 'disabled')
+
+    # Factor of the thresholds after which a collection is done without slack
+    OVERDUE = 10
+
+    def __init__(self, mode: str = 'auto') -> None:
+        if mode not in self.MODES:
+            raise ValueError("Invalid garbage collector mode %s, expected one of %s" % (mode, ", ".join(self.MODES)))
+        self.mode = mode
+
+    def freeze(self) -> None:
+        """Called once after the setup of the runtime."""
+        if self.mode == 'auto':
+            return
+        gc.collect()
+        gc.freeze()
+        if self.mode in ('slack', 'disabled'):
+            gc.disable()
+
+    def collect(self, slack: bool) -> None:
+        """Collects the generations which reached their threshold. Without
+        slack only generations far above their thresholds are collected."""
+        if self.mode != 'slack':
+            return
+        count = gc.get_count()
+        threshold = gc.get_threshold()
+        factor = 1 if slack else self.OVERDUE
+        for generation in (2, 1, 0):
+            if count[generation] > threshold[generation] * factor:
+                gc.collect(generation)
+                return
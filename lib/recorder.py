@@ -0,0 +1,100 @@
+from enum import IntEnum
+from typing import Iterable, Iterator, NamedTuple
+import struct
+import mmap
+import math
+import os
+
+class RecordKind(IntEnum):
+    ANGLE = 0       # angle (degree)
+    SPEED = 1       # speed (m/s)
+    COMMAND = 2     # action, direction, speed, angle, frequency and turns as extra
+    OUTPUT = 3      # speed of the angle controller, frequency of the speed controller, actual speed
+    WRITE = 4       # target frequency, running, forward, time after the converter call
+    START = 5       # start of a run of the control process
+
+class Record(NamedTuple):
+    sequence: int
+    time: float
+    kind: RecordKind
+    stage: int
+    extra: int
+    values: tuple[float, float, float, float, float]
+
+# Recorder of the data of the control process. Records have a fixed
+# size and are written into a ring in a memory-mapped file, so recording costs
+# a single pack into memory and the operating system writes the file in the
+# background. The latest records survive a crash of the process. The file is
+# reused by the next run, if it has the same layout, so the ring covers the
+# last runs as well. Every run begins with a START record.
+#
+# Layout: header (magic, version, record size, capacity, next sequence) padded
+# to 64 bytes, followed by capacity records of
+#   sequence u64, time f64, kind u8, stage u8, extra u16, 4 bytes padding,
+#   5 values f64
+class FlightRecorder:
+    MAGIC = b'RSCFLREC'
+    VERSION = 1
+    HEADER = struct.Struct('<8sIIQQ')
+    HEADER_SIZE = 64
+    RECORD = struct.Struct('<QdBBH4x5d')
+    _SEQUENCE = struct.Struct('<Q')
+    _SEQUENCE_OFFSET = 24
+
+    def __init__(self, path: str, capacity: int = 262144) -> None:
+        self.path = path
+        size = self.HEADER_SIZE + capacity * self.RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            reuse = os.fstat(fd).st_size == size
+            if not reuse:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, version, record_size, known_capacity, sequence = self.HEADER.unpack_from(self._mm, 0)
+        if not reuse or magic != self.MAGIC or version != self.VERSION or \
+            record_size != self.RECORD.size or known_capacity != capacity:
+            sequence = 0
+            self.HEADER.pack_into(self._mm, 0, self.MAGIC, self.VERSION, self.RECORD.size, capacity, sequence)
+        self.capacity = capacity
+        self.sequence = sequence
+
+    def record(self, kind: RecordKind, stage: int, time: float, a: float = math.nan, b: float = math.nan,
+               c: float = math.nan, d: float = math.nan, e: float = math.nan, extra: int = 0) -> None:
+        sequence = self.sequence
+        self.RECORD.pack_into(self._mm, self.HEADER_SIZE + (sequence % self.capacity) * self.RECORD.size,
+            sequence, time, kind, stage, extra, a, b, c, d, e)
+        self.sequence = sequence + 1
+        self._SEQUENCE.pack_into(self._mm, self._SEQUENCE_OFFSET, self.sequence)
+
+    def close(self) -> None:
+        self._mm.flush()
+        self._mm.close()
+
+def read_records(path: str, since: int = 0) -> Iterator[Record]:
+    """Returns the records of a flight recorder file from the oldest to the
+    latest one, starting at the sequence number since."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, record_size, capacity, sequence = FlightRecorder.HEADER.unpack_from(data, 0)
+    if magic != FlightRecorder.MAGIC or version != FlightRecorder.VERSION or record_size != FlightRecorder.RECORD.size:
+        raise ValueError("%s is not a flight recorder file of version %i" % (path, FlightRecorder.VERSION))
+    for s in range(max(sequence - capacity, since), sequence):
+        values = FlightRecorder.RECORD.unpack_from(data, FlightRecorder.HEADER_SIZE + (s % capacity) * record_size)
+        if values[0] != s:
+            # Overwritten while the file was read
+            continue
+        yield Record(values[0], values[1], RecordKind(values[2]), values[3], values[4], values[5:])
+
+def runs(records: Iterable[Record]) -> list[list[Record]]:
+    """Splits records into the runs of the control process. A run begins
+    with a START record, records before the first one form a run of their
+    own."""
+    result: list[list[Record]] = []
+    for r in records:
+        if len(result) == 0 or r.kind == RecordKind.START:
+            result.append([])
+        result[-1].append(r)
+    return result
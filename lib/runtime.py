@@ -2,6 +2,8 @@ from typing import Any, Type
 from abc import ABC, abstractmethod
 from enum import Enum
 
+from .utility.clock import Clock, SYSTEM_CLOCK
+
 class ExitCodes(Enum):
     """Exit codes describe the reason why a runtime exited"""
     SUCCESS = 0
@@ -21,6 +23,26 @@ class App(ABC):
     def get_config(self, section: str, option: str, t: Type = str, default: Any = None, timeout: float = 2.0) -> Any:
         pass
 
+    def get_stage_config(self, stage: int, section: str, option: str, t: Type = str, default: Any = None) -> Any:
+        """Returns a config value of a single stage. Every stage except the
+        first one can override options in a section with the stage index as
+        suffix, e.g. [motor.1]. Options which are not overridden are read from
+        the common section."""
+        if stage > 0:
+            value = self.get_config("%s.%i" % (section, stage), option, t)
+            if value is not None:
+                return value
+        return self.get_config(section, option, t, default)
+
+    def get_runtime_config(self, runtime: str, option: str, t: Type = str, default: Any = None) -> Any:
+        """Returns a config value of the [runtime] section, which a single
+        runtime can override in a section with its name as suffix, e.g.
+        [runtime.ControlRuntime]."""
+        value = self.get_config("runtime.%s" % runtime, option, t)
+        if value is not None:
+            return value
+        return self.get_config("runtime", option, t, default)
+
     @property
     @abstractmethod
     def is_testing_enabled(self) -> bool:
@@ -37,7 +59,10 @@ class Runtime(ABC):
     split into three parts: Setup, loop and stop (or cleanup). Setup and stop
     are called once and loop is called repeatably until the runtime is forced to
     stop. The runtime is initialized with arguments passed to the class
-    constructor."""
+    constructor. All timing of the runtime, including the pacing of its loop,
+    uses the clock of the runtime."""
+    clock: Clock = SYSTEM_CLOCK
+
     @abstractmethod
     def setup():
         pass
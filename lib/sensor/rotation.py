@@ -2,11 +2,14 @@ from typing import Any
 from abc import ABC, abstractmethod
 import cv2
 import numpy as np
-import math
-from time import time
 from math import degrees, atan2
+from collections import deque
+import random
 
 from lib.utility.angle import Angle
+from lib.stage.plant import StagePlant
+from lib.utility.clock import Clock, SYSTEM_CLOCK
+from lib.utility.log import log
 
 class RotationSensor(ABC):
     def init(self) -> None:
@@ -30,8 +33,9 @@ class RotationSensor(ABC):
         pass
 
 class OpticalRotationSensor(RotationSensor):
-    def __init__(self, camera: int = 0, number_of_tracker: int = 36, debug: bool = False) -> None:
+    def __init__(self, camera: int = 0, number_of_tracker: int = 36, debug: bool = False, clock: Clock = SYSTEM_CLOCK) -> None:
         super().__init__()
+        self.clock = clock
         self.debug = debug
         self.camera = camera
         self.number_of_tracker = number_of_tracker
@@ -87,6 +91,7 @@ class OpticalRotationSensor(RotationSensor):
     def measure_angle(self) -> float | None:
         # Read a frame from the camera
         _, frame = self.cap.read()
+        recording = self.clock.time()
 
         # Detect ArUco markers in the frame
         detector = cv2.aruco.ArucoDetector(self.aruco_dict, self.aruco_params)
@@ -118,47 +123,52 @@ class OpticalRotationSensor(RotationSensor):
         
         # Display the frame
         if self.debug:
-            print(caluclated_angle)
+            log.debug("OpticalRotationSensor", "Angle measured", angle=caluclated_angle)
 
         self._last_angle = Angle(caluclated_angle)
-        self._last_angle_recording = time()
+        self._last_angle_recording = recording
         return self.last_angle
 
     def release(self) -> None:
         self.cap.release()
 
-class TestRotationSensor(RotationSensor):
-    def __init__(self, start_angle = Angle(180.0), speed: float = 1.0, update_interval: int = 20, stage_diameter: float = 4.5) -> None:
+class SimulatedRotationSensor(RotationSensor):
+    """Camera looking at the simulated plant of a stage. Frames are captured
+    with the frame rate and delivered after the latency. The angle of every
+    frame has gaussian noise."""
+    def __init__(self, plant: StagePlant, frame_rate: float = 30.0, latency: float = 0.05, noise: float = 0.05, seed: int | None = None, clock: Clock = SYSTEM_CLOCK) -> None:
         super().__init__()
-        self.speed = speed
-        self.stage_diameter = stage_diameter
-        self.angular_velocity = 0.0  
-        self.current_angle = start_angle
-        self.update_interval = update_interval / 1000
-        self.last_update = time()
-        self.turn_forward = True
+        self.clock = clock
+        self.plant = plant
+        self.frame_interval = 1 / frame_rate
+        self.latency = latency
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.frames: deque[tuple[float, Angle]] = deque()
+        self.next_frame = self.clock.time()
+        self.current_angle: Angle | None = None
+        self.current_recording: float | None = None
 
     @property
     def last_angle(self) -> Angle | None:
         return self.current_angle
-    
+
     @property
     def last_angle_recording(self) -> float | None:
-        return self.last_update
+        return self.current_recording
 
-    def update(self, forward: bool, frequency: float) -> None:
-        self.angular_velocity = (self.speed * (frequency / 60.0)) / (self.stage_diameter / 2) # speed: m/s, diameter: m, velocity: 1/s
-        self.turn_forward = forward
-
-    def measure_angle(self) -> float | None:
-        dt = time() - self.last_update
-        if dt > self.update_interval:
-            dr = math.degrees(self.angular_velocity * dt) # v * s = rad
-            if self.turn_forward:
-                self.current_angle += Angle(dr)
-            else:
-                self.current_angle -= Angle(dr)
-            self.last_update = time()
-            return self.current_angle
-        else:
-            return None
\ No newline at end of file
+    def measure_angle(self) -> Angle | None:
+        now = self.clock.time()
+        if now >= self.next_frame:
+            angle, _, _ = self.plant.state()
+            self.frames.append((now, Angle(angle + self.random.gauss(0, self.noise))))
+            self.next_frame = max(self.next_frame + self.frame_interval, now)
+
+        # Deliver the latest frame which passed the latency
+        delivered = None
+        while len(self.frames) > 0 and self.frames[0][0] + self.latency <= now:
+            delivered = self.frames.popleft()
+        if delivered is None:
+            return None
+        self.current_recording, self.current_angle = delivered
+        return self.current_angle
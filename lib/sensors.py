@@ -1,18 +1,22 @@
 from multiprocessing.connection import Connection
 from multiprocessing import Pipe
-from typing import Tuple, cast
-from time import time
+from typing import Tuple
 
 from .runtime import Runtime, App
 from .process import GenericProcess, RuntimeEnvironment
-from .sensor.rotation import RotationSensor, OpticalRotationSensor, TestRotationSensor
+from . import wire
+from .tracing import TracedReadings
+from .sensor.rotation import RotationSensor, OpticalRotationSensor, SimulatedRotationSensor
 from .sensor.speed import SpeedSensor, AngularSpeedSensor
 from .sensor import Sensor
+from .stage.plant import StagePlant
 
 class AbsoluteSensorRuntime(Runtime):
-    def __init__(self, values: Connection, app: App) -> None:
+    def __init__(self, values: Connection, app: App, stage: int = 0, plant: StagePlant | None = None) -> None:
         super().__init__()
         self.app = app
+        self.stage = stage
+        self.plant = plant
 
         # Connections
         self.values = values
@@ -26,60 +30,83 @@ class AbsoluteSensorRuntime(Runtime):
         self.current_speed: float | None = None
         self.last_angle_measurement: float = None
         self.last_speed_measurement: float = None
+        self.frames = 0
+        self.last_report: float = self.clock.time()
 
         # Const
         self.angle_sensor_timeout = self.app.get_config('sensors', 'angle_sensor_timeout', float, 1)
         self.speed_sensor_timeout = self.app.get_config('sensors', 'speed_sensor_timeout', float, 1)
+        self.report_interval = self.app.get_config('runtime', 'stats_interval', int, 10000) / 1000
 
     def setup(self) -> None:
-        self.angle_sensor = OpticalRotationSensor(self.app.get_config('sensors', 'camera_index', int, 0)) if not self.app.is_testing_enabled else TestRotationSensor()
+        if self.plant is not None:
+            self.angle_sensor = SimulatedRotationSensor(self.plant,
+                self.app.get_stage_config(self.stage, 'simulation', 'frame_rate', float, 30.0),
+                self.app.get_stage_config(self.stage, 'simulation', 'latency', int, 50) / 1000,
+                self.app.get_stage_config(self.stage, 'simulation', 'noise', float, 0.05),
+                clock=self.clock)
+        else:
+            self.angle_sensor = OpticalRotationSensor(self.app.get_stage_config(self.stage, 'sensors', 'camera_index', int, 0), clock=self.clock)
         self.speed_sensor = AngularSpeedSensor(self.angle_sensor, self.app.get_config('DEFAULT', 'stage_diameter', float, 4.5))
         self.angle_sensor.init()
         self.speed_sensor.init()
 
-        self.last_angle_measurement = time()
-        self.last_speed_measurement = time()
+        self.last_angle_measurement = self.clock.time()
+        self.last_speed_measurement = self.clock.time()
+        self.last_report = self.clock.time()
 
     def loop(self) -> None:
         send_queue: list[tuple[Sensor, float]] = []
 
         angle = self.angle_sensor.measure_angle()
+        detection = self.clock.time()
         if angle is not None:
             self.current_angle = angle
-            self.last_angle_measurement = time()
+            self.last_angle_measurement = detection
+            self.frames += 1
             send_queue.append((Sensor.STAGE_ABSOLUTE_ANGLE, float(self.current_angle)))
 
         speed = self.speed_sensor.measure_speed()
         if speed is not None:
             self.current_speed = speed
-            self.last_speed_measurement = time()
+            self.last_speed_measurement = self.clock.time()
             send_queue.append((Sensor.STAGE_SPEED, self.current_speed))
 
         # Check if values come regularly
-        if time() - self.last_angle_measurement > self.angle_sensor_timeout:
+        if self.clock.time() - self.last_angle_measurement > self.angle_sensor_timeout:
             raise Exception("Not enough absolute angles measured in time")
         
-        if time() - self.last_speed_measurement > self.speed_sensor_timeout:
+        if self.clock.time() - self.last_speed_measurement > self.speed_sensor_timeout:
             raise Exception("Not enough speed points measured in time")
 
-        while self.values.poll():
-            msg = self.values.recv()
-            assert len(msg) >= 2 and isinstance(msg[0], str)
-            if msg[0] == 'debug' and self.app.is_testing_enabled:
-                cast(TestRotationSensor, self.angle_sensor).update(*(msg[1], msg[2]))
+        # Report the measured angles per second to the main process
+        if self.report_interval > 0 and detection - self.last_report > self.report_interval:
+            self.app.send(('sensor', self.stage, self.frames / (detection - self.last_report)))
+            self.frames = 0
+            self.last_report = detection
 
-        if len(send_queue) > 0:
-            self.values.send(send_queue)
+        # Readings of a new frame are traced from the capture of the frame
+        if len(send_queue) > 0 and angle is not None and self.angle_sensor.last_angle_recording is not None:
+            wire.send(self.values, TracedReadings(send_queue, self.angle_sensor.last_angle_recording, detection, self.clock.time()))
+        elif len(send_queue) > 0:
+            wire.send(self.values, send_queue)
 
     def stop(self) -> int | None:
         self.speed_sensor.release()
         self.angle_sensor.release()
 
 class AbsoluteSensor(GenericProcess):
+    def __init__(self, stage: int = 0, plant: StagePlant | None = None) -> None:
+        super().__init__()
+        self.stage = stage
+        self.plant = plant
+
     def init(self) -> Tuple[RuntimeEnvironment, Connection]:
         signal, runtime_signal = Pipe()
         self.values, runtime_value = Pipe()
         kwargs = {
-            "values": runtime_value
+            "values": runtime_value,
+            "stage": self.stage,
+            "plant": self.plant
         }
         return RuntimeEnvironment(AbsoluteSensorRuntime, runtime_signal, kwargs=kwargs), signal
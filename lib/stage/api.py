@@ -0,0 +1,107 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from typing import Any, Callable
+import json
+
+from .commands import Command
+from .input import StageInputState
+from lib.telemetry import Telemetry
+from lib.utility.log import log
+
+# Local HTTP API of a stage.
+#   GET  /state    Snapshot of the stage state
+#   POST /command  Submits a command, e.g. {"action": "run_to_angle",
+#                  "direction": "clockwise", "speed": 0.5, "angle": 90}.
+#                  The direction "auto" takes the faster way and "turns"
+#                  adds full turns before the angle.
+# The snapshot is rendered at most once per control cycle, when the telemetry
+# of the stage changed. Any number of requests in between are answered with the
+# same rendered snapshot. An emergency stop takes the fast path of the OSC
+# input, before the command is handed over.
+class StageHTTPAPI:
+    def __init__(self, state: StageInputState, telemetry: Telemetry, stage: int,
+                 ip: str = "127.0.0.1", port: int = 8080, debug: bool = False,
+                 on_emergency_stop: Callable[[], None] | None = None) -> None:
+        self.state = state
+        self.telemetry = telemetry
+        self.stage = stage
+        self.debug = debug
+        self.on_emergency_stop = on_emergency_stop
+
+        self.http = ThreadingHTTPServer((ip, port), StageHTTPRequestHandler)
+        self.http.daemon_threads = True
+        setattr(self.http, 'api', self)
+        self._thread: Thread | None = None
+
+        self._snapshot_lock = Lock()
+        self._snapshot: bytes = b'null'
+        self._snapshot_sequence = -1
+
+    def start(self) -> None:
+        self._thread = Thread(target=self.http.serve_forever, name="StageHTTPAPI", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self.http.shutdown()
+            self._thread.join(1.0)
+        self.http.server_close()
+
+    def snapshot(self) -> bytes:
+        sequence = self.telemetry.sequence(self.stage)
+        with self._snapshot_lock:
+            if sequence != self._snapshot_sequence:
+                state = self.telemetry.read(self.stage)
+                self._snapshot = json.dumps(dict(stage=self.stage, **state.as_dict()) if state is not None else None).encode()
+                self._snapshot_sequence = sequence
+            return self._snapshot
+
+    def submit(self, body: dict[str, Any]) -> Command:
+        """Validates a command like any other input and hands it over to the
+        input state."""
+        command = Command(
+            Command.Action[str(body["action"]).upper()],
+            Command.Direction[str(body.get("direction", "none")).upper()],
+            float(body.get("speed", 1.0)),
+            float(body["angle"]) if body.get("angle") is not None else None,
+            float(body["frequency"]) if body.get("frequency") is not None else None,
+            float(body["at"]) if body.get("at") is not None else None,
+            int(body.get("turns", 0)))
+        if command.action == Command.Action.EMERGENCY_STOP and self.on_emergency_stop is not None:
+            self.on_emergency_stop()
+        with self.state:
+            self.state.apply(command)
+        return command
+
+class StageHTTPRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != "/state":
+            self._respond(404, b'{"error": "not found"}')
+            return
+        self._respond(200, self.api.snapshot())
+
+    def do_POST(self) -> None:
+        if self.path != "/command":
+            self._respond(404, b'{"error": "not found"}')
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            self.api.submit(body)
+        except (ValueError, KeyError, TypeError, AssertionError) as e:
+            self._respond(400, json.dumps({"error": "%s: %s" % (e.__class__.__name__, e)}).encode())
+            return
+        self._respond(202, b'{}')
+
+    @property
+    def api(self) -> StageHTTPAPI:
+        return getattr(self.server, 'api')
+
+    def _respond(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        log.debug("HTTP", format % args)
@@ -0,0 +1,150 @@
+from typing import TypeVar, Sequence, Iterator
+from contextlib import contextmanager
+from threading import Condition
+import time
+
+from .motor import FrequencyConverter, JSLSM100Converter, TestConverter, SimulatedConverter
+from .plant import StagePlant
+from lib.utility.histogram import Histogram
+
+T = TypeVar('T')
+
+class BusLock:
+    """Serializes transactions on the bus. Routine transactions wait as long as
+    an urgent transaction is pending, so an urgent transaction waits at most
+    for the single transaction which is currently on the bus. The duration of
+    every transaction and the failed ones are counted."""
+    def __init__(self) -> None:
+        self._condition = Condition()
+        self._busy = False
+        self._urgent = 0
+        self.transactions = Histogram()
+        self.errors = 0
+
+    @contextmanager
+    def routine(self) -> Iterator[None]:
+        with self._condition:
+            while self._busy or self._urgent > 0:
+                self._condition.wait()
+            self._busy = True
+        started = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            with self._condition:
+                self._record(time.perf_counter() - started, failed)
+                self._busy = False
+                self._condition.notify_all()
+
+    @contextmanager
+    def urgent(self) -> Iterator[None]:
+        with self._condition:
+            self._urgent += 1
+            while self._busy:
+                self._condition.wait()
+            self._busy = True
+        started = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            with self._condition:
+                self._record(time.perf_counter() - started, failed)
+                self._busy = False
+                self._urgent -= 1
+                self._condition.notify_all()
+
+    def _record(self, duration: float, failed: bool) -> None:
+        self.transactions.record(duration)
+        if failed:
+            self.errors += 1
+
+    def take_statistics(self) -> tuple[Histogram, int]:
+        """Returns the transactions and errors since the last call."""
+        with self._condition:
+            transactions, errors = self.transactions, self.errors
+            self.transactions, self.errors = Histogram(), 0
+            return transactions, errors
+
+class BusConverter(FrequencyConverter):
+    """Converter on the shared bus. Every call is a routine transaction."""
+    def __init__(self, converter: FrequencyConverter, lock: BusLock) -> None:
+        super().__init__()
+        self.converter = converter
+        self.lock = lock
+
+    def set_target_frequency(self, frequency: float) -> None:
+        with self.lock.routine():
+            self.converter.set_target_frequency(frequency)
+
+    def get_target_frequency(self) -> float:
+        with self.lock.routine():
+            return self.converter.get_target_frequency()
+
+    def get_current_frequency(self) -> float:
+        with self.lock.routine():
+            return self.converter.get_current_frequency()
+
+    def is_emergency_stop_active(self) -> bool:
+        with self.lock.routine():
+            return self.converter.is_emergency_stop_active()
+
+    def run(self, forward: bool) -> None:
+        with self.lock.routine():
+            self.converter.run(forward)
+
+    def stop(self) -> None:
+        with self.lock.routine():
+            self.converter.stop()
+
+    def emergency_stop(self) -> None:
+        with self.lock.urgent():
+            self.converter.emergency_stop()
+
+class ConverterBus:
+    """RS-485 bus shared by the frequency converters of all stages. Every
+    converter is addressed by its Modbus address on the same serial port.
+    Minimalmodbus reuses one serial connection for all instruments on a port
+    and the bus lock keeps transactions from overlapping, even if they are
+    issued from different threads. The bus also makes sure that every address
+    gets its turn."""
+    def __init__(self, port: str = '/dev/serial0', testing: bool = False) -> None:
+        self.port = port
+        self.testing = testing
+        self.lock = BusLock()
+        self.converters: dict[int, BusConverter] = {}
+        self._next = 0
+        self._items: Sequence | None = None
+        self._orders: list[list] = []
+
+    def converter(self, address: int, plant: StagePlant | None = None) -> BusConverter:
+        """Creates the converter with the given Modbus address on this bus.
+        In testing mode the converter drives the simulated plant, if there is
+        one."""
+        if address in self.converters:
+            raise ValueError("Converter address %i is used by more than one stage" % address)
+        if not self.testing:
+            converter = JSLSM100Converter(address, self.port)
+        elif plant is not None:
+            converter = SimulatedConverter(plant)
+        else:
+            converter = TestConverter()
+        self.converters[address] = BusConverter(converter, self.lock)
+        return self.converters[address]
+
+    def schedule(self, items: Sequence[T]) -> list[T]:
+        """Returns the items in the order they should access the bus in this
+        cycle. The first item rotates every cycle, so a stage with slow
+        transactions delays every other stage only once per rotation. The
+        orders are created once for the items and must not be modified."""
+        if self._items is not items or len(self._orders) != len(items):
+            self._items = items
+            self._orders = [list(items[start:]) + list(items[:start]) for start in range(len(items))]
+        if len(items) == 0:
+            return []
+        start = self._next % len(items)
+        self._next = start + 1
+        return self._orders[start]
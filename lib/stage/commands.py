@@ -1,10 +1,16 @@
 from enum import Enum
 
 class Command:
+    __slots__ = ('action', 'direction', 'speed', 'angle', 'frequency', 'turns', 'at')
+
+    # Turns are sent as u16 between the processes
+    MAX_TURNS = 65535
+
     class Direction(Enum):
         NONE = 0
         CLOCKWISE = 1
         COUNTERCLOCKWISE = 2
+        AUTO = 3
 
     class Action(Enum):
         EMERGENCY_STOP = 0
@@ -13,9 +19,10 @@ class Command:
         RUN_TO_ANGLE = 3
         REMOTE = 4
 
-    def __init__(self, action: 'Action', direction: 'Direction' = Direction.NONE, speed: float = 1.0, angle: float | None = None, frequency: float | None = None) -> None:
+    def __init__(self, action: 'Action', direction: 'Direction' = Direction.NONE, speed: float = 1.0, angle: float | None = None, frequency: float | None = None, at: float | None = None, turns: int = 0) -> None:
         if action == Command.Action.RUN_TO_ANGLE:
             assert angle >= 0 and angle < 360, 'Expect angle in degree between 0 and 360 [0, 360)'
+        assert turns >= 0 and turns <= Command.MAX_TURNS, 'Expect a number of turns between 0 and %i' % Command.MAX_TURNS
         if direction == Command.Direction.NONE:
             assert action == Command.Action.EMERGENCY_STOP or action == Command.Action.STOP, 'Expect direction for run commands'
         if action == Command.Action.REMOTE:
@@ -26,6 +33,14 @@ class Command:
         self.angle = angle
         self.frequency = frequency
 
+        # Full turns of a RUN_TO_ANGLE command before the stage stops at the
+        # angle
+        self.turns = turns
+
+        # Time (seconds since the epoch) at which the command should be
+        # applied. None applies the command immediately.
+        self.at = at
+
     @property
     def turn_clockwise(self) -> bool:
         return self.direction == Command.Direction.CLOCKWISE
@@ -41,7 +56,7 @@ class Command:
     def __eq__(self, o: object) -> bool:
         if not isinstance(o, Command):
             return False
-        if self.action == o.action:
+        if self.action == o.action and self.at == o.at:
             if self.is_stop():
                 return True
             else:
@@ -51,7 +66,8 @@ class Command:
                 elif self.action == Command.Action.RUN_TO_ANGLE:
                     return self.direction == o.direction and \
                         self.speed == o.speed and \
-                        self.angle == o.angle
+                        self.angle == o.angle and \
+                        self.turns == o.turns
         else:
             return False
         
@@ -4,10 +4,11 @@ from .controller.speed import StageSpeedController
 from .commands import Command
 from lib.sensor import Sensor
 from lib.utility.angle import Angle
-from time import time
+from lib.utility.clock import Clock, SYSTEM_CLOCK
 
 class StageControl:
-    def __init__(self, motor: FrequencyConverter, angle_controller: StageAngleController, speed_controller: StageSpeedController, max_frequency: float) -> None:
+    def __init__(self, motor: FrequencyConverter, angle_controller: StageAngleController, speed_controller: StageSpeedController, max_frequency: float,
+                 clock: Clock = SYSTEM_CLOCK) -> None:
         # Controller
         self.motor = motor
         self.angle_controller = angle_controller
@@ -16,35 +17,48 @@ class StageControl:
         # State
         self.motor_running: bool = False
         self.motor_running_forward: bool = True
+        self.target_frequency: float = 0.0
         self._active_command: Command | None = None
 
         self.max_frequency = max_frequency
-        self.last_update = time()
+        self.clock = clock
+        self.last_update = clock.time()
+        # Time the frequency was calculated by the controllers in the last call
+        self.last_output: float | None = None
 
     @property
     def stopped(self) -> bool:
         return not self.motor_running
     
-    # Update motor controls
-    def __call__(self, readings: list[tuple[Sensor, float]] | None) -> bool:
+    # Update a controller with a sensor reading
+    def measure(self, sensor: Sensor, value: float) -> None:
+        assert isinstance(value, float)
+        if sensor == Sensor.STAGE_ABSOLUTE_ANGLE:
+            self.angle_controller(value)
+        elif sensor == Sensor.STAGE_SPEED:
+            self.speed_controller(value)
+        else:
+            raise ValueError("Unknown sensor")
+
+    # Update motor controls. Readings can also be passed to measure before.
+    def __call__(self, readings: list[tuple[Sensor, float]] | None = None) -> bool:
         # Update sensor readings on the controllers
         if readings is not None:
             for sensor, value in readings:
-                assert isinstance(value, float)
-                if sensor == Sensor.STAGE_ABSOLUTE_ANGLE:
-                    self.angle_controller(Angle(value))
-                elif sensor == Sensor.STAGE_SPEED:
-                    self.speed_controller(value)
-                else:
-                    raise ValueError("Unknown sensor")
+                self.measure(sensor, value)
 
         if self._active_command is not None and \
             self._active_command.action != Command.Action.REMOTE:
             # Update speed controller with speeds from the angle controller, if the
             # angle used for control.
             if self._active_command is not None and \
-                self._active_command.action == Command.Action.RUN_TO_ANGLE:
-                self.speed_controller.set_setpoint(self.angle_controller.speed)
+                self._active_command.action == Command.Action.RUN_TO_ANGLE and \
+                self.angle_controller.speed is not None:
+                # A negative speed turns the stage back to the angle. The motor
+                # stops before it reverses.
+                speed = self.angle_controller.speed
+                forward = self._turn_forward() if speed >= 0 else not self._turn_forward()
+                self.speed_controller.set_setpoint(0.0 if self.motor_running and forward != self.motor_running_forward else abs(speed))
 
             # Updates are possible only if a frequency was calculated by the speed
             # controller.
@@ -69,6 +83,7 @@ class StageControl:
             frequency = 0
             speed = 0
         assert frequency >= 0
+        self.last_output = self.clock.time()
 
         # if self.motor.is_emergency_stop_active():
         #     self._active_command = Command(Command.Action.EMERGENCY_STOP)
@@ -78,27 +93,45 @@ class StageControl:
         if frequency < 1.0 and self.motor_running:
             self.motor.stop()
             self.motor.set_target_frequency(0)
+            self.target_frequency = 0.0
             self.motor_running = False
             return True
         elif frequency >= 1.0 and not self.motor_running:
-            turn_forward = self._active_command.turn_clockwise
+            turn_forward = self._turn_forward()
             turn_forward = turn_forward if speed >= 0 else not turn_forward
             self.motor_running_forward = turn_forward
             self.motor_running = True
             self.motor.run(turn_forward)
             self.motor.set_target_frequency(frequency)
+            self.target_frequency = frequency
+            return True
+        elif self.motor_running and self._turn_forward() != self.motor_running_forward and \
+            self._active_command.action != Command.Action.RUN_TO_ANGLE:
+            # The converter ramps down and up again in the other direction. Moves
+            # to an angle stop the motor before they reverse.
+            self.motor_running_forward = self._turn_forward()
+            self.motor.run(self.motor_running_forward)
             return True
         
-        if time() - self.last_update > 0.1:
-            self.last_update = time()
+        if self.clock.time() - self.last_update > 0.1:
+            self.last_update = self.clock.time()
             target_frequency = round(self.motor.get_target_frequency(), 2)
             if frequency != target_frequency and self.motor_running:
                 if frequency >= 0.5:
                     self.motor.set_target_frequency(frequency)
+                    self.target_frequency = frequency
                 return True
 
         return False
 
+    def _turn_forward(self) -> bool:
+        if self._active_command.action == Command.Action.RUN_TO_ANGLE:
+            return self.angle_controller.clockwise
+        elif self._active_command.direction == Command.Direction.AUTO:
+            # Continuous runs keep turning the way they do
+            return self.motor_running_forward
+        return self._active_command.turn_clockwise
+
     @property
     def activity(self) -> Command | None:
         return self._active_command
@@ -106,11 +139,13 @@ class StageControl:
     def set_activity(self, command: Command) -> bool:
         if command.action == Command.Action.EMERGENCY_STOP:
             self.motor.emergency_stop()
+            self.target_frequency = 0.0
             success = True
         elif command.action == Command.Action.STOP:
             success = self.speed_controller.set_setpoint(0)
         elif command.action == Command.Action.RUN_TO_ANGLE:
-            success = self.angle_controller.set_setpoint(Angle(command.angle), command.speed, command.turn_clockwise)
+            success = self.angle_controller.set_setpoint(Angle(command.angle), command.speed, command.direction, command.turns,
+                self.speed_controller.actual_speed or 0.0, self.motor_running_forward)
         elif command.action == Command.Action.RUN_CONTINUOUS:
             success = self.speed_controller.set_setpoint(command.speed)
         elif command.action == Command.Action.REMOTE:
@@ -1,2 +1,3 @@
 from .angle import StageAngleController
-from .speed import StageSpeedController
\ No newline at end of file
+from .speed import StageSpeedController
+from .feedforward import FrequencyMap
\ No newline at end of file
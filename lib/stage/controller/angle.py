@@ -1,40 +1,97 @@
 from simple_pid import PID
+import math
 
 from lib.utility.angle import Angle
+from lib.utility.clock import Clock, SYSTEM_CLOCK
+from lib.utility.log import log
+from ..commands import Command
+from .trajectory import MotionProfile, braking_distance, move_duration, ramp_duration
 
 # This class controls the speed based on a desired angle which is requested by
-# the user.
+# the user. A new setpoint is planned as a motion profile with limited
+# acceleration and jerk. The planned speed is used as feed-forward and the PID
+# only corrects the difference between the planned and the actual angle. The
+# progress is tracked unwrapped, so a move can span several turns.
 class StageAngleController:
-    def __init__(self, kp: float, ki: float, kd: float) -> None:
+    # Below this speed (m/s) the stage is considered to be standing still
+    STANDSTILL_SPEED = 0.01
+
+    def __init__(self, kp: float, ki: float, kd: float, stage_diameter: float = 4.5,
+                 max_acceleration: float = 0.25, max_jerk: float = 0.5, converter_acceleration: float | None = None,
+                 response_time: float = 0.0, clock: Clock = SYSTEM_CLOCK) -> None:
+        self.clock = clock
         self._control_speed: float | None = None
-        self._angle_increment = Angle(0)
+        self._angle_increment: float = 0.0
         self._desired_angle: Angle | None = None
         self._turning_clockwise: bool = True
-        self._actual_angle: Angle | None = None
-        
+        self._actual_angle: float | None = None
+
+        # Motion planning. Limits are given at the edge of the stage (m/s² and
+        # m/s³) and the profile is planned in degree. The stage can't
+        # accelerate faster than the ramp of the converter and follows the
+        # commanded speed only after the response time (s) of the drive.
+        self._radius = stage_diameter / 2
+        self._max_acceleration = min(max_acceleration, converter_acceleration) \
+            if converter_acceleration is not None else max_acceleration
+        self._max_jerk = max_jerk
+        self._response_time = response_time
+        self._max_speed: float = 0.0
+        self._profile: MotionProfile | None = None
+        self._profile_start: float = 0.0
+
+        # A reversing stage has to stop first. The move is planned again from
+        # the angle where the stage came to rest.
+        self._reversing_until: float | None = None
+        self._distance: float = 0.0
+
         # PID
-        self._pid = PID(kp, ki, kd)
+        self._pid = PID(kp, ki, kd, time_fn=clock.time)
         self._pid.sample_time = 0.1 # (100 ms)
-        self._pid.output_limits = (0, 1.0) # -1 m/s to 1 m/s
+        self._pid.output_limits = (-1.0, 1.0) # -1 m/s to 1 m/s
 
     @property
     def speed(self) -> float:
         return self._control_speed
 
-    # Update controller with new angle of the stage
-    def __call__(self, actual: Angle) -> float:
+    @property
+    def clockwise(self) -> bool:
+        return self._turning_clockwise
+
+    @property
+    def profile(self) -> MotionProfile | None:
+        return self._profile
+
+    # Update controller with new angle of the stage. The angle is kept as
+    # float, so an update allocates no Angle.
+    def __call__(self, actual: Angle | float) -> float:
+        actual = float(actual) % 360
         if self._desired_angle is not None:
-            if self._turning_clockwise:
-                if actual > self._actual_angle:
-                    self._angle_increment = self._angle_increment + actual - self._actual_angle
-                else:
-                    self._angle_increment = self._angle_increment + 360 - self._actual_angle + actual
-            else:
-                if actual < self._actual_angle:
-                    self._angle_increment = self._angle_increment + self._actual_angle - actual
-                else:
-                    self._angle_increment = self._angle_increment + self._actual_angle + 360 - actual
-            self._control_speed = self._pid(float(self._angle_increment))
+            # Shortest signed change since the last angle, counted in the
+            # direction of travel
+            delta = (actual - self._actual_angle + 180) % 360 - 180
+            self._angle_increment += delta if self._turning_clockwise else -delta
+
+            if self._reversing_until is not None:
+                if self.clock.time() < self._reversing_until:
+                    self._control_speed = 0.0
+                    self._actual_angle = actual
+                    return self._control_speed
+                self._start_profile(self._distance - self._angle_increment, 0.0)
+
+            # Feed-forward of the planned speed, the PID corrects the residual.
+            # The speed is planned ahead by the response time of the drive, so
+            # the stage follows the planned angle.
+            t = self.clock.time() - self._profile_start
+            planned_angle, _ = self._profile(t)
+            _, planned_speed = self._profile(t + self._response_time)
+            self._pid.setpoint = planned_angle
+            residual = self._pid(self._angle_increment)
+
+            # A lagging stage is not allowed to catch up faster than it can
+            # still stop at the angle. Past the angle it turns back.
+            limit = self._stopping_speed(self._to_speed(self._profile.distance - self._angle_increment))
+            limit = min(max(limit, -self._max_speed), self._max_speed)
+            self._control_speed = min(max(self._to_speed(planned_speed) + residual, min(limit, 0.0)), max(limit, 0.0))
         self._actual_angle = actual
         return self._control_speed
 
@@ -43,31 +100,99 @@ class StageAngleController:
         return self._desired_angle
 
     # Set a new desired angle of the stage with the speed it should run with.
-    def set_setpoint(self, angle: Angle, speed: float, clockwise: bool) -> bool:
+    # The stage makes the given number of full turns before it stops at the
+    # angle. With the AUTO direction the faster way is taken, considering the
+    # current motion of the stage.
+    def set_setpoint(self, angle: Angle, speed: float, direction: Command.Direction, turns: int = 0,
+                     current_speed: float = 0.0, moving_clockwise: bool | None = None) -> bool:
         if self._actual_angle is None:
             return False
-        
-        # Calculate control angle
-        if clockwise:
-            if self._actual_angle > angle:
-                control_angle = Angle(360) - self._actual_angle + angle
-            else:
-                control_angle = angle - self._actual_angle
-        else:
-            if self._actual_angle < angle:
-                control_angle = self._actual_angle + 360 - angle
-            else:
-                control_angle = self._actual_angle - angle
 
-        # Configure PID with control speed
-        self._pid.set_auto_mode(False)
-        self._pid(0)
-        self._angle_increment = Angle(0)
-        self._pid.setpoint = float(control_angle)
-        self._pid.output_limits = (0, speed)
-        self._pid.set_auto_mode(True, last_output=self._control_speed)
-        print(self._pid.output_limits, self._control_speed)
+        moving = moving_clockwise is not None and current_speed > self.STANDSTILL_SPEED
+        if direction == Command.Direction.AUTO:
+            clockwise = self._fastest_direction(angle, speed, turns, current_speed, moving_clockwise if moving else None)
+        else:
+            clockwise = direction == Command.Direction.CLOCKWISE
 
+        # The limits of the move
+        self._max_speed = speed
+        self._pid.output_limits = (-speed, speed)
         self._desired_angle = angle
         self._turning_clockwise = clockwise
+        self._angle_increment = 0.0
+
+        if moving and moving_clockwise != clockwise:
+            # Stop first and plan the move after the stage came to rest
+            v = self._to_degree(current_speed)
+            self._distance = self._distance_to(angle, clockwise, turns)
+            self._reversing_until = self.clock.time() + self._braking_duration(v)
+            self._control_speed = 0.0
+        else:
+            # Plan the motion from the current speed
+            v = self._to_degree(current_speed) if moving else 0.0
+            self._reversing_until = None
+            self._start_profile(self._distance_to(angle, clockwise, turns, v), v)
+        log.debug("StageAngleController", "New setpoint", angle=float(angle), speed=speed, clockwise=clockwise,
+                  reversing=self._reversing_until is not None)
         return True
+
+    def _start_profile(self, distance: float, start_speed: float) -> None:
+        self._profile = MotionProfile(max(distance, 0.0),
+            self._to_degree(self._max_speed),
+            self._to_degree(self._max_acceleration),
+            self._to_degree(self._max_jerk),
+            start_speed)
+        self._profile_start = self.clock.time()
+        self._reversing_until = None
+
+        # Configure PID for the residual
+        self._pid.reset()
+        self._angle_increment = 0.0
+        self._pid.setpoint = 0
+
+    def _distance_to(self, angle: Angle, clockwise: bool, turns: int, start_speed: float = 0.0) -> float:
+        """Returns the distance in degree to the angle in the given direction.
+        A full turn is added, if the stage can't stop in time."""
+        if clockwise:
+            distance = (float(angle) - float(self._actual_angle)) % 360
+        else:
+            distance = (float(self._actual_angle) - float(angle)) % 360
+        distance += 360 * turns
+        while distance < braking_distance(start_speed, 0.0, self._to_degree(self._max_acceleration), self._to_degree(self._max_jerk)):
+            distance += 360
+        return distance
+
+    def _stopping_speed(self, distance: float) -> float:
+        """Returns the highest speed (m/s) from which the stage stops within
+        the distance (m), while it keeps going for the response time. The
+        speed is negative for negative distances."""
+        a = self._max_acceleration
+        d = self._response_time
+        return math.copysign(math.sqrt(a * a * d * d + 2 * a * abs(distance)) - a * d, distance)
+
+    def _braking_duration(self, speed: float) -> float:
+        return ramp_duration(speed, 0.0, self._to_degree(self._max_acceleration), self._to_degree(self._max_jerk))
+
+    def _fastest_direction(self, angle: Angle, speed: float, turns: int,
+                           current_speed: float, moving_clockwise: bool | None) -> bool:
+        v = self._to_degree(current_speed)
+        v_max = self._to_degree(speed)
+        a_max = self._to_degree(self._max_acceleration)
+        j_max = self._to_degree(self._max_jerk)
+
+        durations = {}
+        for clockwise in (True, False):
+            if moving_clockwise is None or moving_clockwise == clockwise:
+                distance = self._distance_to(angle, clockwise, turns, v if moving_clockwise is not None else 0.0)
+                durations[clockwise] = move_duration(distance, v_max, a_max, j_max, v if moving_clockwise is not None else 0.0)
+            else:
+                # The stage drifts on while it stops
+                distance = self._distance_to(angle, clockwise, turns) + braking_distance(v, 0.0, a_max, j_max)
+                durations[clockwise] = self._braking_duration(v) + move_duration(distance, v_max, a_max, j_max)
+        return durations[True] <= durations[False]
+
+    def _to_degree(self, value: float) -> float:
+        return math.degrees(value / self._radius)
+
+    def _to_speed(self, value: float) -> float:
+        return math.radians(value) * self._radius
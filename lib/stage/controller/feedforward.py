@@ -0,0 +1,105 @@
+from typing import Callable
+import bisect
+import json
+import os
+
+from lib.stage.motor import FrequencyConverter
+from lib.utility.clock import Clock, SYSTEM_CLOCK
+
+# Steady state converter frequency for a stage speed. The map is a lookup
+# table of measured points, which is interpolated linearly. It always contains
+# the origin, so an empty map results in no feed-forward at all. The table is
+# created by a calibration run and refined online while the stage is running.
+class FrequencyMap:
+    def __init__(self, speeds: list[float] | None = None, frequencies: list[float] | None = None,
+                 learning_rate: float = 0.05, min_spacing: float = 0.05) -> None:
+        self.speeds = [0.0]
+        self.frequencies = [0.0]
+        self.learning_rate = learning_rate
+        self.min_spacing = min_spacing
+        for speed, frequency in zip(speeds or [], frequencies or []):
+            self.insert(speed, frequency)
+
+    def __len__(self) -> int:
+        return len(self.speeds) - 1
+
+    def __call__(self, speed: float) -> float:
+        if len(self.speeds) == 1 or speed <= 0:
+            return 0.0
+        i = bisect.bisect_right(self.speeds, speed)
+        if i >= len(self.speeds):
+            # Extrapolate with the slope of the last segment
+            i = len(self.speeds) - 1
+        s0, s1 = self.speeds[i - 1], self.speeds[i]
+        f0, f1 = self.frequencies[i - 1], self.frequencies[i]
+        return max(f0 + (speed - s0) * (f1 - f0) / (s1 - s0), 0.0)
+
+    def insert(self, speed: float, frequency: float) -> None:
+        if speed <= 0:
+            return
+        i = bisect.bisect_left(self.speeds, speed)
+        if i < len(self.speeds) and self.speeds[i] == speed:
+            self.frequencies[i] = frequency
+        else:
+            self.speeds.insert(i, speed)
+            self.frequencies.insert(i, frequency)
+
+    def refine(self, speed: float, frequency: float) -> None:
+        """Moves the map towards a measured steady state. Speeds which are
+        not covered by the map yet are added as new points, otherwise the
+        neighbouring points are corrected according to their weight."""
+        if speed <= 0:
+            return
+        i = min(bisect.bisect_left(self.speeds, speed), len(self.speeds) - 1)
+        if len(self.speeds) < 2 or i == 0 or \
+            min(abs(self.speeds[i] - speed), abs(self.speeds[i - 1] - speed)) >= self.min_spacing:
+            self.insert(speed, frequency)
+            return
+        error = frequency - self(speed)
+        s0, s1 = self.speeds[i - 1], self.speeds[i]
+        w1 = min(max((speed - s0) / (s1 - s0), 0.0), 1.0)
+        if i - 1 > 0:
+            self.frequencies[i - 1] += self.learning_rate * error * (1 - w1)
+        self.frequencies[i] += self.learning_rate * error * w1
+
+    @staticmethod
+    def load(path: str) -> 'FrequencyMap':
+        if not os.path.exists(path):
+            return FrequencyMap()
+        with open(path) as f:
+            data = json.load(f)
+        return FrequencyMap(data["speeds"], data["frequencies"])
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump({"speeds": self.speeds[1:], "frequencies": self.frequencies[1:]}, f, indent=2)
+
+def calibrate(converter: FrequencyConverter, measure_speed: Callable[[], float | None],
+              frequencies: list[float], settle: float = 5.0, duration: float = 3.0,
+              clock: Clock = SYSTEM_CLOCK) -> FrequencyMap:
+    """Sweeps the converter through the given frequencies and records the
+    steady state speed of the stage for each of them. The speed is averaged
+    over duration after waiting settle seconds for the stage to follow."""
+    frequency_map = FrequencyMap()
+    converter.set_target_frequency(frequencies[0])
+    converter.run(True)
+    try:
+        for frequency in frequencies:
+            converter.set_target_frequency(frequency)
+            clock.sleep(settle)
+            speeds = []
+            started = clock.time()
+            while clock.time() - started < duration:
+                speed = measure_speed()
+                if speed is not None:
+                    speeds.append(speed)
+            if len(speeds) > 0:
+                speed = sum(speeds) / len(speeds)
+                frequency_map.insert(speed, frequency)
+                print("[Calibration] %.2f Hz -> %.3f m/s" % (frequency, speed))
+            else:
+                print("[Calibration] %.2f Hz -> no speed measured" % frequency)
+    finally:
+        converter.set_target_frequency(0)
+        converter.stop()
+    return frequency_map
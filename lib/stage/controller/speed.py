@@ -1,44 +1,92 @@
 from typing import Any
 from simple_pid import PID
 
+from lib.utility.clock import Clock, SYSTEM_CLOCK
+from .feedforward import FrequencyMap
+
 # Controls the frequency of the motor based on the expected and actual speed of
-# the stage.
+# the stage. The frequency map gives the steady state frequency of the desired
+# speed as feed-forward and the PID only corrects the residual. While the stage
+# runs steady, the map is refined with the frequency that actually holds the
+# speed.
 class StageSpeedController:
-    def __init__(self, max_frequency: float, kp: float, ki: float, kd: float) -> None:
+    def __init__(self, max_frequency: float, kp: float, ki: float, kd: float,
+                 frequency_map: FrequencyMap | None = None, steady_tolerance: float = 0.02,
+                 steady_frequency_tolerance: float = 1.0, steady_duration: float = 2.0,
+                 clock: Clock = SYSTEM_CLOCK) -> None:
+        self.clock = clock
         self._control_frequency: float | None = None
         self._desired_speed: float | None = None
         self._actual_speed: float | None = None
+        self._max_frequency = max_frequency
+
+        # Feed-forward
+        self.frequency_map = frequency_map if frequency_map is not None else FrequencyMap()
+        self._steady_tolerance = steady_tolerance
+        self._steady_frequency_tolerance = steady_frequency_tolerance
+        self._steady_duration = steady_duration
+        self._steady_since: float | None = None
+        self._steady_speed: float = 0.0
+        self._steady_frequency: float = 0.0
 
         # PID
-        self._pid = PID(kp, ki, kd)
+        self._pid = PID(kp, ki, kd, time_fn=clock.time)
         self._pid.sample_time = 0.05 # (50 ms)
-        self._pid.output_limits = (0, max_frequency)
+        self._pid.output_limits = (-max_frequency, max_frequency)
 
     @property
     def frequency(self) -> float | None:
         return self._control_frequency
-    
+
     @property
     def actual_speed(self) -> float | None:
         return self._actual_speed
 
     def __call__(self, actual: float) -> float:
-        if self._desired_speed is not None:
-            self._control_frequency = self._pid(actual)
+        if self._desired_speed is not None and self._desired_speed <= 0:
+            # Stopping is left to the ramp of the converter
+            self._pid.reset()
+            self._control_frequency = 0.0
+        elif self._desired_speed is not None:
+            feed_forward = self.frequency_map(self._desired_speed)
+            self._control_frequency = min(max(feed_forward + self._pid(actual), 0.0), self._max_frequency)
+            self._refine(actual)
 
         self._actual_speed = actual
         return self._control_frequency
-    
+
+    def _refine(self, actual: float) -> None:
+        # Any speed which is held for a while with an almost constant frequency
+        # is a steady state of the stage, even if it is not the desired speed
+        # yet.
+        now = self.clock.time()
+        if self._steady_since is None or self._control_frequency <= 0 or \
+            abs(actual - self._steady_speed) > self._steady_tolerance or \
+            abs(self._control_frequency - self._steady_frequency) > self._steady_frequency_tolerance:
+            self._steady_since = now
+            self._steady_speed = actual
+            self._steady_frequency = self._control_frequency
+        elif now - self._steady_since >= self._steady_duration:
+            feed_forward = self.frequency_map(self._desired_speed)
+            self.frequency_map.refine(actual, self._control_frequency)
+
+            # Move the change of the feed-forward out of the integral, otherwise
+            # the frequency jumps
+            _, integral, _ = self._pid.components
+            self._pid.set_auto_mode(False)
+            self._pid.set_auto_mode(True, integral + feed_forward - self.frequency_map(self._desired_speed))
+            self._steady_since = None
+
     @property
     def setpoint(self) -> float:
         return self._desired_speed
-    
+
     def set_setpoint(self, speed: float) -> bool:
         if self._actual_speed is None:
             return False
-        
+
         # Configure PID
         self._pid.setpoint = speed
 
         self._desired_speed = speed
-        return True
\ No newline at end of file
+        return True
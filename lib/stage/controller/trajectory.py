@@ -0,0 +1,130 @@
+from bisect import bisect_right
+import math
+
+# Time parameterized motion over a distance. Speed, acceleration and jerk are
+# limited, which results in an S-curve velocity profile (a trapezoidal profile
+# with smooth corners). The profile is planned in closed form as a few phases
+# of constant jerk: a ramp from the start speed to the peak speed, a cruise at
+# the peak speed and a ramp down to a standstill. Each control cycle evaluates
+# the phase at the time, so planning and lookup cost the same for any
+# distance. Units are arbitrary but have to match, e.g. degree, degree/s,
+# degree/s² and degree/s³.
+class MotionProfile:
+    def __init__(self, distance: float, speed: float, acceleration: float, jerk: float,
+                 start_speed: float = 0.0) -> None:
+        # Start times of the phases and position, speed, acceleration and
+        # jerk at their start
+        self._starts: list[float] = []
+        self._phases: list[tuple[float, float, float, float]] = []
+        self.duration = 0.0
+        self.distance = 0.0
+        if distance > 0 and speed > 0:
+            self._plan(distance, speed, acceleration, jerk, start_speed)
+
+    def __call__(self, t: float) -> tuple[float, float]:
+        """Returns the planned position and speed at time t since the start
+        of the profile."""
+        if t >= self.duration or len(self._phases) == 0:
+            return self.distance, 0.0
+        i = bisect_right(self._starts, t) - 1
+        if i < 0:
+            return 0.0, self._phases[0][1]
+        p, v, a, j = self._phases[i]
+        t -= self._starts[i]
+        return p + v * t + a * t * t / 2 + j * t * t * t / 6, v + a * t + j * t * t / 2
+
+    def _plan(self, distance: float, v_max: float, a_max: float, j_max: float, v: float) -> None:
+        peak = _peak_speed(distance, v_max, a_max, j_max, v)
+        up = _ramp(v, peak, a_max, j_max)
+        down = _ramp(peak, 0.0, a_max, j_max)
+        ramps = ramp_distance(v, peak, a_max, j_max) + ramp_distance(peak, 0.0, a_max, j_max)
+        cruise = (distance - ramps) / peak if peak > 0 and distance > ramps else 0.0
+
+        t, p, a = 0.0, 0.0, 0.0
+        for duration, j in up + [(cruise, 0.0)] + down:
+            if duration <= 0:
+                continue
+            self._starts.append(t)
+            self._phases.append((p, v, a, j))
+            v, a, dp = _advance(v, a, j, duration)
+            t += duration
+            p += dp
+        self.duration = t
+        # A start speed which can't be stopped in time ends behind the distance
+        self.distance = max(p, distance)
+
+def _advance(v: float, a: float, j: float, t: float) -> tuple[float, float, float]:
+    """Returns speed, acceleration and distance after t with constant jerk"""
+    return v + a * t + j * t * t / 2, a + j * t, v * t + a * t * t / 2 + j * t * t * t / 6
+
+def _ramp(v_from: float, v_to: float, a_max: float, j_max: float) -> list[tuple[float, float]]:
+    """Returns the phases (duration and jerk) of a change of the speed, which
+    starts and ends without acceleration."""
+    dv = abs(v_to - v_from)
+    if dv == 0:
+        return []
+    j = math.copysign(j_max, v_to - v_from)
+    if dv * j_max >= a_max * a_max:
+        # Ramp up to the acceleration limit, hold it and ramp down
+        return [(a_max / j_max, j), (dv / a_max - a_max / j_max, 0.0), (a_max / j_max, -j)]
+    return [(math.sqrt(dv / j_max), j), (math.sqrt(dv / j_max), -j)]
+
+def ramp_duration(v_from: float, v_to: float, a_max: float, j_max: float) -> float:
+    return sum(duration for duration, _ in _ramp(v_from, v_to, a_max, j_max))
+
+def ramp_distance(v_from: float, v_to: float, a_max: float, j_max: float) -> float:
+    # The acceleration of a ramp is symmetric, so the average speed is the
+    # mean of both speeds
+    return (v_from + v_to) / 2 * ramp_duration(v_from, v_to, a_max, j_max)
+
+def move_duration(distance: float, speed: float, acceleration: float, jerk: float,
+                  start_speed: float = 0.0) -> float:
+    """Returns the duration of the MotionProfile with these limits without
+    planning its phases."""
+    if distance <= 0 or speed <= 0:
+        return 0.0
+    peak = _peak_speed(distance, speed, acceleration, jerk, start_speed)
+    ramps = ramp_distance(start_speed, peak, acceleration, jerk) + ramp_distance(peak, 0.0, acceleration, jerk)
+    cruise = (distance - ramps) / peak if peak > 0 and distance > ramps else 0.0
+    return ramp_duration(start_speed, peak, acceleration, jerk) + cruise + ramp_duration(peak, 0.0, acceleration, jerk)
+
+def _peak_speed(distance: float, v_max: float, a_max: float, j_max: float, v: float) -> float:
+    """Returns the highest speed between v and v_max at which the ramps to it
+    and down to a standstill fit into the distance. If even stopping right
+    away doesn't fit, the stage brakes from v."""
+    def fits(peak: float) -> bool:
+        return ramp_distance(v, peak, a_max, j_max) + ramp_distance(peak, 0.0, a_max, j_max) <= distance
+
+    if fits(v_max):
+        return v_max
+    if not fits(v):
+        return v
+    # The ramps grow monotonically with the distance of the peak to v
+    fitting, too_far = v, v_max
+    for _ in range(50):
+        middle = (fitting + too_far) / 2
+        if fits(middle):
+            fitting = middle
+        else:
+            too_far = middle
+    return fitting
+
+def braking_distance(v: float, a: float, a_max: float, j_max: float) -> float:
+    """Returns the distance needed to stop from speed v and acceleration a if
+    deceleration and jerk are limited."""
+    d = 0.0
+    if a > 0:
+        # Reduce acceleration to zero first
+        v, a, d = _advance(v, a, -j_max, a / j_max)
+    deceleration = -a
+    if deceleration * deceleration / (2 * j_max) >= v:
+        # Decelerating already harder than needed
+        return d + (v * v / (2 * deceleration) if deceleration > 0 else 0)
+
+    # Peak deceleration to stop with a jerk limited ramp to and from it
+    peak = min(math.sqrt((2 * j_max * v + deceleration * deceleration) / 2), a_max)
+    v, a, d1 = _advance(v, a, -j_max, (peak - deceleration) / j_max)
+    hold = max((v - peak * peak / (2 * j_max)) / peak, 0.0)
+    v, a, d2 = _advance(v, a, 0.0, hold)
+    _, _, d3 = _advance(v, a, j_max, peak / j_max)
+    return d + d1 + d2 + d3
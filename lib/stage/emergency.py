@@ -0,0 +1,69 @@
+from multiprocessing import Event, Array
+from threading import Thread
+from collections import deque
+from time import time
+from typing import Callable
+
+from lib.utility.log import log
+
+# Emergency stops bypass the command pipe and the control loop. The view
+# process raises the request in shared memory and a watchdog thread inside the
+# control process, which owns the converter bus, stops the converter
+# immediately.
+class EmergencyStop:
+    def __init__(self, stages: int = 1) -> None:
+        self._event = Event()
+        self._requests = Array('d', stages)
+
+    def trigger(self, stage: int = 0) -> None:
+        """Requests an emergency stop of a stage. Safe to call from any
+        process or thread."""
+        self._requests[stage] = time()
+        self._event.set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._event.wait(timeout)
+
+    def pending(self) -> list[tuple[int, float]]:
+        """Returns the stages with an unhandled request and the time of the
+        request."""
+        # Clear the event first. A request triggered while handling the pending
+        # ones sets the event again and is handled in the next round.
+        self._event.clear()
+        with self._requests.get_lock():
+            return [(stage, requested_at) for stage, requested_at in enumerate(self._requests) if requested_at > 0]
+
+    def acknowledge(self, stage: int, requested_at: float) -> None:
+        with self._requests.get_lock():
+            if self._requests[stage] == requested_at:
+                self._requests[stage] = 0
+
+class EmergencyStopWatchdog(Thread):
+    """Waits for emergency stop requests and stops the converter of the stage.
+    The measured latency from the request to the completed converter write is
+    queued for the control loop, which reports it. The latency is None if the
+    converter could not be stopped."""
+    def __init__(self, emergency_stop: EmergencyStop, stop_converter: Callable[[int], None]) -> None:
+        super().__init__(name="EmergencyStopWatchdog", daemon=True)
+        self.emergency_stop = emergency_stop
+        self.stop_converter = stop_converter
+        self.handled: deque[tuple[int, float | None]] = deque()
+        self._running = True
+
+    def run(self) -> None:
+        while self._running:
+            if not self.emergency_stop.wait(0.1):
+                continue
+            for stage, requested_at in self.emergency_stop.pending():
+                try:
+                    self.stop_converter(stage)
+                    latency = time() - requested_at
+                except Exception as e:
+                    log.error("EmergencyStopWatchdog", "Emergency stop failed", stage=stage, error=e)
+                    latency = None
+                self.emergency_stop.acknowledge(stage, requested_at)
+                self.handled.append((stage, latency))
+
+    def stop(self) -> None:
+        self._running = False
+        self.join(1.0)
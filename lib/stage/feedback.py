@@ -0,0 +1,114 @@
+from threading import Thread, Event
+from time import time
+import ipaddress
+import socket
+import math
+from pythonosc.osc_bundle_builder import OscBundleBuilder, IMMEDIATELY
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from lib.telemetry import Telemetry, StageState
+
+# Destination of the stage feedback with its own rate limit
+class FeedbackDestination:
+    def __init__(self, host: str, port: int, rate: float) -> None:
+        # Resolve the host once, sending must not wait for name resolution
+        self.address = (socket.gethostbyname(host), port)
+        self.interval = 1 / rate
+        self.next_send = 0.0
+        self.dropped = 0
+
+    @staticmethod
+    def parse(destinations: str, rate: float) -> list['FeedbackDestination']:
+        """Parses a comma separated list of destinations in the form
+        host:port or host:port@rate."""
+        parsed = []
+        for destination in destinations.split(','):
+            destination = destination.strip()
+            if destination == "":
+                continue
+            address, _, destination_rate = destination.partition('@')
+            host, _, port = address.rpartition(':')
+            parsed.append(FeedbackDestination(host, int(port), float(destination_rate) if destination_rate != "" else rate))
+        return parsed
+
+# Publishes the state of a stage to OSC/UDP destinations. The state is read
+# from the shared telemetry in a background thread. The socket never blocks,
+# a datagram which cannot be send right away is dropped.
+class StageOSCFeedback:
+    def __init__(self, telemetry: Telemetry, stage: int, destinations: list[FeedbackDestination], prefix: str = "/stage") -> None:
+        self.telemetry = telemetry
+        self.stage = stage
+        self.destinations = destinations
+        self.prefix = "%s/%i" % (prefix, stage)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if any(ipaddress.ip_address(d.address[0]).is_multicast for d in destinations):
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        self.socket.setblocking(False)
+
+        self._stopped = Event()
+        self._thread: Thread | None = None
+        self._datagram: bytes | None = None
+        self._sequence = -1
+
+    def start(self) -> None:
+        if len(self.destinations) == 0:
+            return
+        self._thread = Thread(target=self._publish, name="StageOSCFeedback", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        self.socket.close()
+
+    def _publish(self) -> None:
+        while not self._stopped.is_set():
+            now = time()
+            for destination in self.destinations:
+                if destination.next_send > now:
+                    continue
+                destination.next_send = max(destination.next_send + destination.interval, now)
+                datagram = self.datagram()
+                if datagram is None:
+                    continue
+                try:
+                    self.socket.sendto(datagram, destination.address)
+                except (BlockingIOError, OSError):
+                    destination.dropped += 1
+            next_send = min(d.next_send for d in self.destinations)
+            self._stopped.wait(max(next_send - time(), 0))
+
+    def datagram(self) -> bytes | None:
+        """Returns the OSC bundle of the latest state. The bundle is only
+        rebuild if the state changed."""
+        sequence = self.telemetry.sequence(self.stage)
+        if sequence != self._sequence:
+            state = self.telemetry.read(self.stage)
+            self._datagram = self.build(state) if state is not None else None
+            self._sequence = sequence
+        return self._datagram
+
+    def build(self, state: StageState) -> bytes:
+        bundle = OscBundleBuilder(IMMEDIATELY)
+        for address, value in (
+                ("angle", state.angle),
+                ("speed", state.speed),
+                ("frequency", state.frequency)):
+            if not math.isnan(value):
+                bundle.add_content(self._message(address, value))
+        action = state.command_action
+        if action is not None:
+            bundle.add_content(self._message("action", action.name.lower()))
+            bundle.add_content(self._message("direction", state.command_direction.name.lower()))
+            bundle.add_content(self._message("command/speed", state.command_speed))
+            if not math.isnan(state.command_angle):
+                bundle.add_content(self._message("command/angle", state.command_angle))
+        return bundle.build().dgram
+
+    def _message(self, address: str, value: float | str):
+        msg = OscMessageBuilder("%s/%s" % (self.prefix, address))
+        msg.add_arg(value)
+        return msg.build()
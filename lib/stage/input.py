@@ -1,18 +1,74 @@
-from typing import Any
-from pythonosc.osc_server import ThreadingOSCUDPServer
+from typing import Any, Callable
+from threading import Condition, Thread
+from time import time
+import select
+from pythonosc.osc_server import BlockingOSCUDPServer
 from pythonosc.dispatcher import Dispatcher
+from pythonosc import osc_packet
 
 from .commands import Command
+from lib.utility.log import log
 
 # The stage state class keeps track of input request and maps them to desired
-# commands, which are send to the control process.
+# commands, which are send to the control process. Inputs update the state
+# from their own threads inside a `with state:` block. Leaving the block
+# increments the version of the state and wakes up threads waiting for the
+# update. Readers only hold the lock and compare the version with the last one
+# they have seen, before they build a command from the state. Commands which
+# are scheduled for later are queued separately and never change the values
+# of the state, which are applied immediately.
+#
+# Changes are compared with the last immediate command, not with a scheduled
+# one, because the values of a scheduled command were never part of the state.
+# Otherwise any later message, e.g. a new speed, would send the state as it was
+# before the bundle and cancel the cue. Setting the action is always sent, so
+# a repeated stop still cancels the scheduled commands.
 class StageInputState:
     def __init__(self) -> None:
-        self.action = Command.Action.STOP
+        self._action = Command.Action.STOP
         self.direction = Command.Direction.CLOCKWISE
         self.speed = 0.0
         self.angle = 0.0
         self.frequency = 0.0
+        self.turns = 0
+        self.scheduled: list[Command] = []
+        self.version = 0
+        self._condition = Condition()
+
+        # Last command which was applied immediately and if an action was
+        # requested since then
+        self.immediate = Command(Command.Action.STOP)
+        self.requested = False
+
+    @property
+    def action(self) -> Command.Action:
+        return self._action
+
+    @action.setter
+    def action(self, action: Command.Action) -> None:
+        self._action = action
+        self.requested = True
+
+    @property
+    def lock(self) -> Condition:
+        return self._condition
+
+    def __enter__(self) -> 'StageInputState':
+        self._condition.acquire()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.version += 1
+        self._condition.notify_all()
+        self._condition.release()
+
+    def wait(self, version: int, timeout: float | None = None) -> int:
+        """Waits until the version of the state differs from the given one
+        and returns the current version. The version is unchanged if the
+        timeout expired."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
 
     @property
     def command(self) -> Command:
@@ -22,21 +78,112 @@ class StageInputState:
         elif self.action == Command.Action.RUN_CONTINUOUS:
             return Command(self.action, self.direction, self.speed)
         elif self.action == Command.Action.RUN_TO_ANGLE:
-            return Command(self.action, self.direction, self.speed, self.angle)
+            return Command(self.action, self.direction, self.speed, self.angle, turns=self.turns)
         elif self.action == Command.Action.REMOTE:
             return Command(self.action, self.direction, frequency=self.frequency)
         else:
             raise ValueError("Unknown command action")
-    
+
+    def copy(self) -> 'StageInputState':
+        """Returns a state with the same values, but without the scheduled
+        commands."""
+        state = StageInputState()
+        state.action = self.action
+        state.direction = self.direction
+        state.speed = self.speed
+        state.angle = self.angle
+        state.frequency = self.frequency
+        state.turns = self.turns
+        return state
+
+    def take_commands(self) -> list[Command]:
+        """Returns the commands to send since the last call: the command of
+        the state, if it changed or an action was requested, followed by the
+        scheduled commands."""
+        commands = []
+        if self.requested or self.changed_from(self.immediate):
+            self.immediate = self.command
+            commands.append(self.immediate)
+        self.requested = False
+        commands += self.scheduled
+        self.scheduled = []
+        return commands
+
+    def apply(self, command: Command) -> None:
+        """Takes over the values of a command. A command for later is queued
+        instead."""
+        if command.at is not None and command.at > time():
+            self.scheduled.append(command)
+            return
+        self.action = command.action
+        if command.direction != Command.Direction.NONE:
+            self.direction = command.direction
+        # Stops have the default speed of a command, which must not become
+        # the speed of the next run
+        if command.is_run():
+            self.speed = command.speed
+            if command.angle is not None:
+                self.angle = command.angle
+            self.turns = command.turns
+        if command.frequency is not None:
+            self.frequency = command.frequency
+
     def changed_from(self, command: Command) -> bool:
         return self.command != command
 
-class StageOSCInput:
-    def __init__(self, state: StageInputState, ip: str = "0.0.0.0", port: int = 1337, debug: bool = False) -> None:
+# Python-osc sleeps in the server thread until the timetag of a bundle is
+# reached. This dispatcher handles all messages of a packet right away instead.
+# The messages of a bundle for later change a copy of the state, which is
+# queued as a command with the timetag. The control process applies it at that
+# time, so all changes of a bundle take effect together. A packet with several
+# timetags is applied at the latest one. An emergency stop never waits: a
+# packet with one is handled right away, whatever its timetag.
+class StageOSCDispatcher(Dispatcher):
+    def __init__(self, state: StageInputState) -> None:
+        super().__init__()
         self.state = state
+
+    def call_handlers_for_packet(self, data: bytes, client_address: tuple[str, int]) -> list:
+        try:
+            packet = osc_packet.OscPacket(data)
+        except osc_packet.ParseError:
+            return []
+        if len(packet.messages) == 0:
+            return []
+
+        at = packet.messages[-1].time
+        if at <= time() or any(m.message.address == "/emergencystop" for m in packet.messages):
+            self._invoke(packet, client_address)
+            return []
+
+        # The handlers change the state of the dispatcher
+        live = self.state
+        self.state = live.copy()
+        try:
+            self._invoke(packet, client_address)
+            command = self.state.command
+        finally:
+            self.state = live
+        command.at = at
+        live.scheduled.append(command)
+        return []
+
+    def _invoke(self, packet: osc_packet.OscPacket, client_address: tuple[str, int]) -> None:
+        for timed_msg in packet.messages:
+            for handler in self.handlers_for_address(timed_msg.message.address):
+                handler.invoke(client_address, timed_msg.message)
+
+# The OSC input runs its own server thread. Every datagram is handled as soon
+# as it arrives. A burst of datagrams is drained from the socket in one go, so
+# the state is updated once with the latest values.
+class StageOSCInput:
+    MAX_DRAIN = 64
+
+    def __init__(self, state: StageInputState, ip: str = "0.0.0.0", port: int = 1337, debug: bool = False, on_emergency_stop: Callable[[], None] | None = None) -> None:
         self.internal_state = StageInputState()
         self.debug = debug
-        self.dispatcher = Dispatcher()
+        self.on_emergency_stop = on_emergency_stop
+        self.dispatcher = StageOSCDispatcher(state)
         self.dispatcher.map("/stop", self._osc_stop)
         self.dispatcher.map("/emergencystop", self._osc_emergencystop)
         self.dispatcher.map("/run*", self._osc_run)
@@ -44,23 +191,54 @@ class StageOSCInput:
         self.dispatcher.map("/speed", self._osc_speed)
         self.dispatcher.map("/direction", self._osc_direction)
         self.dispatcher.map("/angle", self._osc_angle)
+        self.dispatcher.map("/turns", self._osc_turns)
         self.dispatcher.map("/remote", self._osc_remote)
 
-        self.osc = ThreadingOSCUDPServer((ip, port), self.dispatcher)
-        self.osc.timeout = 0.1
+        self.osc = BlockingOSCUDPServer((ip, port), self.dispatcher)
+        self.osc.timeout = 0
+        self._thread: Thread | None = None
+        self._running = False
 
-    def __call__(self):
-        self.osc.handle_request()
+    @property
+    def state(self) -> StageInputState:
+        # The handlers change the state the dispatcher currently works on
+        return self.dispatcher.state
+
+    def start(self) -> None:
+        self._running = True
+        self._thread = Thread(target=self._serve, name="StageOSCInput", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(1.0)
+        self.osc.server_close()
+
+    def _serve(self) -> None:
+        while self._running:
+            ready, _, _ = select.select([self.osc], [], [], 0.1)
+            if not ready:
+                continue
+            with self.state:
+                drained = 0
+                while ready and drained < self.MAX_DRAIN:
+                    self.osc.handle_request()
+                    drained += 1
+                    ready, _, _ = select.select([self.osc], [], [], 0)
 
     def _debug(self, msg: str) -> None:
-        if self.debug:
-            print("[OSC] %s" % msg)
+        log.debug("OSC", msg)
 
     def _osc_stop(self, _: str, *__) -> None:
         self.state.action = Command.Action.STOP
         self._debug("Stop received")
 
     def _osc_emergencystop(self, _: str, *__) -> None:
+        # The fast path stops the converter right away. The command is still
+        # send to keep the control state in sync.
+        if self.on_emergency_stop is not None:
+            self.on_emergency_stop()
         self.state.action = Command.Action.EMERGENCY_STOP
         self._debug("Emergency stop received")
 
@@ -108,6 +286,8 @@ class StageOSCInput:
             direction = Command.Direction.CLOCKWISE
         elif osc_arguments[0].lower() == "counterclockwise":
             direction = Command.Direction.COUNTERCLOCKWISE
+        elif osc_arguments[0].lower() == "auto":
+            direction = Command.Direction.AUTO
         else:
             self._debug("Invalid direction: %s" % osc_arguments[0])
             return
@@ -126,6 +306,17 @@ class StageOSCInput:
         self.state.angle = osc_arguments[0]
         self._debug("Set new angle: %.2f" % self.state.angle)
 
+    def _osc_turns(self, addr: str, *osc_arguments) -> None:
+        if len(osc_arguments) != 1 or not isinstance(osc_arguments[0], (int, float)):
+            self._debug("Invalid turns arguments: %s" % (osc_arguments,))
+            return
+        if osc_arguments[0] < 0 or osc_arguments[0] > Command.MAX_TURNS:
+            self._debug("Invalid number of turns: %s" % osc_arguments[0])
+            return
+        self.internal_state.turns = int(osc_arguments[0])
+        self.state.turns = int(osc_arguments[0])
+        self._debug("Set new turns: %i" % self.state.turns)
+
     def _osc_remote(self, addr: str, *osc_arguments) -> None:
         if len(osc_arguments) != 2:
             self._debug("Invalid length of arguments")
@@ -1,6 +1,9 @@
 import minimalmodbus
 from abc import ABC, abstractmethod
 
+from .plant import StagePlant
+from lib.utility.log import log
+
 class FrequencyConverter(ABC):
     @abstractmethod
     def set_target_frequency(self, frequency: float) -> None:
@@ -100,7 +103,7 @@ class TestConverter(FrequencyConverter):
 
     def set_target_frequency(self, frequency: float) -> None:
         self.frequency = frequency
-        print("[Test Converter] Set target frequency to %.2f" % frequency)
+        log.debug("TestConverter", "Set target frequency", frequency=frequency)
 
     def get_target_frequency(self) -> float:
         return self.frequency
@@ -110,16 +113,45 @@ class TestConverter(FrequencyConverter):
 
     def run(self, forward: bool) -> None:
         self.running = True
-        print("[Test Converter] Set run command! Run %s" % ("forwards" if forward else "backwards"))
+        log.debug("TestConverter", "Run", forward=forward)
 
     def stop(self) -> None:
         self.running = False
-        print("[Test Converter] Set stop command!")
+        log.debug("TestConverter", "Stop")
 
     def emergency_stop(self) -> None:
         self.running = False
         self.emergency = True
-        print("[Test Converter] EMERGENCY STOP!!! Stopping immediately!")
+        log.warn("TestConverter", "Emergency stop")
     
     def is_emergency_stop_active(self) -> bool:
-        return self.emergency
\ No newline at end of file
+        return self.emergency
+
+class SimulatedConverter(FrequencyConverter):
+    """Drives the simulated plant of a stage like the real converter. An
+    emergency stop ramps down fast and stays active until the next run
+    command."""
+    def __init__(self, plant: StagePlant) -> None:
+        super().__init__()
+        self.plant = plant
+
+    def set_target_frequency(self, frequency: float) -> None:
+        self.plant.command(target_frequency=frequency)
+
+    def get_target_frequency(self) -> float:
+        return self.plant.read(StagePlant.TARGET_FREQUENCY)
+
+    def get_current_frequency(self) -> float:
+        return abs(self.plant.read(StagePlant.FREQUENCY))
+
+    def run(self, forward: bool) -> None:
+        self.plant.command(running=True, forward=forward, emergency=False)
+
+    def stop(self) -> None:
+        self.plant.command(running=False)
+
+    def emergency_stop(self) -> None:
+        self.plant.command(target_frequency=0, running=False, emergency=True)
+
+    def is_emergency_stop_active(self) -> bool:
+        return bool(self.plant.read(StagePlant.EMERGENCY))
@@ -0,0 +1,119 @@
+from multiprocessing import Array
+import math
+
+from lib.utility.clock import Clock, SYSTEM_CLOCK
+
+# Simulated physics of a stage and its frequency converter in shared memory.
+# The control process drives it through the SimulatedConverter and the sensor
+# process observes it through the SimulatedRotationSensor. The state is
+# integrated lazily by whichever process accesses it next.
+#
+# The converter ramps its output frequency towards the target. The motor pulls
+# the stage towards the synchronous speed of the output frequency with the
+# time constant of the stage inertia, while friction decelerates the stage and
+# holds it at rest if the drive is too weak.
+class StagePlant:
+    # Layout of the shared state
+    TIME = 0
+    ANGLE = 1
+    SPEED = 2
+    FREQUENCY = 3
+    TARGET_FREQUENCY = 4
+    RUNNING = 5
+    FORWARD = 6
+    EMERGENCY = 7
+    SPEED_PER_HERTZ = 8
+    TIME_CONSTANT = 9
+    FRICTION = 10
+    RAMP = 11
+    EMERGENCY_RAMP = 12
+    RADIUS = 13
+    SIZE = 14
+
+    # Longest integration step in seconds
+    STEP = 0.001
+
+    def __init__(self, start_angle: float = 180.0, clock: Clock = SYSTEM_CLOCK) -> None:
+        self.clock = clock
+        self._state = Array('d', self.SIZE)
+        self._state[self.TIME] = self.clock.time()
+        self._state[self.ANGLE] = start_angle
+        self._state[self.FORWARD] = 1
+        self.configure()
+
+    def configure(self, speed_per_hertz: float = 1 / 60, time_constant: float = 0.8,
+                  friction: float = 0.01, ramp: float = 10.0, emergency_ramp: float = 40.0,
+                  stage_diameter: float = 4.5) -> None:
+        """Sets the parameters of the model. The speed per hertz (m/s) is the
+        synchronous speed at the edge of the stage, time_constant (s) is the
+        inertia, friction (m/s²) the deceleration by friction and ramp and
+        emergency_ramp (Hz/s) the ramps of the converter."""
+        with self._state.get_lock():
+            if self._state[self.TIME_CONSTANT] > 0:
+                self._step(self.clock.time())
+            self._state[self.SPEED_PER_HERTZ] = speed_per_hertz
+            self._state[self.TIME_CONSTANT] = time_constant
+            self._state[self.FRICTION] = friction
+            self._state[self.RAMP] = ramp
+            self._state[self.EMERGENCY_RAMP] = emergency_ramp
+            self._state[self.RADIUS] = stage_diameter / 2
+
+    def command(self, target_frequency: float | None = None, running: bool | None = None,
+                forward: bool | None = None, emergency: bool | None = None) -> None:
+        """Changes the inputs of the converter. Values which are None are
+        kept."""
+        with self._state.get_lock():
+            self._step(self.clock.time())
+            for index, value in ((self.TARGET_FREQUENCY, target_frequency), (self.RUNNING, running),
+                                 (self.FORWARD, forward), (self.EMERGENCY, emergency)):
+                if value is not None:
+                    self._state[index] = float(value)
+
+    def read(self, index: int) -> float:
+        with self._state.get_lock():
+            self._step(self.clock.time())
+            return self._state[index]
+
+    def state(self) -> tuple[float, float, float]:
+        """Returns the angle (degree), speed (m/s, positive if clockwise) and
+        output frequency (Hz, positive if forward) of the stage now."""
+        with self._state.get_lock():
+            self._step(self.clock.time())
+            return self._state[self.ANGLE], self._state[self.SPEED], self._state[self.FREQUENCY]
+
+    def _step(self, now: float) -> None:
+        s = self._state
+        dt = now - s[self.TIME]
+        if dt <= 0:
+            return
+        k, tau, friction = s[self.SPEED_PER_HERTZ], s[self.TIME_CONSTANT], s[self.FRICTION]
+        radius = s[self.RADIUS]
+        angle, v, f = s[self.ANGLE], s[self.SPEED], s[self.FREQUENCY]
+        if s[self.EMERGENCY]:
+            target, ramp = 0.0, s[self.EMERGENCY_RAMP]
+        else:
+            target = s[self.TARGET_FREQUENCY] * (1 if s[self.FORWARD] else -1) if s[self.RUNNING] else 0.0
+            ramp = s[self.RAMP]
+
+        steps = max(math.ceil(dt / self.STEP), 1)
+        h = dt / steps
+        for _ in range(steps):
+            # Converter ramp
+            f = min(f + ramp * h, target) if f < target else max(f - ramp * h, target)
+
+            # Motor drive and friction
+            drive = (k * f - v) / tau
+            if v == 0 and abs(drive) <= friction:
+                continue
+            direction = math.copysign(1.0, v if v != 0 else drive)
+            v_next = v + (drive - friction * direction) * h
+            if v != 0 and math.copysign(1.0, v_next) != direction:
+                # Friction stops the stage, but does not reverse it
+                v_next = 0.0
+            angle += math.degrees((v + v_next) / 2 * h / radius)
+            v = v_next
+
+        s[self.TIME] = now
+        s[self.ANGLE] = angle % 360
+        s[self.SPEED] = v
+        s[self.FREQUENCY] = f
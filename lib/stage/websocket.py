@@ -0,0 +1,119 @@
+from threading import Thread, Event
+import asyncio
+import json
+import websockets
+from pythonosc.dispatcher import Dispatcher
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from .input import StageInputState
+from lib.telemetry import Telemetry
+from lib.utility.log import log
+
+# WebSocket endpoint of a stage. Clients send the same operations as OSC
+# clients as JSON, e.g. {"address": "/speed", "args": [0.5]}, and they are
+# handled by the dispatcher of the OSC input. Every client receives the state
+# of the stage at the configured rate. A client has room for one pending frame
+# only. If it is too slow to take a frame before the next one, the old frame is
+# dropped, so a slow client never builds up a backlog. The server runs its own
+# event loop in a thread, but it is bound before start returns, so a port in
+# use fails the setup of the view like the other inputs.
+class StageWebSocketInput:
+    def __init__(self, state: StageInputState, dispatcher: Dispatcher, telemetry: Telemetry, stage: int,
+                 ip: str = "0.0.0.0", port: int = 8765, rate: float = 10.0, debug: bool = False) -> None:
+        self.state = state
+        self.dispatcher = dispatcher
+        self.telemetry = telemetry
+        self.stage = stage
+        self.address = (ip, port)
+        self.interval = 1 / rate
+        self.debug = debug
+
+        self._clients: set[asyncio.Queue] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopped: asyncio.Event | None = None
+        self._thread: Thread | None = None
+        self._error: Exception | None = None
+
+    def start(self) -> None:
+        ready = Event()
+        self._thread = Thread(target=asyncio.run, args=(self._serve(ready),), name="StageWebSocketInput", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def stop(self) -> None:
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        if self._thread is not None:
+            self._thread.join(1.0)
+
+    def _debug(self, msg: str) -> None:
+        log.debug("WebSocket", msg)
+
+    async def _serve(self, ready: Event) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        try:
+            server = await websockets.serve(self._client, *self.address)
+        except OSError as e:
+            self._error = e
+            return
+        finally:
+            ready.set()
+        async with server:
+            broadcast = asyncio.create_task(self._broadcast())
+            await self._stopped.wait()
+            broadcast.cancel()
+            await asyncio.gather(broadcast, return_exceptions=True)
+
+    async def _broadcast(self) -> None:
+        sequence = -1
+        while True:
+            await asyncio.sleep(self.interval)
+            if len(self._clients) == 0 or self.telemetry.sequence(self.stage) == sequence:
+                continue
+            sequence = self.telemetry.sequence(self.stage)
+            state = self.telemetry.read(self.stage)
+            if state is None:
+                continue
+            frame = json.dumps(dict(stage=self.stage, **state.as_dict()))
+            for queue in self._clients:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(frame)
+
+    async def _client(self, connection) -> None:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._clients.add(queue)
+        sender = asyncio.create_task(self._send(connection, queue))
+        try:
+            async for request in connection:
+                self._handle(request, connection.remote_address)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._clients.discard(queue)
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+
+    async def _send(self, connection, queue: asyncio.Queue) -> None:
+        try:
+            while True:
+                frame = await queue.get()
+                await connection.send(frame)
+        except websockets.ConnectionClosed:
+            pass
+
+    def _handle(self, request: str | bytes, client_address: tuple[str, int]) -> None:
+        try:
+            operation = json.loads(request)
+            msg = OscMessageBuilder(operation["address"])
+            for arg in operation.get("args", []):
+                msg.add_arg(arg)
+            dgram = msg.build().dgram
+        except Exception as e:
+            self._debug("Invalid request %s: %s" % (request, e))
+            return
+        with self.state:
+            self.dispatcher.call_handlers_for_packet(dgram, client_address)
@@ -0,0 +1,150 @@
+from multiprocessing import RawArray
+from typing import NamedTuple, Any
+import struct
+import math
+import zlib
+
+from .stage.commands import Command
+
+class StageState(NamedTuple):
+    """Snapshot of the telemetry of one stage. Values which are not known yet
+    are NaN."""
+    sequence: int
+    time: float
+    angle: float
+    speed: float
+    frequency: float
+    forward: float
+    action: float
+    direction: float
+    command_speed: float
+    command_angle: float
+    measurement: float
+    emergency_stop: float
+
+    @property
+    def command_action(self) -> Command.Action | None:
+        return Command.Action(int(self.action)) if not math.isnan(self.action) else None
+
+    @property
+    def command_direction(self) -> Command.Direction | None:
+        return Command.Direction(int(self.direction)) if not math.isnan(self.direction) else None
+
+    def as_dict(self) -> dict[str, Any]:
+        """Returns the state with JSON compatible values. Unknown values are
+        None."""
+        action = self.command_action
+        direction = self.command_direction
+        return {
+            "time": self.time,
+            "angle": _optional(self.angle),
+            "speed": _optional(self.speed),
+            "frequency": _optional(self.frequency),
+            "forward": bool(self.forward),
+            "command": {
+                "action": action.name.lower(),
+                "direction": direction.name.lower(),
+                "speed": _optional(self.command_speed),
+                "angle": _optional(self.command_angle)
+            } if action is not None else None,
+            "converter": {
+                "emergency_stop": bool(self.emergency_stop) if not math.isnan(self.emergency_stop) else None
+            },
+            "health": {
+                "control": self.time,
+                "sensor": _optional(self.measurement)
+            }
+        }
+
+def _optional(value: float) -> float | None:
+    return None if math.isnan(value) else value
+
+# Latest state of all stages in shared memory. The control process writes the
+# state of a stage once per cycle. Any other process reads consistent
+# snapshots without a pipe between the processes, so the number of readers has
+# no effect on the control process. Every stage is guarded by a sequence
+# counter, which is odd while the state is written.
+#
+# The counter alone only works if the stores of the writer become visible in
+# program order, like on x86. Neither process has a memory barrier and ARM,
+# which runs the stage, may reorder the plain stores and loads. So the writer
+# also stores a CRC-32 of the values after them and readers check it on their
+# copy. A torn copy is read again, up to a bound, and never returned.
+class Telemetry:
+    # Sequence, values and checksum of every stage
+    _STRIDE = len(StageState._fields) + 1
+    _PAYLOAD = struct.Struct('<%id' % (len(StageState._fields) - 1))
+    _MAX_RETRIES = 1000
+
+    def __init__(self, stages: int = 1) -> None:
+        self.stages = stages
+        self._buffer = RawArray('d', stages * self._STRIDE)
+        self._values: memoryview | None = None
+        self._payloads: list[memoryview] = []
+
+    def __getstate__(self) -> dict[str, Any]:
+        # The views are created again in every process
+        state = self.__dict__.copy()
+        state['_values'] = None
+        state['_payloads'] = []
+        return state
+
+    def _views(self) -> memoryview:
+        # Bytes of the values of every stage, which the checksum covers
+        data = memoryview(self._buffer).cast('B')
+        self._values = data.cast('d')
+        size = self._PAYLOAD.size
+        self._payloads = [data[(stage * self._STRIDE + 1) * 8:(stage * self._STRIDE + 1) * 8 + size]
+                          for stage in range(self.stages)]
+        return self._values
+
+    def write(self, stage: int, timestamp: float, angle: float | None, speed: float | None,
+              frequency: float | None, forward: bool, command: Command | None,
+              measurement: float | None = None, emergency_stop: bool | None = None) -> None:
+        # Items of a memoryview are set without the temporary objects of a
+        # ctypes array
+        b = self._values
+        if b is None:
+            b = self._views()
+        offset = stage * self._STRIDE
+        b[offset] += 1
+        b[offset + 1] = timestamp
+        b[offset + 2] = float(angle) if angle is not None else math.nan
+        b[offset + 3] = speed if speed is not None else math.nan
+        b[offset + 4] = frequency if frequency is not None else math.nan
+        b[offset + 5] = 1.0 if forward else 0.0
+        if command is not None:
+            b[offset + 6] = command.action.value
+            b[offset + 7] = command.direction.value
+            b[offset + 8] = command.speed
+            b[offset + 9] = command.angle if command.angle is not None else math.nan
+        else:
+            b[offset + 6] = b[offset + 7] = b[offset + 8] = b[offset + 9] = math.nan
+        b[offset + 10] = measurement if measurement is not None else math.nan
+        b[offset + 11] = float(emergency_stop) if emergency_stop is not None else math.nan
+        b[offset + 12] = zlib.crc32(self._payloads[stage])
+        b[offset] += 1
+
+    def sequence(self, stage: int) -> int:
+        """Returns the sequence counter of a stage, which changes on every
+        write."""
+        return int(self._buffer[stage * self._STRIDE])
+
+    def read(self, stage: int) -> StageState | None:
+        """Returns the latest state of a stage or None if the stage was not
+        written yet."""
+        b = self._values
+        if b is None:
+            b = self._views()
+        offset = stage * self._STRIDE
+        payload = self._payloads[stage]
+        for _ in range(self._MAX_RETRIES):
+            sequence = b[offset]
+            data = payload.tobytes()
+            checksum = b[offset + 12]
+            if sequence % 2 == 0 and b[offset] == sequence:
+                if sequence == 0:
+                    return None
+                if zlib.crc32(data) == checksum:
+                    return StageState(int(sequence), *self._PAYLOAD.unpack(data))
+        return None
@@ -0,0 +1,49 @@
+from typing import NamedTuple
+
+from .sensor import Sensor
+from .utility.histogram import Histogram
+
+class TracedReadings(NamedTuple):
+    """Sensor readings with the stamps of the camera frame they were measured
+    on: capture of the frame, detection of the markers done and send to the
+    control process."""
+    readings: list[tuple[Sensor, float]]
+    capture: float
+    detection: float
+    send: float
+
+# Latencies of one stage from a camera frame to the converter. Every traced
+# reading is followed through the pipeline
+#   capture -> detection -> send -> receive -> output -> write
+# and the time between two stamps is recorded in the histogram of the later
+# one. The output is the frequency calculated by the controllers and the write
+# is the completed Modbus transaction. Total is the time from the capture to the
+# write, if the reading caused a write.
+class LatencyTrace:
+    SEGMENTS = ('detection', 'send', 'receive', 'output', 'write', 'total')
+
+    def __init__(self) -> None:
+        self.histograms = {segment: Histogram() for segment in self.SEGMENTS}
+
+    def record(self, capture: float, detection: float, send: float, receive: float, output: float, write: float | None = None) -> None:
+        h = self.histograms
+        h['detection'].record(detection - capture)
+        h['send'].record(send - detection)
+        h['receive'].record(receive - send)
+        h['output'].record(output - receive)
+        if write is not None:
+            h['write'].record(write - output)
+            h['total'].record(write - capture)
+
+    def summary(self) -> tuple[float, ...]:
+        """Returns count, p50, p99 and max in seconds of every segment in the
+        order of SEGMENTS."""
+        values: list[float] = []
+        for segment in self.SEGMENTS:
+            h = self.histograms[segment]
+            values += [float(h.count), h.percentile(50), h.percentile(99), h.max]
+        return tuple(values)
+
+    def reset(self) -> None:
+        for h in self.histograms.values():
+            h.reset()
@@ -0,0 +1,39 @@
+from abc import ABC, abstractmethod
+import time
+
+# Source of time for the runtimes, controllers and simulated devices. Production
+# code uses the system clock. A simulation passes a virtual clock instead, which
+# only moves forward when it is advanced, so it can run much faster than real
+# time with the same timing behavior.
+class Clock(ABC):
+    @abstractmethod
+    def time(self) -> float:
+        """Returns the current time in seconds since the epoch."""
+        pass
+
+    @abstractmethod
+    def sleep(self, seconds: float) -> None:
+        pass
+
+class SystemClock(Clock):
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+class VirtualClock(Clock):
+    def __init__(self, start: float | None = None) -> None:
+        self._now = time.time() if start is None else start
+
+    def time(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float) -> None:
+        self.advance(seconds)
+
+    def advance(self, seconds: float) -> None:
+        if seconds > 0:
+            self._now += seconds
+
+SYSTEM_CLOCK = SystemClock()
@@ -0,0 +1,64 @@
+from array import array
+from bisect import bisect_left
+import math
+
+# Upper bounds of the buckets in seconds, from 50 µs to 2 s. Durations above
+# the last bound are counted in an overflow bucket.
+DEFAULT_BOUNDS = (
+    0.00005, 0.0001, 0.0002, 0.0005,
+    0.001, 0.002, 0.005,
+    0.01, 0.02, 0.05,
+    0.1, 0.2, 0.5,
+    1.0, 2.0)
+
+# Histogram of durations with fixed buckets. Recording a value only increments
+# a counter, so it costs the same no matter how many values were recorded and
+# can stay enabled in production. Percentiles are estimated with the upper
+# bound of the bucket they fall into.
+class Histogram:
+    def __init__(self, bounds: tuple[float, ...] = DEFAULT_BOUNDS) -> None:
+        self.bounds = bounds
+        self.counts = array('Q', bytes(8 * (len(bounds) + 1)))
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        """Returns the upper bound of the bucket which contains the q-th
+        percentile (0 to 100) or NaN if nothing was recorded. Values in the
+        overflow bucket are estimated with the maximum."""
+        if self.count == 0:
+            return math.nan
+        rank = q / 100 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count > 0:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count > 0 else math.nan
+
+    def merge(self, other: 'Histogram') -> None:
+        assert self.bounds == other.bounds, "Histograms with different buckets can't be merged"
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def reset(self) -> None:
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
@@ -0,0 +1,121 @@
+from threading import Thread, Lock
+from collections import deque
+from enum import IntEnum
+from typing import Any, NamedTuple, TextIO
+import queue
+import time
+import sys
+import os
+
+class Level(IntEnum):
+    DEBUG = 10
+    INFO = 20
+    WARN = 30
+    ERROR = 40
+
+class LogRecord(NamedTuple):
+    time: float
+    level: Level
+    source: str
+    message: str
+    fields: dict[str, Any]
+
+    def format(self) -> str:
+        line = "%s.%03i [%s] [%s] %s" % (time.strftime("%H:%M:%S", time.localtime(self.time)),
+            int(self.time * 1000) % 1000, self.level.name, self.source, self.message)
+        if len(self.fields) > 0:
+            line += " " + " ".join("%s=%s" % (k, ("%.4g" % v) if isinstance(v, float) else v) for k, v in self.fields.items())
+        return line
+
+# Structured log of a process. A call only creates the record and puts it into
+# a queue, a background thread formats and writes it, so a slow console never
+# delays the caller. Every record, including those below the level, is kept in
+# a ring of the latest records, which can be dumped after a fault. A process
+# started by fork gets a new writer and an empty ring on its first record.
+class Logger:
+    def __init__(self, level: Level = Level.INFO, capacity: int = 1000, stream: TextIO | None = None) -> None:
+        self.level = level
+        self.stream = stream
+        self.recent: deque[LogRecord] = deque(maxlen=capacity)
+        self._queue: queue.Queue[LogRecord] = queue.Queue()
+        self._last: dict[tuple[str, str], tuple[float, int]] = {}
+        self._lock = Lock()
+        self._pid: int | None = None
+
+    def _ensure_writer(self) -> None:
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.recent.clear()
+            self._last.clear()
+            self._queue = queue.Queue()
+            Thread(target=self._write, name="LogWriter", daemon=True).start()
+
+    def _write(self) -> None:
+        q = self._queue
+        while True:
+            record = q.get()
+            stream = self.stream or sys.stdout
+            try:
+                stream.write(record.format() + "\n")
+                # Write everything which is pending at once
+                while not q.empty():
+                    q.task_done()
+                    record = q.get_nowait()
+                    stream.write(record.format() + "\n")
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+            q.task_done()
+
+    def log(self, level: Level, source: str, message: str, **fields: Any) -> None:
+        if self._pid != os.getpid():
+            self._ensure_writer()
+        record = LogRecord(time.time(), level, source, message, fields)
+        self.recent.append(record)
+        if level >= self.level:
+            self._queue.put(record)
+
+    def debug(self, source: str, message: str, **fields: Any) -> None:
+        self.log(Level.DEBUG, source, message, **fields)
+
+    def info(self, source: str, message: str, **fields: Any) -> None:
+        self.log(Level.INFO, source, message, **fields)
+
+    def warn(self, source: str, message: str, **fields: Any) -> None:
+        self.log(Level.WARN, source, message, **fields)
+
+    def error(self, source: str, message: str, **fields: Any) -> None:
+        self.log(Level.ERROR, source, message, **fields)
+
+    def every(self, interval: float, level: Level, source: str, message: str, **fields: Any) -> None:
+        """Logs a repeated message at most once per interval in seconds. The
+        number of suppressed messages is added to the next one."""
+        key = (source, message)
+        now = time.monotonic()
+        last, suppressed = self._last.get(key, (-interval, 0))
+        if now - last < interval:
+            self._last[key] = (last, suppressed + 1)
+            return
+        self._last[key] = (now, 0)
+        if suppressed > 0:
+            fields["suppressed"] = suppressed
+        self.log(level, source, message, **fields)
+
+    def flush(self) -> None:
+        """Waits until all queued records are written."""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def dump(self, stream: TextIO | None = None) -> None:
+        """Writes the ring of the latest records synchronously."""
+        stream = stream or self.stream or sys.stdout
+        self.flush()
+        stream.write("--- %i latest log records ---\n" % len(self.recent))
+        for record in list(self.recent):
+            stream.write(record.format() + "\n")
+        stream.write("---\n")
+        stream.flush()
+
+log = Logger()
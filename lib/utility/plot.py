@@ -1,53 +1,90 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import math
 
-MAX_FREQUENCY = 40
-
-def on_close(_):
-    global closed
-    closed = True
-
-def init_graphs():
-    global closed
-    global fig
-    global rotation_ax
-    global rotation_r
-    global rotation_theta
-
-    closed = False
-    fig = plt.figure()
-    fig.canvas.mpl_connect('close_event', on_close)
-
-    # Rotation diagram
-    rotation_ax = plt.subplot(projection='polar')
-    rotation_r = []
-    rotation_theta = []
-
-    rotation_ax.set_rlim(top=MAX_FREQUENCY)
-    rotation_ax.set_theta_direction(-1)
-    rotation_ax.set_theta_offset(math.radians(90))
-    rotation_ax.grid(True)
-    rotation_ax.plot(rotation_theta, rotation_r)
-
-    # Show graphs
-    plt.show(block=False)
-
-def update_graphs():
-    if closed: return
-    rotation_ax.autoscale(False)
-    rotation_ax.set_rlim(top=MAX_FREQUENCY)
-    fig.canvas.draw()
-    fig.canvas.flush_events()
-
-def append_rotation_data(theta: float, r: float):
-    global rotation_theta
-    global rotation_r
-    rotation_theta = rotation_theta[-20:]
-    rotation_r = rotation_r[-20:]
-
-    rotation_theta.append(theta)
-    rotation_r.append(r)
-    
-    if closed: return
-    rotation_ax.clear()
-    rotation_ax.plot(rotation_theta, rotation_r)
+# Live plot of the stages. Every stage has a trail in the polar plot of angle
+# and frequency and traces of speed, frequency and angle error over the last
+# seconds. The axes have fixed limits and the time is relative to now, so only
+# the lines are drawn on every frame on top of a cached background (blitting).
+# The background is drawn again only if the window changed, e.g. was resized.
+class LivePlot:
+    def __init__(self, stages: int, history: float, max_speed: float, max_frequency: float, error_range: float) -> None:
+        self.closed = False
+        self.fig = plt.figure(figsize=(10, 6))
+        self.fig.canvas.mpl_connect('close_event', self._on_close)
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        self._background = None
+
+        # Rotation diagram
+        grid = self.fig.add_gridspec(3, 2)
+        self.rotation_ax = self.fig.add_subplot(grid[:, 0], projection='polar')
+        self.rotation_ax.set_rlim(0, max_frequency)
+        self.rotation_ax.set_theta_direction(-1)
+        self.rotation_ax.set_theta_offset(math.radians(90))
+        self.rotation_ax.grid(True)
+
+        # Traces
+        self.speed_ax = self.fig.add_subplot(grid[0, 1])
+        self.speed_ax.set_ylabel("Speed (m/s)")
+        self.speed_ax.set_ylim(0, max_speed * 1.1)
+        self.frequency_ax = self.fig.add_subplot(grid[1, 1], sharex=self.speed_ax)
+        self.frequency_ax.set_ylabel("Frequency (Hz)")
+        self.frequency_ax.set_ylim(0, max_frequency * 1.1)
+        self.error_ax = self.fig.add_subplot(grid[2, 1], sharex=self.speed_ax)
+        self.error_ax.set_ylabel("Error (°)")
+        self.error_ax.set_ylim(-error_range, error_range)
+        self.error_ax.set_xlabel("Time (s)")
+        self.speed_ax.set_xlim(-history, 0)
+        for ax in (self.speed_ax, self.frequency_ax, self.error_ax):
+            ax.grid(True)
+
+        self.lines: list[dict[str, plt.Line2D]] = []
+        for stage in range(stages):
+            color = "C%i" % stage
+            self.lines.append({
+                "rotation": self.rotation_ax.plot([], [], color=color, animated=True)[0],
+                "speed": self.speed_ax.plot([], [], color=color, label="Stage %i" % stage, animated=True)[0],
+                "command_speed": self.speed_ax.plot([], [], color=color, linestyle='--', animated=True)[0],
+                "frequency": self.frequency_ax.plot([], [], color=color, animated=True)[0],
+                "error": self.error_ax.plot([], [], color=color, animated=True)[0],
+            })
+        self.fig.tight_layout()
+        plt.show(block=False)
+
+    def _on_close(self, _) -> None:
+        self.closed = True
+
+    def _on_draw(self, _) -> None:
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self) -> None:
+        for lines in self.lines:
+            for name, line in lines.items():
+                line.axes.draw_artist(line)
+
+    def update(self, stage: int, t: np.ndarray, angle: np.ndarray, speed: np.ndarray, command_speed: np.ndarray,
+               frequency: np.ndarray, error: np.ndarray, trail: int) -> None:
+        """Sets the data of a stage. t is relative to now and the last trail
+        points are shown in the rotation diagram."""
+        lines = self.lines[stage]
+        lines["rotation"].set_data(np.radians(angle[-trail:]), frequency[-trail:])
+        lines["speed"].set_data(t, speed)
+        lines["command_speed"].set_data(t, command_speed)
+        lines["frequency"].set_data(t, frequency)
+        lines["error"].set_data(t, error)
+
+    def draw(self) -> None:
+        if self.closed:
+            return
+        canvas = self.fig.canvas
+        if self._background is None:
+            canvas.draw()
+        else:
+            canvas.restore_region(self._background)
+            self._draw_lines()
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def close(self) -> None:
+        plt.close(self.fig)
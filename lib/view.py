@@ -4,15 +4,24 @@ from typing import Tuple
 import time
 
 from .process import RuntimeEnvironment
+from . import wire
 from .runtime import Runtime, App
 from .process import GenericProcess
 from .stage.commands import Command
 from .stage.input import StageInputState, StageOSCInput
+from .stage.emergency import EmergencyStop
+from .stage.feedback import StageOSCFeedback, FeedbackDestination
+from .stage.websocket import StageWebSocketInput
+from .stage.api import StageHTTPAPI
+from .telemetry import Telemetry
 
 class ViewRuntime(Runtime):
-    def __init__(self, commands: Connection, app: App) -> None:
+    def __init__(self, commands: Connection, emergency_stop: EmergencyStop, telemetry: Telemetry, app: App, stage: int = 0) -> None:
         super().__init__()
-        self.app = app     
+        self.app = app
+        self.stage = stage
+        self.emergency_stop = emergency_stop
+        self.telemetry = telemetry
 
         # Connections
         self.commands = commands
@@ -20,40 +29,79 @@ class ViewRuntime(Runtime):
         # Function classes
         self.state: StageInputState = None
         self.osc: StageOSCInput = None
+        self.feedback: StageOSCFeedback = None
+        self.websocket: StageWebSocketInput = None
+        self.api: StageHTTPAPI = None
 
         # State
-        self.active_command = Command(Command.Action.STOP)
+        self.state_version = 0
 
     def setup(self):
         self.state = StageInputState()
         self.osc = StageOSCInput(self.state, 
-            self.app.get_config('input', 'ip', str, '0.0.0.0'),
-            self.app.get_config('input', 'port', int, 1337),
+            self.app.get_stage_config(self.stage, 'input', 'ip', str, '0.0.0.0'),
+            self.app.get_stage_config(self.stage, 'input', 'port', int, 1337),
+            self.app.is_debug_enabled,
+            lambda: self.emergency_stop.trigger(self.stage))
+        self.osc.start()
+
+        self.feedback = StageOSCFeedback(self.telemetry, self.stage,
+            FeedbackDestination.parse(
+                self.app.get_stage_config(self.stage, 'feedback', 'destinations', str, ''),
+                self.app.get_stage_config(self.stage, 'feedback', 'rate', float, 30.0)),
+            self.app.get_stage_config(self.stage, 'feedback', 'prefix', str, '/stage'))
+        self.feedback.start()
+
+        self.websocket = StageWebSocketInput(self.state, self.osc.dispatcher, self.telemetry, self.stage,
+            self.app.get_stage_config(self.stage, 'websocket', 'ip', str, '0.0.0.0'),
+            self.app.get_stage_config(self.stage, 'websocket', 'port', int, 8765),
+            self.app.get_stage_config(self.stage, 'websocket', 'rate', float, 10.0),
             self.app.is_debug_enabled)
+        self.websocket.start()
 
-    def loop(self):
-        self.osc()
+        self.api = StageHTTPAPI(self.state, self.telemetry, self.stage,
+            self.app.get_stage_config(self.stage, 'api', 'ip', str, '127.0.0.1'),
+            self.app.get_stage_config(self.stage, 'api', 'port', int, 8080),
+            self.app.is_debug_enabled,
+            lambda: self.emergency_stop.trigger(self.stage))
+        self.api.start()
 
-        if self.state.changed_from(self.active_command):
-            self.active_command = self.state.command
-            self.commands.send(self.active_command)
+    def loop(self):
+        # Forward the command as soon as an input changed the state. A command
+        # is only build and compared, if the state has a new version. The
+        # timeout keeps the loop responsive to the control process. Scheduled
+        # commands follow the immediate one, which would cancel them.
+        if self.state.wait(self.state_version, 0.1) != self.state_version:
+            with self.state.lock:
+                self.state_version = self.state.version
+                for command in self.state.take_commands():
+                    wire.send(self.commands, command)
 
         while self.commands.poll():
-            active_command = self.commands.recv()
+            active_command = wire.recv(self.commands)
             assert isinstance(active_command, Command)
             # print("Received active command different from current")
 
     def stop(self) -> int | None:
-        pass
+        self.api.stop()
+        self.websocket.stop()
+        self.feedback.stop()
+        self.osc.stop()
     
 class View(GenericProcess):
-    def __init__(self) -> None:
+    def __init__(self, emergency_stop: EmergencyStop, telemetry: Telemetry, stage: int = 0) -> None:
         super().__init__()
+        self.emergency_stop = emergency_stop
+        self.telemetry = telemetry
+        self.stage = stage
 
     def init(self) -> Tuple[RuntimeEnvironment, Connection]:
         signal, runtime_signal = Pipe()
         self.commands, runtime_commands = Pipe()
         kwargs = {
-            "commands": runtime_commands
+            "commands": runtime_commands,
+            "emergency_stop": self.emergency_stop,
+            "telemetry": self.telemetry,
+            "stage": self.stage
         }
         return RuntimeEnvironment(ViewRuntime, runtime_signal, kwargs=kwargs), signal
@@ -0,0 +1,234 @@
+"""Binary wire format of the messages between the processes.
+
+Every frame starts with a header of two unsigned bytes: the schema version and
+the kind of the frame. All values are little endian. Missing optional values
+are encoded as NaN.
+
+    COMMAND   action u8, direction u8, speed f64, angle f64, frequency f64,
+              at f64, turns u16
+    READINGS  count u16, count times (sensor u8, value f64)
+    TRACED    READINGS payload, followed by the capture, detection and send
+              stamps f64 of the readings
+    RECORD    tag length u8, tag utf-8, count u16, count times value f64
+    TEXT      utf-8
+    NONE      no payload
+    MESSAGE   signal u8, followed by a complete frame with the message data
+    PICKLE    pickled python object, the fallback for everything else (e.g.
+              config values)
+"""
+from multiprocessing.connection import Connection
+from typing import Any
+import select
+import pickle
+import struct
+import math
+import os
+
+from .sensor import Sensor
+from .stage.commands import Command
+from .tracing import TracedReadings
+
+VERSION = 2
+
+class Kinds:
+    COMMAND = 1
+    READINGS = 2
+    RECORD = 3
+    TEXT = 4
+    NONE = 5
+    MESSAGE = 6
+    TRACED = 7
+    PICKLE = 255
+
+HEADER = struct.Struct('<BB')
+COMMAND = struct.Struct('<BBddddH')
+COUNT = struct.Struct('<H')
+READING = struct.Struct('<Bd')
+TAG = struct.Struct('<B')
+SIGNAL = struct.Struct('<B')
+STAMPS = struct.Struct('<ddd')
+
+# Length prefix of the frames send with Connection.send_bytes
+LENGTH = struct.Struct('!i')
+
+_SENSORS = {sensor.value: sensor for sensor in Sensor}
+
+_COMMAND_HEADER = HEADER.pack(VERSION, Kinds.COMMAND)
+_READINGS_HEADER = HEADER.pack(VERSION, Kinds.READINGS)
+_TRACED_HEADER = HEADER.pack(VERSION, Kinds.TRACED)
+_RECORD_HEADER = HEADER.pack(VERSION, Kinds.RECORD)
+_TEXT_HEADER = HEADER.pack(VERSION, Kinds.TEXT)
+_NONE_FRAME = HEADER.pack(VERSION, Kinds.NONE)
+_MESSAGE_HEADER = HEADER.pack(VERSION, Kinds.MESSAGE)
+_PICKLE_HEADER = HEADER.pack(VERSION, Kinds.PICKLE)
+
+def _optional(value: float | None) -> float:
+    return math.nan if value is None else value
+
+def _value(value: float) -> float | None:
+    return None if math.isnan(value) else value
+
+def _is_record(obj: Any) -> bool:
+    return isinstance(obj, tuple) and len(obj) > 0 and isinstance(obj[0], str) and \
+        all(isinstance(v, (int, float)) for v in obj[1:])
+
+def _is_readings(obj: Any) -> bool:
+    return isinstance(obj, list) and \
+        all(isinstance(r, tuple) and len(r) == 2 and isinstance(r[0], Sensor) for r in obj)
+
+def _encode_readings(readings: list[tuple[Sensor, float]]) -> bytes:
+    return COUNT.pack(len(readings)) + b''.join(READING.pack(sensor.value, value) for sensor, value in readings)
+
+def _decode_readings(frame: bytes, offset: int) -> tuple[list[tuple[Sensor, float]], int]:
+    count, = COUNT.unpack_from(frame, offset)
+    offset += COUNT.size
+    end = offset + count * READING.size
+    return [(_SENSORS[sensor], value) for sensor, value in READING.iter_unpack(frame[offset:end])], end
+
+def encode(obj: Any) -> bytes:
+    if isinstance(obj, Command):
+        return _COMMAND_HEADER + COMMAND.pack(obj.action.value, obj.direction.value, obj.speed,
+            _optional(obj.angle), _optional(obj.frequency), _optional(obj.at), obj.turns)
+    elif isinstance(obj, TracedReadings):
+        return _TRACED_HEADER + _encode_readings(obj.readings) + STAMPS.pack(obj.capture, obj.detection, obj.send)
+    elif _is_readings(obj):
+        return _READINGS_HEADER + _encode_readings(obj)
+    elif _is_record(obj):
+        tag = obj[0].encode()
+        return _RECORD_HEADER + TAG.pack(len(tag)) + tag + \
+            struct.pack('<H%id' % (len(obj) - 1), len(obj) - 1, *obj[1:])
+    elif isinstance(obj, str):
+        return _TEXT_HEADER + obj.encode()
+    elif obj is None:
+        return _NONE_FRAME
+    else:
+        return _PICKLE_HEADER + pickle.dumps(obj)
+
+def decode(frame: bytes | bytearray, start: int = 0, end: int | None = None) -> Any:
+    """Decodes the frame, which is optionally a part of a larger buffer."""
+    end = len(frame) if end is None else end
+    version, kind = HEADER.unpack_from(frame, start)
+    if version != VERSION:
+        raise ValueError("Unsupported wire format version %i" % version)
+
+    offset = start + HEADER.size
+    if kind == Kinds.COMMAND:
+        action, direction, speed, angle, frequency, at, turns = COMMAND.unpack_from(frame, offset)
+        return Command(Command.Action(action), Command.Direction(direction), speed,
+            _value(angle), _value(frequency), _value(at), turns)
+    elif kind == Kinds.READINGS:
+        return _decode_readings(frame, offset)[0]
+    elif kind == Kinds.TRACED:
+        readings, offset = _decode_readings(frame, offset)
+        return TracedReadings(readings, *STAMPS.unpack_from(frame, offset))
+    elif kind == Kinds.RECORD:
+        length = frame[offset]
+        tag = str(frame[offset + 1:offset + 1 + length], 'utf-8')
+        offset += 1 + length
+        count, = COUNT.unpack_from(frame, offset)
+        return (tag,) + struct.unpack_from('<%id' % count, frame, offset + COUNT.size)
+    elif kind == Kinds.TEXT:
+        return str(frame[offset:end], 'utf-8')
+    elif kind == Kinds.NONE:
+        return None
+    elif kind == Kinds.PICKLE:
+        return pickle.loads(frame[offset:end])
+    else:
+        raise ValueError("Unknown wire format kind %i" % kind)
+
+def encode_message(signal: int, data: Any) -> bytes:
+    return _MESSAGE_HEADER + SIGNAL.pack(signal) + encode(data)
+
+def decode_message(frame: bytes) -> tuple[int, Any]:
+    version, kind = HEADER.unpack_from(frame)
+    if version != VERSION or kind != Kinds.MESSAGE:
+        raise ValueError("Expected message frame of version %i" % VERSION)
+    return frame[HEADER.size], decode(frame[HEADER.size + SIGNAL.size:])
+
+def send(c: Connection, obj: Any) -> None:
+    c.send_bytes(encode(obj))
+
+def recv(c: Connection) -> Any:
+    return decode(c.recv_bytes())
+
+def kind(frame: bytes | bytearray, start: int = 0) -> int:
+    version, kind = HEADER.unpack_from(frame, start)
+    if version != VERSION:
+        raise ValueError("Unsupported wire format version %i" % version)
+    return kind
+
+def readings(frame: bytes | bytearray, start: int = 0) -> tuple[int, int]:
+    """Returns the number of readings of a READINGS or TRACED frame and the
+    offset of the first one. The readings are read with READING.unpack_from
+    and the stamps of a TRACED frame follow the last reading. Nothing is
+    allocated, unlike decode."""
+    if kind(frame, start) not in (Kinds.READINGS, Kinds.TRACED):
+        raise ValueError("Expected readings frame")
+    count, = COUNT.unpack_from(frame, start + HEADER.size)
+    return count, start + HEADER.size + COUNT.size
+
+def sensor(value: int) -> Sensor:
+    return _SENSORS[value]
+
+# Receives the frames of a connection into a buffer, which is allocated once.
+# Polling and receiving a frame allocates nothing, unlike Connection.poll and
+# Connection.recv_bytes. The frames have to be send with Connection.send_bytes
+# and a connection must not be read by anything else, because the reader
+# receives everything that is available at once.
+class FrameReader:
+    def __init__(self, c: Connection, size: int = 65536) -> None:
+        self.connection = c
+        self._fd = c.fileno()
+        self._poll = select.poll()
+        self._poll.register(self._fd, select.POLLIN)
+        self._allocate(size)
+        self._next = 0
+        self._received = 0
+
+    def _allocate(self, size: int) -> None:
+        self.buffer = bytearray(size)
+        self._view = memoryview(self.buffer)
+        self._whole = [self._view]
+
+    def _available(self) -> int:
+        """Returns the size of the next frame, if it was received completely,
+        otherwise -1."""
+        if self._received - self._next < LENGTH.size:
+            return -1
+        size, = LENGTH.unpack_from(self.buffer, self._next)
+        if size < 0:
+            raise ValueError("Frames larger than 2 GiB are not supported")
+        return size if self._received - self._next - LENGTH.size >= size else -1
+
+    def _read(self, size: int) -> None:
+        # Move a partially received frame to the front and grow the buffer,
+        # if the frame does not fit
+        if self._next > 0:
+            pending = self._received - self._next
+            self.buffer[:pending] = bytes(self._view[self._next:self._received])
+            self._next, self._received = 0, pending
+        if LENGTH.size + size > len(self.buffer):
+            pending = bytes(self._view[:self._received])
+            self._allocate(LENGTH.size + size)
+            self.buffer[:len(pending)] = pending
+        received = os.readv(self._fd, self._whole if self._received == 0 else [self._view[self._received:]])
+        if received == 0:
+            raise EOFError
+        self._received += received
+
+    def poll(self) -> bool:
+        return self._available() >= 0 or len(self._poll.poll(0)) > 0
+
+    def recv(self) -> tuple[int, int]:
+        """Receives the next frame and returns its start and end in the
+        buffer. The frame is valid until the next call of poll or recv."""
+        if self._next == self._received:
+            self._next = self._received = 0
+        size = self._available()
+        while size < 0:
+            self._read(LENGTH.size if self._received - self._next < LENGTH.size else
+                LENGTH.unpack_from(self.buffer, self._next)[0])
+            size = self._available()
+        start = self._next + LENGTH.size
+        self._next = start + size
+        return start, self._next
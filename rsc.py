@@ -2,9 +2,16 @@ from lib.app import App, Signals
 from lib.control import Control
 from lib.sensors import AbsoluteSensor
 from lib.view import View
-from lib.utility.plot import init_graphs, update_graphs, append_rotation_data
+from lib.plot import Plot
+from lib.process import GenericProcess
+from lib.stage.emergency import EmergencyStop
+from lib.telemetry import Telemetry
+from lib.tracing import LatencyTrace
+from lib.metrics import StageMetrics, MetricsServer
+from lib.stage.plant import StagePlant
+from lib.utility.histogram import DEFAULT_BOUNDS
 import signal
-import math
+import time
 import argparse
 import traceback
 
@@ -12,6 +19,38 @@ def graceful_shutdown(_, __):
     global app
     app.exit()
 
+# Diagnostics are requested with signals while rsc is running:
+#   kill -USR1 <pid>  prints the loop statistics of all runtimes
+#   kill -USR2 <pid>  profiles the loops of all runtimes
+# The requests are handled by the main loop, not inside the signal handler.
+stats_requested = False
+profile_requested = False
+
+def request_stats(_, __):
+    global stats_requested
+    stats_requested = True
+
+def request_profile(_, __):
+    global profile_requested
+    profile_requested = True
+
+def print_stats(processes: list[GenericProcess]):
+    print("Runtime                   PID     it/s  Sleep  Loop p50/p99/max ms   Jitter std/p99/max ms  GC n/max ms  Exceptions")
+    for process in processes:
+        name = process.__class__.__name__ + (" %i" % process.stage if hasattr(process, 'stage') else "")
+        stats = process.stats
+        if stats is None:
+            print("%-24s  no statistics yet" % name)
+            continue
+        loop = stats["loop"]
+        jitter = stats["jitter"]
+        collections = stats["gc"]
+        exceptions = ", ".join("%s %i" % e for e in stats["exceptions"].items())
+        print("%-24s %5i %8.1f %5.0f%%  %6.2f/%6.2f/%6.2f   %5.2f/%6.2f/%6.2f     %4i/%6.2f  %s" % (name, stats["pid"], stats["rate"],
+            stats["sleep_ratio"] * 100, loop["p50"] * 1000, loop["p99"] * 1000, loop["max"] * 1000,
+            jitter["std"] * 1000, jitter["p99"] * 1000, jitter["max"] * 1000,
+            collections["collections"], collections["max"] * 1000, exceptions or "-"))
+
 def args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         prog='rsc')
@@ -20,40 +59,83 @@ def args() -> argparse.Namespace:
     parser.add_argument('-c', '--config')
     return parser.parse_args()
 
+def process_labels(process: GenericProcess) -> tuple[str, int | None]:
+    return process.__class__.__name__, getattr(process, 'stage', None)
+
 def loop_view(view: View):
     msg = view.recv()
     if msg is not None:
         if msg.signal == Signals.ERROR:
+            metrics.runtime_error(*process_labels(view))
             view.restart(app.send_config_to)
+        elif msg.signal == Signals.STATS:
+            metrics.runtime_stats(*process_labels(view), msg.data)
         elif msg.signal == Signals.CONFIG:
             app.send_config_to(view, msg)
 
+def print_latency(stage: int, summary: tuple[float, ...]):
+    segments = []
+    for i, segment in enumerate(LatencyTrace.SEGMENTS):
+        count, p50, p99, maximum = summary[4 * i:4 * i + 4]
+        if count > 0:
+            segments.append("%s %.1f/%.1f/%.1f" % (segment, p50 * 1000, p99 * 1000, maximum * 1000))
+    if len(segments) > 0:
+        print("[INFO] Latency of stage %i in ms (p50/p99/max): %s" % (stage, ", ".join(segments)))
+
 def loop_control(control: Control):
     msg = control.recv()
     if msg is not None:
         if msg.signal == Signals.ERROR:
+            metrics.runtime_error(*process_labels(control))
             control.restart(app.send_config_to)
+        elif msg.signal == Signals.STATS:
+            metrics.runtime_stats(*process_labels(control), msg.data)
         elif msg.signal == Signals.DATA:
             assert isinstance(msg.data, tuple)
-            if app.is_debug_enabled:
-                append_rotation_data(math.radians(msg.data[0]), msg.data[1])
+            if msg.data[0] == 'emergency_stop':
+                print("[INFO] Emergency stop of stage %i done after %.1f ms" % (int(msg.data[1]), msg.data[2] * 1000))
+                metrics.emergency_stop(int(msg.data[1]))
+            elif msg.data[0] == 'latency':
+                print_latency(int(msg.data[1]), msg.data[2:])
+                metrics.latency(int(msg.data[1]), LatencyTrace.SEGMENTS, msg.data[2:])
+            elif msg.data[0] == 'modbus':
+                metrics.modbus(list(DEFAULT_BOUNDS), [int(c) for c in msg.data[3:]], msg.data[1], int(msg.data[2]))
         elif msg.signal == Signals.CONFIG:
             app.send_config_to(control, msg)
 
+def loop_plot(plot: Plot):
+    msg = plot.recv()
+    if msg is not None:
+        if msg.signal == Signals.ERROR:
+            metrics.runtime_error(*process_labels(plot))
+            plot.restart(app.send_config_to)
+        elif msg.signal == Signals.STATS:
+            metrics.runtime_stats(*process_labels(plot), msg.data)
+        elif msg.signal == Signals.CONFIG:
+            app.send_config_to(plot, msg)
+
 def loop_absolute_sensor(absolute_sensor: AbsoluteSensor):
     msg = absolute_sensor.recv()
     if msg is not None:
         if msg.signal == Signals.ERROR:
+            metrics.runtime_error(*process_labels(absolute_sensor))
             absolute_sensor.restart(app.send_config_to)
+        elif msg.signal == Signals.STATS:
+            metrics.runtime_stats(*process_labels(absolute_sensor), msg.data)
+        elif msg.signal == Signals.DATA and msg.data[0] == 'sensor':
+            metrics.sensor(int(msg.data[1]), msg.data[2])
         elif msg.signal == Signals.CONFIG:
             app.send_config_to(absolute_sensor, msg)
 
 def main(args: argparse.Namespace):
-    global app
+    global app, metrics, stats_requested, profile_requested
     app = App(args.debug, args.testing)
+    metrics = StageMetrics()
 
     signal.signal(signal.SIGINT, graceful_shutdown)
     signal.signal(signal.SIGTERM, graceful_shutdown)
+    signal.signal(signal.SIGUSR1, request_stats)
+    signal.signal(signal.SIGUSR2, request_profile)
 
     # Read configuration
     if args.config is not None:
@@ -62,14 +144,29 @@ def main(args: argparse.Namespace):
     # Initialization
     # Processes are initialized and started. If something fails,
     # the whole application should be closed. 
-    view = View()
-    absolute_sensor = AbsoluteSensor()
-    control = Control(view, absolute_sensor)
+    emergency_stop = EmergencyStop(app.stages)
+    telemetry = Telemetry(app.stages)
+    plants = [StagePlant() for _ in range(app.stages)] if app.is_testing_enabled else None
+    views = [View(emergency_stop, telemetry, stage) for stage in range(app.stages)]
+    absolute_sensors = [AbsoluteSensor(stage, plants[stage] if plants is not None else None) for stage in range(app.stages)]
+    control = Control(views, absolute_sensors, emergency_stop, telemetry, plants)
+
+    # The debug plot runs in its own process and reads the telemetry
+    plots = [Plot(telemetry)] if app.is_debug_enabled else []
+
+    # Metrics are served from a snapshot, which the loop renders at most
+    # once per second
+    metrics_server = None
+    if app.metrics_port > 0:
+        metrics_server = MetricsServer(metrics, app.metrics_ip, app.metrics_port)
+        metrics_server.start()
+    last_metrics_render = 0.0
 
     try:
-        absolute_sensor.start(app.send_config_to)
-        view.start(app.send_config_to)
+        [absolute_sensor.start(app.send_config_to) for absolute_sensor in absolute_sensors]
+        [view.start(app.send_config_to) for view in views]
         control.start(app.send_config_to)
+        [plot.start(app.send_config_to) for plot in plots]
     except Exception as e:
         print("Failed to initialize app!")
         print("[ERROR] %s" % str(e))
@@ -78,22 +175,34 @@ def main(args: argparse.Namespace):
 
     # Loop
     try:
-        if app.is_debug_enabled:
-            init_graphs()
-
         while not app.shutdown:
-            if app.is_debug_enabled:
-                update_graphs()
-            loop_absolute_sensor(absolute_sensor)
-            loop_view(view)
+            [loop_absolute_sensor(absolute_sensor) for absolute_sensor in absolute_sensors]
+            [loop_view(view) for view in views]
             loop_control(control)
+            [loop_plot(plot) for plot in plots]
+
+            if stats_requested:
+                stats_requested = False
+                print_stats(absolute_sensors + views + [control] + plots)
+            if profile_requested:
+                profile_requested = False
+                [process.profile() for process in absolute_sensors + views + [control] + plots]
+            if metrics.changed and time.time() - last_metrics_render > 1.0:
+                metrics.render()
+                last_metrics_render = time.time()
     
     # Shutdown
     finally:
         print(f"... Received signal. Shutting down ...")
         print("Control exited with %s" % control.stop())
-        print("Absolute sensor exited with %s" % absolute_sensor.stop())
-        print("View exited with %s" % view.stop())
+        for absolute_sensor in absolute_sensors:
+            print("Absolute sensor %i exited with %s" % (absolute_sensor.stage, absolute_sensor.stop()))
+        for view in views:
+            print("View %i exited with %s" % (view.stage, view.stop()))
+        for plot in plots:
+            print("Plot exited with %s" % plot.stop())
+        if metrics_server is not None:
+            metrics_server.stop()
 
 if "__main__" == __name__:
     main(args())
\ No newline at end of file
@@ -0,0 +1,161 @@
+from lib.stage.plant import StagePlant
+from lib.stage.motor import SimulatedConverter
+from lib.stage.control import StageControl
+from lib.stage.controller import StageAngleController, StageSpeedController, FrequencyMap
+from lib.stage.commands import Command
+from lib.sensor import Sensor
+from lib.sensor.rotation import SimulatedRotationSensor
+from lib.sensor.speed import AngularSpeedSensor
+from lib.utility.clock import VirtualClock
+import configparser
+import argparse
+import json
+import time
+
+# Runs the controller of a stage against the simulated plant in a single
+# process on a virtual clock. The loop advances the clock by the minimal loop
+# duration of the runtimes, so a rehearsal of a show runs many times faster than
+# real time with the timing behavior of the stage.
+#
+# Cues are read from a JSON list like
+#   [{"at": 0, "action": "run_to_angle", "direction": "auto", "speed": 0.5, "angle": 90}]
+# where "at" is the time in seconds since the start of the simulation.
+def args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='simulate')
+    parser.add_argument('-c', '--config', default='default.conf')
+    parser.add_argument('--cues', help="JSON file with the cues, a demo show is used by default")
+    parser.add_argument('--duration', type=float, default=600.0, help="Simulated seconds")
+    parser.add_argument('--step', type=float, default=5.0, help="Loop duration in ms")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="Angle in degree at which a cue is settled")
+    parser.add_argument('--trace', help="CSV file to write the trace of the stage to")
+    return parser.parse_args()
+
+def demo_cues(duration: float) -> list[dict]:
+    angles = [90, 270, 45, 180, 300, 0]
+    return [{"at": t, "action": "run_to_angle", "direction": "auto", "speed": 0.5, "angle": angles[i % len(angles)]}
+            for i, t in enumerate(range(0, int(duration), 30))]
+
+def command(cue: dict) -> Command:
+    return Command(
+        Command.Action[cue["action"].upper()],
+        Command.Direction[cue.get("direction", "none").upper()],
+        float(cue.get("speed", 1.0)),
+        float(cue["angle"]) if cue.get("angle") is not None else None,
+        float(cue["frequency"]) if cue.get("frequency") is not None else None,
+        turns=int(cue.get("turns", 0)))
+
+if __name__ == "__main__":
+    args = args()
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    cues = sorted(json.load(open(args.cues)) if args.cues else demo_cues(args.duration), key=lambda cue: cue["at"])
+
+    clock = VirtualClock()
+    start = clock.time()
+    stage_diameter = config.getfloat('DEFAULT', 'stage_diameter', fallback=4.5)
+    max_frequency = config.getfloat('motor', 'max_frequency', fallback=40.0)
+    max_speed = config.getfloat('DEFAULT', 'max_speed', fallback=1.0)
+
+    speed_per_hertz = config.getfloat('simulation', 'speed_per_hertz', fallback=1 / 60)
+    time_constant = config.getfloat('simulation', 'time_constant', fallback=0.8)
+    friction = config.getfloat('simulation', 'friction', fallback=0.01)
+
+    plant = StagePlant(clock=clock)
+    plant.configure(speed_per_hertz, time_constant, friction,
+        config.getfloat('simulation', 'ramp', fallback=10.0),
+        config.getfloat('simulation', 'emergency_ramp', fallback=40.0),
+        stage_diameter)
+    angle_sensor = SimulatedRotationSensor(plant,
+        config.getfloat('simulation', 'frame_rate', fallback=30.0),
+        config.getint('simulation', 'latency', fallback=50) / 1000,
+        config.getfloat('simulation', 'noise', fallback=0.05),
+        seed=0, clock=clock)
+    speed_sensor = AngularSpeedSensor(angle_sensor, stage_diameter)
+
+    # Without a calibrated map the steady state of the plant is used, which
+    # is what a calibration would measure
+    frequency_map = FrequencyMap.load(config.get('control', 'frequency_map', fallback='frequency_map.{stage}.json').format(stage=0))
+    if len(frequency_map) == 0:
+        for frequency in range(2, int(max_frequency) + 1, 2):
+            frequency_map.insert(speed_per_hertz * frequency - friction * time_constant, frequency)
+    control = StageControl(SimulatedConverter(plant),
+        StageAngleController(
+            config.getfloat('control', 'angle_pid_kp', fallback=0.6),
+            config.getfloat('control', 'angle_pid_ki', fallback=0),
+            config.getfloat('control', 'angle_pid_kd', fallback=0),
+            stage_diameter,
+            config.getfloat('control', 'max_acceleration', fallback=0.25),
+            config.getfloat('control', 'max_jerk', fallback=0.5),
+            config.getfloat('motor', 'ramp', fallback=10.0) * config.getfloat('motor', 'speed_per_hertz', fallback=1 / 60),
+            config.getint('control', 'response_time', fallback=2000) / 1000,
+            clock=clock),
+        StageSpeedController(
+            max_frequency,
+            config.getfloat('control', 'speed_pid_kp', fallback=20),
+            config.getfloat('control', 'speed_pid_ki', fallback=0.5),
+            config.getfloat('control', 'speed_pid_kd', fallback=0),
+            frequency_map,
+            clock=clock),
+        max_frequency, clock)
+
+    trace = open(args.trace, "w") if args.trace else None
+    if trace is not None:
+        trace.write("time,angle,speed,frequency,target_frequency\n")
+
+    # Every cue is reported with the time until the stage settled at the angle
+    # and the largest overshoot beyond it.
+    results = []
+    pending = list(cues)
+    active: dict | None = None
+    step = args.step / 1000
+    started = time.perf_counter()
+    while clock.time() - start < args.duration:
+        now = clock.time() - start
+
+        readings: list[tuple[Sensor, float]] = []
+        angle = angle_sensor.measure_angle()
+        if angle is not None:
+            readings.append((Sensor.STAGE_ABSOLUTE_ANGLE, float(angle)))
+        speed = speed_sensor.measure_speed()
+        if speed is not None:
+            readings.append((Sensor.STAGE_SPEED, speed))
+
+        # A cue is retried until the controller accepts it, e.g. before the
+        # first angle is measured
+        while len(pending) > 0 and pending[0]["at"] <= now:
+            cmd = command(pending[0])
+            cmd.speed = min(cmd.speed, max_speed)
+            if not control.set_activity(cmd):
+                break
+            if active is not None and active["settled"] is None:
+                results.append(active)
+            active = dict(cue=pending.pop(0), started=now, settled=None, reached=False, overshoot=0.0)
+        control(readings)
+
+        actual, actual_speed, frequency = plant.state()
+        if active is not None and active["cue"]["action"] == "run_to_angle" and active["settled"] is None:
+            error = (actual - active["cue"]["angle"] + 180) % 360 - 180
+            if abs(error) <= args.tolerance:
+                active["reached"] = True
+            if active["reached"]:
+                active["overshoot"] = max(active["overshoot"], error if control.angle_controller.clockwise else -error)
+            if abs(error) <= args.tolerance and abs(actual_speed) < 0.005:
+                active["settled"] = now
+                results.append(active)
+        if trace is not None:
+            trace.write("%.3f,%.3f,%.4f,%.2f,%.2f\n" % (now, actual, actual_speed, frequency, control.target_frequency))
+
+        clock.advance(step)
+    elapsed = time.perf_counter() - started
+    if active is not None and active["settled"] is None:
+        results.append(active)
+    if trace is not None:
+        trace.close()
+
+    print("Cue      Target  Direction         Settled after  Overshoot")
+    for result in results:
+        cue = result["cue"]
+        settled = "%10.2f s" % (result["settled"] - result["started"]) if result["settled"] is not None else "       never"
+        print("%6.1f s %6s  %-16s %s  %7.2f deg" % (cue["at"], cue.get("angle", "-"), cue.get("direction", "none"), settled, result["overshoot"]))
+    print("Simulated %.0f s in %.1f s (%.0fx real time)" % (args.duration, elapsed, args.duration / elapsed))
@@ -0,0 +1,292 @@
+from lib.stage.controller import FrequencyMap
+from lib.stage.controller.trajectory import MotionProfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import configparser
+import argparse
+import itertools
+import math
+import time
+
+# Offline search for the PID gains of the angle and speed controllers. Every
+# candidate of the gain grid is simulated at once: the state of the plant, the
+# camera and both controllers are NumPy arrays with one element per candidate.
+# The model follows the simulated plant and the controllers of the stage:
+#   - moves are planned with the same motion profile, the angle PID corrects the
+#     residual and its output is clamped to [0, speed]
+#   - the speed PID adds to the feed-forward of the frequency map
+#   - the camera delivers noisy angles with frame rate and latency, the speed is
+#     measured over the last 10 frames like the AngularSpeedSensor
+#   - the converter gets a new frequency at most every 100 ms, if it changed
+# Online refinement of the frequency map is not simulated.
+#
+# Every candidate is scored by its settle time, overshoot, the remaining error
+# and the number of converter writes. The converter does not run below 1 Hz, so
+# small corrections are not possible and a move can end short of the angle.
+# The Pareto-best candidates are printed as config.
+
+GAINS = ('angle_pid_kp', 'angle_pid_ki', 'angle_pid_kd', 'speed_pid_kp', 'speed_pid_ki', 'speed_pid_kd')
+
+def args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='tune')
+    parser.add_argument('-c', '--config', default='default.conf')
+    parser.add_argument('--angle-kp', default='0.02:0.3:8', help="Grid as start:stop:count or a single value")
+    parser.add_argument('--angle-ki', default='0:0.1:3')
+    parser.add_argument('--angle-kd', default='0:0.4:3')
+    parser.add_argument('--speed-kp', default='5:60:8')
+    parser.add_argument('--speed-ki', default='0:30:6')
+    parser.add_argument('--speed-kd', default='0:1:2')
+    parser.add_argument('--moves', default='30,120,300', help="Distances of the simulated moves in degree")
+    parser.add_argument('--speed', type=float, default=0.5, help="Speed of the moves in m/s")
+    parser.add_argument('--settle-window', type=float, default=10.0, help="Seconds simulated after the planned move")
+    parser.add_argument('--tolerance', type=float, default=1.0, help="Angle in degree at which a move is settled")
+    parser.add_argument('--step', type=float, default=5.0, help="Loop duration in ms")
+    parser.add_argument('--workers', type=int, default=1, help="Processes to split the grid across")
+    parser.add_argument('--top', type=int, default=5, help="Number of Pareto-best settings to print as config")
+    return parser.parse_args()
+
+def grid(spec: str) -> np.ndarray:
+    parts = spec.split(':')
+    if len(parts) == 1:
+        return np.array([float(parts[0])])
+    return np.linspace(float(parts[0]), float(parts[1]), int(parts[2]))
+
+class Model:
+    """Parameters of the plant, the camera and the controllers, read from the
+    config like the testing mode does."""
+    def __init__(self, config: configparser.ConfigParser, step: float) -> None:
+        self.step = step
+        self.radius = config.getfloat('DEFAULT', 'stage_diameter', fallback=4.5) / 2
+        self.max_frequency = config.getfloat('motor', 'max_frequency', fallback=40.0)
+        self.max_acceleration = config.getfloat('control', 'max_acceleration', fallback=0.25)
+        self.max_jerk = config.getfloat('control', 'max_jerk', fallback=0.5)
+        self.response_time = config.getint('control', 'response_time', fallback=2000) / 1000
+        self.converter_acceleration = config.getfloat('motor', 'ramp', fallback=10.0) * \
+            config.getfloat('motor', 'speed_per_hertz', fallback=1 / 60)
+        self.speed_per_hertz = config.getfloat('simulation', 'speed_per_hertz', fallback=1 / 60)
+        self.time_constant = config.getfloat('simulation', 'time_constant', fallback=0.8)
+        self.friction = config.getfloat('simulation', 'friction', fallback=0.01)
+        self.ramp = config.getfloat('simulation', 'ramp', fallback=10.0)
+        self.frame_interval = 1 / config.getfloat('simulation', 'frame_rate', fallback=30.0)
+        self.latency = config.getint('simulation', 'latency', fallback=50) / 1000
+        self.noise = config.getfloat('simulation', 'noise', fallback=0.05)
+
+        # Without a calibrated map the steady state of the plant is used, which
+        # is what a calibration would measure
+        frequency_map = FrequencyMap.load(config.get('control', 'frequency_map', fallback='frequency_map.{stage}.json').format(stage=0))
+        if len(frequency_map) == 0:
+            for frequency in np.linspace(2, self.max_frequency, 10):
+                frequency_map.insert(self.speed_per_hertz * frequency - self.friction * self.time_constant, frequency)
+        self.map_speeds = np.array(frequency_map.speeds)
+        self.map_frequencies = np.array(frequency_map.frequencies)
+
+    def feed_forward(self, speed: np.ndarray) -> np.ndarray:
+        if len(self.map_speeds) < 2:
+            return np.zeros_like(speed)
+        s, f = self.map_speeds, self.map_frequencies
+        slope = (f[-1] - f[-2]) / (s[-1] - s[-2])
+        result = np.where(speed > s[-1], f[-1] + (speed - s[-1]) * slope, np.interp(speed, s, f))
+        return np.where(speed <= 0, 0.0, np.maximum(result, 0.0))
+
+    def to_degree(self, value: float) -> float:
+        return math.degrees(value / self.radius)
+
+def simulate(model: Model, gains: np.ndarray, distance: float, speed: float,
+             settle_window: float, tolerance: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Simulates a move from rest for every row of gains and returns settle
+    time, overshoot, remaining error and converter writes per row."""
+    n = len(gains)
+    akp, aki, akd, skp, ski, skd = (gains[:, i] for i in range(6))
+    acceleration = min(model.max_acceleration, model.converter_acceleration)
+    profile = MotionProfile(distance, model.to_degree(speed), model.to_degree(acceleration),
+                            model.to_degree(model.max_jerk))
+    duration = profile.duration + settle_window
+    dt = model.step
+    substeps = max(int(round(dt / 0.001)), 1)
+    h = dt / substeps
+    rng = np.random.default_rng(0)
+
+    # Plant and converter
+    position = np.zeros(n)
+    v = np.zeros(n)
+    f = np.zeros(n)
+    target = np.zeros(n)
+    running = np.zeros(n, dtype=bool)
+
+    # Camera frames as (capture time, position), the last 10 delivered frames
+    # for the speed measurement
+    frames: list[tuple[float, np.ndarray]] = []
+    next_frame = 0.0
+    window_angles: list[np.ndarray] = []
+    window_times: list[float] = []
+    last_mean_angle: np.ndarray | None = None
+    last_mean_time = 0.0
+    measured_speed = np.zeros(n)
+
+    # Angle PID (100 ms sample time) and speed PID (50 ms sample time)
+    a_integral = np.zeros(n)
+    a_last_input = np.zeros(n)
+    a_output = np.zeros(n)
+    a_last_time = -math.inf
+    control_speed = np.zeros(n)
+    s_integral = np.zeros(n)
+    s_last_input = np.zeros(n)
+    s_output = np.zeros(n)
+    s_last_time = -math.inf
+    s_reset = np.ones(n, dtype=bool)
+    frequency = np.zeros(n)
+
+    # Converter writes
+    writes = np.zeros(n)
+    last_update = 0.0
+
+    # Scores
+    last_outside = np.zeros(n)
+    overshoot = np.zeros(n)
+
+    t = 0.0
+    while t < duration:
+        # Camera
+        if t >= next_frame:
+            frames.append((t, position + rng.normal(0, model.noise)))
+            next_frame += model.frame_interval
+        delivered = None
+        while len(frames) > 0 and frames[0][0] + model.latency <= t:
+            delivered = frames.pop(0)
+
+        if delivered is not None:
+            recording, measured = delivered
+            window_angles = (window_angles + [measured])[-10:]
+            window_times = (window_times + [recording])[-10:]
+            mean_angle = sum(window_angles) / len(window_angles)
+            mean_time = sum(window_times) / len(window_times)
+            speed_update = last_mean_angle is not None and mean_time > last_mean_time
+            if speed_update:
+                measured_speed = np.abs(np.radians(mean_angle - last_mean_angle) * model.radius / (mean_time - last_mean_time))
+            if last_mean_angle is None or speed_update:
+                last_mean_angle, last_mean_time = mean_angle, mean_time
+
+            # Angle controller
+            planned_angle, _ = profile(t)
+            _, planned_speed = profile(t + model.response_time)
+            if t - a_last_time >= 0.1:
+                error = planned_angle - measured
+                pid_dt = t - a_last_time if a_last_time > -math.inf else 1e-16
+                a_integral = np.clip(a_integral + aki * error * pid_dt, -speed, speed)
+                derivative = -akd * (measured - a_last_input) / pid_dt if a_last_time > -math.inf else 0.0
+                a_output = np.clip(akp * error + a_integral + derivative, -speed, speed)
+                a_last_input = measured
+                a_last_time = t
+            # Limited to the speed from which the stage still stops at the
+            # angle. The model doesn't turn the stage back past the angle.
+            remaining = np.maximum(np.radians(distance - measured) * model.radius, 0.0)
+            limit = np.sqrt((acceleration * model.response_time) ** 2 + 2 * acceleration * remaining) - \
+                acceleration * model.response_time
+            control_speed = np.clip(math.radians(planned_speed) * model.radius + a_output, 0.0, np.minimum(limit, speed))
+
+            # Speed controller
+            if speed_update:
+                stopping = control_speed <= 0
+                s_integral = np.where(stopping | s_reset, 0.0, s_integral)
+                if t - s_last_time >= 0.05:
+                    error = control_speed - measured_speed
+                    pid_dt = t - s_last_time if s_last_time > -math.inf else 1e-16
+                    s_integral = np.clip(s_integral + ski * error * pid_dt, -model.max_frequency, model.max_frequency)
+                    derivative = np.where(s_reset, 0.0, -skd * (measured_speed - s_last_input) / pid_dt)
+                    s_output = np.clip(skp * error + s_integral + derivative, -model.max_frequency, model.max_frequency)
+                    s_last_input = measured_speed
+                    s_last_time = t
+                    s_reset = stopping
+                frequency = np.where(stopping, 0.0,
+                    np.clip(model.feed_forward(control_speed) + s_output, 0.0, model.max_frequency))
+
+        # Stage control writes to the converter
+        rounded = np.round(frequency, 2)
+        stop = (rounded < 1.0) & running
+        start = (rounded >= 1.0) & ~running
+        writes += 2 * (stop | start)
+        target = np.where(stop, 0.0, np.where(start, rounded, target))
+        running = (running & ~stop) | start
+        if t - last_update > 0.1:
+            last_update = t
+            update = running & ~stop & ~start & (rounded != target) & (rounded >= 0.5)
+            writes += update
+            target = np.where(update, rounded, target)
+
+        # Plant
+        goal = np.where(running, target, 0.0)
+        for _ in range(substeps):
+            f = np.where(f < goal, np.minimum(f + model.ramp * h, goal), np.maximum(f - model.ramp * h, goal))
+            drive = (model.speed_per_hertz * f - v) / model.time_constant
+            moving = (v > 0) | (drive > model.friction)
+            v_next = np.where(moving, np.maximum(v + (drive - model.friction) * h, 0.0), 0.0)
+            position += np.degrees((v + v_next) / 2 * h / model.radius)
+            v = v_next
+
+        error = position - distance
+        overshoot = np.maximum(overshoot, error)
+        last_outside = np.where(np.abs(error) > tolerance, t, last_outside)
+        t += dt
+
+    settle = np.where(last_outside >= t - dt, np.inf, last_outside + dt)
+    return settle, overshoot, np.abs(position - distance), writes
+
+def evaluate(model: Model, gains: np.ndarray, moves: list[float], speed: float,
+             settle_window: float, tolerance: float) -> np.ndarray:
+    """Returns the scores (settle time, overshoot, error, writes) of all
+    moves."""
+    scores = np.zeros((len(gains), 4))
+    for distance in moves:
+        settle, overshoot, error, writes = simulate(model, gains, distance, speed, settle_window, tolerance)
+        scores[:, 0] += settle
+        scores[:, 1] = np.maximum(scores[:, 1], overshoot)
+        scores[:, 2] = np.maximum(scores[:, 2], error)
+        scores[:, 3] += writes
+    return scores
+
+def pareto(scores: np.ndarray) -> list[int]:
+    """Returns the indices of the candidates which are not dominated in all
+    scores, ordered by the first score."""
+    front: list[int] = []
+    for i in np.lexsort(scores.T[::-1]):
+        if not np.isfinite(scores[i, 0]):
+            continue
+        if not any(np.all(scores[j] <= scores[i]) for j in front):
+            front.append(int(i))
+    return front
+
+if __name__ == "__main__":
+    args = args()
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    model = Model(config, args.step / 1000)
+    moves = [float(m) for m in args.moves.split(',')]
+
+    gains = np.array(list(itertools.product(*(grid(spec) for spec in
+        (args.angle_kp, args.angle_ki, args.angle_kd, args.speed_kp, args.speed_ki, args.speed_kd)))))
+    started = time.perf_counter()
+    if args.workers > 1:
+        chunks = np.array_split(gains, args.workers)
+        with ProcessPoolExecutor(args.workers) as executor:
+            scores = np.concatenate(list(executor.map(evaluate, [model] * len(chunks), chunks,
+                [moves] * len(chunks), [args.speed] * len(chunks), [args.settle_window] * len(chunks),
+                [args.tolerance] * len(chunks))))
+    else:
+        scores = evaluate(model, gains, moves, args.speed, args.settle_window, args.tolerance)
+    elapsed = time.perf_counter() - started
+
+    front = pareto(scores)
+    print("Evaluated %i candidates on %i moves in %.1f s, %i are Pareto-best, %i never settled" % (
+        len(gains), len(moves), elapsed, len(front), int(np.sum(~np.isfinite(scores[:, 0])))))
+    print("")
+    print("  Settle  Overshoot   Error  Writes  " + "  ".join("%12s" % name for name in GAINS))
+    for i in front:
+        print("%7.2fs %8.2f° %6.2f° %7i  " % tuple(scores[i]) + "  ".join("%12.4g" % g for g in gains[i]))
+
+    for i in front[:args.top]:
+        print("")
+        print("# Settle %.2f s, overshoot %.2f°, error %.2f°, %i converter writes" % tuple(scores[i]))
+        print("[control]")
+        for name, value in zip(GAINS, gains[i]):
+            print("%s = %.4g" % (name, value))